@@ -0,0 +1,110 @@
+import json
+import logging
+import os
+import resource
+import sys
+
+from sqlalchemy import Engine
+from sqlmodel import SQLModel
+
+from src.app import database as db
+
+
+def quiet_logging() -> None:
+    # Построчные логи сканера заметно искажают замеры
+    logging.getLogger("src.app").setLevel(logging.WARNING)
+
+
+def use_database(path: str) -> Engine:
+    # Модули приложения обращаются к db.engine при каждом запросе,
+    # поэтому достаточно подменить его до начала замеров
+    engine = db.create_db_engine(f"sqlite:///{path}")
+    SQLModel.metadata.create_all(engine)
+    db.engine = engine
+    db.async_engine = db.create_async_db_engine(f"sqlite:///{path}")
+    return engine
+
+
+def rss_to_mb(max_rss: int) -> float:
+    # В Linux ru_maxrss в килобайтах, в macOS в байтах
+    if sys.platform == "darwin":
+        return round(max_rss / 1024 / 1024, 1)
+    return round(max_rss / 1024, 1)
+
+
+def peak_rss_mb() -> float:
+    return rss_to_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def peak_children_rss_mb() -> float:
+    return rss_to_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    index = min(int(round(p / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def load_baseline(path: str) -> dict[str, dict[str, float]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return dict(json.load(f))
+
+
+def save_baseline(path: str, results: dict[str, dict[str, float]]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def compare_with_baseline(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    metrics: dict[str, bool],
+    tolerance: float,
+) -> list[str]:
+    # Печатает изменения относительно базовой линии и возвращает регрессии.
+    # metrics: имя метрики -> больше значит лучше
+    regressions = []
+    for case, values in results.items():
+        if case not in baseline:
+            print(f"{case}: no baseline")
+            continue
+        for name, higher_is_better in metrics.items():
+            value = values.get(name)
+            base = baseline[case].get(name)
+            if value is None or not base:
+                continue
+            change = (value - base) / base
+            worse = -change if higher_is_better else change
+            mark = " REGRESSION" if worse > tolerance else ""
+            print(f"{case} {name}: {base} -> {value} ({change:+.1%}){mark}")
+            if mark:
+                regressions.append(f"{case} {name}")
+    return regressions
+
+
+def report(
+    results: dict[str, dict[str, float]],
+    baseline_path: str,
+    save: bool,
+    metrics: dict[str, bool],
+    tolerance: float,
+) -> int:
+    print(json.dumps(results, indent=2, sort_keys=True))
+    if save:
+        baseline = load_baseline(baseline_path)
+        baseline.update(results)
+        save_baseline(baseline_path, baseline)
+        print(f"Baseline saved to {baseline_path}")
+        return 0
+
+    regressions = compare_with_baseline(
+        results, load_baseline(baseline_path), metrics, tolerance
+    )
+    return 1 if len(regressions) > 0 else 0
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any
+
+import httpx
+
+from benchmarks import common
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {"fastP99Ms": False, "slowP99Ms": False, "requestsPerSecond": True}
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), "results", "concurrency.json"
+)
+AUTH = {"u": "admin", "p": "admin"}
+
+# Тяжёлые запросы, как при пролистывании библиотеки и поиске, и лёгкие,
+# которые не должны ждать тяжёлых
+SLOW_REQUESTS = [
+    ("/rest/search3", {"query": "rive", "songCount": 200, "albumCount": 200}),
+    ("/rest/getAlbumList2", {"type": "alphabeticalByArtist", "size": 200}),
+    ("/rest/search2", {"query": "stone", "songCount": 200}),
+]
+FAST_REQUESTS = [
+    ("/rest/ping", {}),
+    ("/rest/getUser", {"username": "admin"} | AUTH),
+    ("/rest/getGenres", {}),
+    ("/rest/getSong", {"id": 1}),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return int(s.getsockname()[1])
+
+
+def start_server(db_dir: str, port: int) -> subprocess.Popen[bytes]:
+    # Путь к БД в приложении относительный, поэтому сервер запускается
+    # в каталоге с подготовленной БД
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = os.environ | {
+        "PYTHONPATH": os.pathsep.join(
+            [root]
+            + [p for p in os.environ.get("PYTHONPATH", "").split(os.pathsep) if p]
+        ),
+        "MUSIC_RITMO_PERSISTENT_DATABASE": "true",
+        "MUSIC_RITMO_SCAN_ON_STARTUP": "false",
+        "MUSIC_RITMO_MUSIC_DIRECTORIES": db_dir,
+    }
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.app.main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=db_dir,
+        env=env,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient) -> None:
+    for _ in range(600):
+        try:
+            await client.get("/rest/ping")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    requests: list[tuple[str, dict[str, Any]]],
+    offset: int,
+    deadline: float,
+    latencies: list[float],
+) -> int:
+    errors = 0
+    i = offset
+    while time.perf_counter() < deadline:
+        path, params = requests[i % len(requests)]
+        i += 1
+        start = time.perf_counter()
+        response = await client.get(path, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            errors += 1
+    return errors
+
+
+async def run_load(
+    port: int, slow_clients: int, fast_clients: int, duration: float
+) -> dict[str, float]:
+    limits = httpx.Limits(max_connections=slow_clients + fast_clients)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120
+    ) as client:
+        await wait_until_ready(client)
+        # Первые запросы прогревают кеш страниц SQLite и пулы соединений
+        for path, params in SLOW_REQUESTS + FAST_REQUESTS:
+            await client.get(path, params=params)
+
+        slow: list[float] = []
+        fast: list[float] = []
+        deadline = time.perf_counter() + duration
+        errors = await asyncio.gather(
+            *(
+                worker(client, SLOW_REQUESTS, i, deadline, slow)
+                for i in range(slow_clients)
+            ),
+            *(
+                worker(client, FAST_REQUESTS, i, deadline, fast)
+                for i in range(fast_clients)
+            ),
+        )
+
+    return {
+        "requestsPerSecond": round((len(slow) + len(fast)) / duration, 1),
+        "errors": sum(errors),
+        "slowP50Ms": round(common.percentile(slow, 50), 1),
+        "slowP99Ms": round(common.percentile(slow, 99), 1),
+        "fastP50Ms": round(common.percentile(fast, 50), 1),
+        "fastP95Ms": round(common.percentile(fast, 95), 1),
+        "fastP99Ms": round(common.percentile(fast, 99), 1),
+        "fastMaxMs": round(max(fast, default=0.0), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Latency of light requests while heavy ones are in flight"
+    )
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--slow-clients", type=int, default=4)
+    parser.add_argument("--fast-clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # БД заполняется так же, как для benchmarks.list_queries
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.list_queries",
+                "--build",
+                os.path.join(tmp_dir, "database.db"),
+                "--tracks",
+                str(args.tracks),
+            ],
+            check=True,
+        )
+        port = free_port()
+        server = start_server(tmp_dir, port)
+        try:
+            result = asyncio.run(
+                run_load(port, args.slow_clients, args.fast_clients, args.duration)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    case = f"concurrency-{args.tracks}-{args.slow_clients}x{args.fast_clients}"
+    sys.exit(
+        common.report(
+            {case: result}, args.baseline, args.save_baseline, METRICS, args.tolerance
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
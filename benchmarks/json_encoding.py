@@ -0,0 +1,108 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable
+
+from sqlmodel import Session
+
+from benchmarks import common
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {"medianMs": False}
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), "results", "json_encoding.json"
+)
+REPEATS = 5
+
+
+def responses() -> dict[str, Callable[[Session], Any]]:
+    # Самые большие ответы: указатель всех исполнителей и поиск без запроса
+    from src.app import service_layer
+    from src.app.open_subsonic_formatter import OpenSubsonicFormatter
+    from src.app.subsonic_response import SubsonicResponse
+
+    def get_indexes(session: Session) -> Any:
+        rsp = SubsonicResponse()
+        rsp.data["indexes"] = OpenSubsonicFormatter.format_indexes(
+            service_layer.IndexService(session).get_indexes_artists()
+        )
+        return {"subsonic-response": rsp.data}
+
+    def search3(session: Session) -> Any:
+        artists, albums, tracks = service_layer.SearchService(session).search3(
+            "", 0, 0, 0, 0, 0, 0
+        )
+        rsp = SubsonicResponse()
+        rsp.data["searchResult3"] = OpenSubsonicFormatter.format_combination(
+            artists.items, albums.items, tracks.items
+        )
+        return {"subsonic-response": rsp.data}
+
+    return {"getIndexes": get_indexes, "search3": search3}
+
+
+def measure(encode: Callable[[Any], bytes], content: Any) -> dict[str, float]:
+    latencies: list[float] = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        body = encode(content)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        "medianMs": round(statistics.median(latencies), 1),
+        "maxMs": round(max(latencies), 1),
+        "sizeMb": round(len(body) / 1024 / 1024, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Serialization time of large Subsonic responses"
+    )
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    from src.app import subsonic_response
+
+    common.quiet_logging()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "benchmark.db")
+        # БД заполняется так же, как для benchmarks.list_queries
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.list_queries",
+                "--build",
+                db_path,
+                "--tracks",
+                str(args.tracks),
+            ],
+            check=True,
+        )
+        engine = common.use_database(db_path)
+        for name, request in responses().items():
+            with Session(engine) as session:
+                content = request(session)
+            for encoder, encode in subsonic_response.ENCODERS.items():
+                results[f"{name}-{encoder}-{args.tracks}"] = measure(encode, content)
+        engine.dispose()
+
+    sys.exit(
+        common.report(
+            results, args.baseline, args.save_baseline, METRICS, args.tolerance
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
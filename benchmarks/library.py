@@ -0,0 +1,244 @@
+import argparse
+import os
+import random
+import struct
+
+from io import BytesIO
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import APIC, ID3, TALB, TCON, TDRC, TIT2, TPE1, TPE2, TRCK, TXXX  # type: ignore[attr-defined]
+from PIL import Image
+
+
+# Несколько кадров MPEG-1 Layer III 128 кбит/с, 44.1 кГц
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+MP3_FRAMES = 40
+
+# Стороны обложек и их доля в библиотеке, 0 - трек без обложки
+COVER_SIZES = ((0, 0.1), (300, 0.5), (600, 0.3), (1200, 0.1))
+COVER_VARIANTS = 4
+
+TRACKS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 4
+FLAC_SHARE = 0.2
+
+GENRES = [
+    "Rock",
+    "Pop",
+    "Jazz",
+    "Electronic",
+    "Hip-Hop",
+    "Classical",
+    "Metal",
+    "Folk",
+    "Blues",
+    "Ambient",
+]
+MOODS = ["calm", "energetic", "sad", "happy", "dark"]
+LANGUAGES = ["en", "ru", "de", "fr", "ja"]
+WORDS = [
+    "night",
+    "river",
+    "город",
+    "light",
+    "summer",
+    "звезда",
+    "echo",
+    "stone",
+    "dream",
+    "fire",
+    "ветер",
+    "glass",
+    "north",
+    "shadow",
+    "Émilie",
+    "Ørsted",
+]
+
+# Файл в каталоге библиотеки, по которому библиотека повторно не генерируется
+MARKER_FILE = ".benchmark-library"
+
+
+def make_covers(rng: random.Random) -> dict[int, list[bytes]]:
+    covers: dict[int, list[bytes]] = {}
+    for size, _ in COVER_SIZES:
+        if size == 0:
+            continue
+        covers[size] = []
+        for _ in range(COVER_VARIANTS):
+            # Градиент с шумом сжимается примерно как настоящая обложка
+            color = tuple(rng.randrange(256) for _ in range(3))
+            gradient = Image.linear_gradient("L").resize((size, size))
+            noise = Image.effect_noise((size, size), 40)
+            image = Image.merge(
+                "RGB",
+                [
+                    Image.blend(gradient, noise, 0.3).point(
+                        lambda v, c=c: (v + c) % 256
+                    )
+                    for c in color
+                ],
+            )
+            buf = BytesIO()
+            image.save(buf, format="JPEG", quality=85)
+            covers[size].append(buf.getvalue())
+    return covers
+
+
+def choose_cover(rng: random.Random, covers: dict[int, list[bytes]]) -> bytes | None:
+    size = rng.choices(
+        [size for size, _ in COVER_SIZES], [share for _, share in COVER_SIZES]
+    )[0]
+    if size == 0:
+        return None
+    return rng.choice(covers[size])
+
+
+def make_name(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).title()
+
+
+def write_mp3(
+    path: str,
+    tags: dict[str, list[str]],
+    custom_tags: dict[str, str],
+    cover: bytes | None,
+) -> None:
+    with open(path, "wb") as f:
+        f.write(MP3_FRAME * MP3_FRAMES)
+
+    id3 = ID3()
+    id3.add(TIT2(text=tags["title"]))
+    id3.add(TPE1(text=["; ".join(tags["artists"])]))
+    id3.add(TALB(text=tags["album"]))
+    id3.add(TPE2(text=tags["album_artist"]))
+    id3.add(TCON(text=[", ".join(tags["genres"])]))
+    id3.add(TRCK(text=tags["track_number"]))
+    id3.add(TDRC(text=tags["year"]))
+    for name, value in custom_tags.items():
+        id3.add(TXXX(desc=name, text=value))
+    if cover is not None:
+        id3.add(APIC(mime="image/jpeg", type=3, desc="3.jpeg", data=cover))
+    id3.save(path)
+
+
+def write_flac(
+    path: str,
+    tags: dict[str, list[str]],
+    custom_tags: dict[str, str],
+    cover: bytes | None,
+) -> None:
+    sample_rate, channels, bits_per_sample, total_samples = 44100, 2, 16, 441000
+    stream_info = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    stream_info += (
+        (sample_rate << 44)
+        | ((channels - 1) << 41)
+        | ((bits_per_sample - 1) << 36)
+        | total_samples
+    ).to_bytes(8, "big")
+    stream_info += b"\x00" * 16
+    with open(path, "wb") as f:
+        f.write(b"fLaC" + b"\x80" + len(stream_info).to_bytes(3, "big"))
+        f.write(stream_info)
+
+    audio = FLAC(path)
+    audio["TITLE"] = tags["title"]
+    audio["ARTIST"] = tags["artists"]
+    audio["ALBUM"] = tags["album"]
+    audio["ALBUMARTIST"] = tags["album_artist"]
+    audio["GENRE"] = tags["genres"]
+    audio["TRACKNUMBER"] = tags["track_number"]
+    audio["DATE"] = tags["year"]
+    for name, value in custom_tags.items():
+        audio[name] = value
+    if cover is not None:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = "image/jpeg"
+        picture.data = cover
+        audio.add_picture(picture)
+    audio.save()
+
+
+def generate_library(directory: str, tracks: int, seed: int = 0) -> None:
+    # Каталог artist/album/NN - title.ext, как в обычной коллекции
+    rng = random.Random(seed)
+    covers = make_covers(rng)
+    os.makedirs(directory, exist_ok=True)
+
+    written = 0
+    artist_number = 0
+    while written < tracks:
+        artist_number += 1
+        artist = f"{make_name(rng, 2)} {artist_number}"
+        for album_number in range(ALBUMS_PER_ARTIST):
+            if written >= tracks:
+                break
+            album = f"{make_name(rng, 3)} {artist_number}-{album_number}"
+            album_dir = os.path.join(directory, artist, album)
+            os.makedirs(album_dir, exist_ok=True)
+
+            compilation = rng.random() < 0.1
+            year = str(rng.randrange(1960, 2025))
+            album_genres = rng.sample(GENRES, rng.randint(1, 3))
+            cover = choose_cover(rng, covers)
+            for track_number in range(1, TRACKS_PER_ALBUM + 1):
+                if written >= tracks:
+                    break
+                artists = [artist]
+                if compilation or rng.random() < 0.2:
+                    artists.append(f"{make_name(rng, 2)} {rng.randrange(1000)}")
+                tags = {
+                    "title": [make_name(rng, rng.randint(1, 4))],
+                    "artists": artists,
+                    "album": [album],
+                    "album_artist": ["Various Artists" if compilation else artist],
+                    "genres": album_genres,
+                    "track_number": [str(track_number)],
+                    "year": [year],
+                }
+                custom_tags = {
+                    "mood": rng.choice(MOODS),
+                    "language": rng.choice(LANGUAGES),
+                }
+                if rng.random() < 0.3:
+                    custom_tags["bpm"] = str(rng.randrange(60, 180))
+
+                name = f"{track_number:02} - {tags['title'][0]}"
+                if rng.random() < FLAC_SHARE:
+                    path = os.path.join(album_dir, f"{name}.flac")
+                    write_flac(path, tags, custom_tags, cover)
+                else:
+                    path = os.path.join(album_dir, f"{name}.mp3")
+                    write_mp3(path, tags, custom_tags, cover)
+                written += 1
+
+    with open(os.path.join(directory, MARKER_FILE), "w") as f:
+        f.write(f"{tracks} {seed}\n")
+
+
+def ensure_library(directory: str, tracks: int, seed: int = 0) -> str:
+    # Сгенерированная библиотека переиспользуется между запусками
+    marker = os.path.join(directory, MARKER_FILE)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read().split() == [str(tracks), str(seed)]:
+                return directory
+        raise RuntimeError(f"{directory} contains another benchmark library")
+    if os.path.exists(directory) and len(os.listdir(directory)) > 0:
+        raise RuntimeError(f"{directory} is not empty")
+
+    generate_library(directory, tracks, seed)
+    return directory
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic music library")
+    parser.add_argument("directory")
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    ensure_library(args.directory, args.tracks, args.seed)
+
+
+if __name__ == "__main__":
+    main()
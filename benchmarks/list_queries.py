@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any, Callable
+
+from sqlalchemy import insert
+from sqlmodel import Session
+
+from benchmarks import common
+from benchmarks.library import (
+    ALBUMS_PER_ARTIST,
+    GENRES,
+    TRACKS_PER_ALBUM,
+    choose_cover,
+    make_covers,
+    make_name,
+)
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {"medianMs": False, "maxMs": False, "rssGrowthMb": False}
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), "results", "list_queries.json"
+)
+REPEATS = 5
+PAGE_SIZE = 500
+
+
+def make_previews(rng: random.Random) -> dict[int, list[bytes]]:
+    # В БД хранятся уменьшенные обложки, как их сохраняет сканер
+    from src.app import utils
+
+    return {
+        size: [utils.get_cover_preview(cover)[0] for cover in covers]
+        for size, covers in make_covers(rng).items()
+    }
+
+
+def build_database(path: str, tracks: int, seed: int = 0) -> None:
+    # Строки пишутся напрямую, без аудиофайлов: для 50 тысяч треков
+    # генерация и сканирование файлов заняли бы большую часть замера
+    from src.app import database as db
+
+    rng = random.Random(seed)
+    previews = make_previews(rng)
+    engine = common.use_database(path)
+    genre_ids = list(range(1, len(GENRES) + 1))
+
+    artists: list[dict[str, Any]] = []
+    albums: list[dict[str, Any]] = []
+    artist_albums: list[dict[str, Any]] = []
+    track_rows: list[dict[str, Any]] = []
+    artist_tracks: list[dict[str, Any]] = []
+    genre_tracks: list[dict[str, Any]] = []
+    while len(track_rows) < tracks:
+        artist_id = len(artists) + 1
+        artists.append({"id": artist_id, "name": f"{make_name(rng, 2)} {artist_id}"})
+        for _ in range(ALBUMS_PER_ARTIST):
+            album_id = len(albums) + 1
+            year = str(rng.randrange(1960, 2025))
+            cover = choose_cover(rng, previews)
+            album_genres = rng.sample(genre_ids, rng.randint(1, 3))
+            albums.append(
+                {
+                    "id": album_id,
+                    "name": f"{make_name(rng, 3)} {album_id}",
+                    "album_artist_id": artist_id,
+                    "total_tracks": TRACKS_PER_ALBUM,
+                    "year": year,
+                    "cover": cover,
+                }
+            )
+            artist_albums.append({"artist_id": artist_id, "album_id": album_id})
+            for position in range(1, TRACKS_PER_ALBUM + 1):
+                track_id = len(track_rows) + 1
+                track_rows.append(
+                    {
+                        "id": track_id,
+                        "music_folder_id": None,
+                        "file_path": f"/music/{artist_id}/{album_id}/{position}.mp3",
+                        "file_size": rng.randrange(3_000_000, 12_000_000),
+                        "type": "audio/mpeg",
+                        "title": make_name(rng, rng.randint(1, 4)),
+                        "album_id": album_id,
+                        "album_artist_id": artist_id,
+                        "album_position": position,
+                        "year": year,
+                        "plays_count": 0,
+                        "cover": cover or b"",
+                        "cover_type": "jpeg",
+                        "bit_rate": 320,
+                        "bits_per_sample": 16,
+                        "sample_rate": 44100,
+                        "channels": 2,
+                        "duration": rng.randrange(120, 400),
+                    }
+                )
+                artist_tracks.append({"artist_id": artist_id, "track_id": track_id})
+                genre_tracks.extend(
+                    {"genre_id": genre_id, "track_id": track_id}
+                    for genre_id in album_genres
+                )
+
+    with Session(engine) as session:
+        session.execute(
+            insert(db.Genre), [{"id": i, "name": n} for i, n in zip(genre_ids, GENRES)]
+        )
+        for model, rows in (
+            (db.Artist, artists),
+            (db.Album, albums),
+            (db.ArtistAlbum, artist_albums),
+            (db.Track, track_rows),
+            (db.ArtistTrack, artist_tracks),
+            (db.GenreTrack, genre_tracks),
+        ):
+            session.execute(insert(model), rows)
+        db.update_album_aggregates(session)
+        db.update_library_aggregates(session)
+        session.commit()
+    engine.dispose()
+
+
+def endpoints() -> dict[str, Callable[[Session], Any]]:
+    from src.app import service_layer
+    from src.app.service_layer import RequestType
+
+    return {
+        "search3": lambda session: service_layer.SearchService(session).search3(
+            "", 0, 0, 0, 0, 0, 0
+        ),
+        # Поиск по началу слова, как при наборе запроса в клиенте
+        "search3Text": lambda session: service_layer.SearchService(session).search3(
+            "rive", 20, 0, 20, 0, 20, 0
+        ),
+        "getIndexes": lambda session: service_layer.IndexService(
+            session
+        ).get_indexes_artists(),
+        "getAlbumList2": lambda session: service_layer.AlbumService(
+            session
+        ).get_album_list(RequestType.BY_NAME, PAGE_SIZE),
+        "getRandomSongs": lambda session: service_layer.TrackService(
+            session
+        ).get_random_songs(PAGE_SIZE),
+        "getSongsByGenre": lambda session: service_layer.TrackService(
+            session
+        ).get_songs_by_genre(GENRES[0], PAGE_SIZE),
+    }
+
+
+def measure(db_path: str, endpoint: str) -> dict[str, float]:
+    # Каждый запрос замеряется в своём процессе, чтобы рост памяти
+    # относился только к нему
+    common.quiet_logging()
+    engine = common.use_database(db_path)
+    request = endpoints()[endpoint]
+
+    rss_before = common.peak_rss_mb()
+    latencies: list[float] = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        with Session(engine) as session:
+            request(session)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "medianMs": round(statistics.median(latencies), 1),
+        "maxMs": round(max(latencies), 1),
+        "rssGrowthMb": round(common.peak_rss_mb() - rss_before, 1),
+        "peakRssMb": common.peak_rss_mb(),
+    }
+
+
+def run_isolated(db_path: str, endpoint: str) -> dict[str, float]:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.list_queries",
+            "--run-one",
+            db_path,
+            "--endpoint",
+            endpoint,
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return dict(json.loads(output.splitlines()[-1]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Latency and memory of list endpoints on a large database"
+    )
+    parser.add_argument("--tracks", type=int, default=50000)
+    parser.add_argument("--endpoints", nargs="+", default=None)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--endpoint", help=argparse.SUPPRESS)
+    parser.add_argument("--build", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(measure(args.run_one, args.endpoint)))
+        return
+    if args.build is not None:
+        build_database(args.build, args.tracks)
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "benchmark.db")
+        # Пиковая память наследуется дочерними процессами, поэтому БД
+        # заполняется не в том процессе, который запускает замеры
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.list_queries",
+                "--build",
+                db_path,
+                "--tracks",
+                str(args.tracks),
+            ],
+            check=True,
+        )
+        for endpoint in args.endpoints or list(endpoints()):
+            results[f"{endpoint}-{args.tracks}"] = run_isolated(db_path, endpoint)
+
+    sys.exit(
+        common.report(
+            results, args.baseline, args.save_baseline, METRICS, args.tolerance
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Any
+
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, func, select
+
+from benchmarks import common
+from benchmarks.library import ensure_library
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {"p50Ms": False, "p95Ms": False, "p99Ms": False, "errors": False}
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), "results", "read_latency.json"
+)
+PROFILES = {"default": "false", "tuned": "true"}
+
+
+def write(library: str, db_path: str, workers: int, ready: Any) -> None:
+    # Файлы разбираются заранее, чтобы замер приходился на запись в БД,
+    # как при сканировании, когда БД не успевает за пулом процессов
+    from sqlmodel import Session
+
+    from src.app import db_loading
+
+    common.quiet_logging()
+    engine = common.use_database(db_path)
+    audio_files = list(db_loading.scan_audio_files(library, workers))
+    ready.set()
+    with Session(engine) as session:
+        with db_loading.AudioDataLoader(session, preload=True) as loader:
+            for audio_info in audio_files:
+                loader.add(audio_info)
+
+
+def read_while_writing(library: str, workers: int) -> dict[str, float]:
+    from src.app import database as db
+    from src.app import db_helpers
+    from src.app import db_loading
+
+    common.quiet_logging()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "benchmark.db")
+        engine = common.use_database(db_path)
+        db_loading.scan_and_load([library], workers)
+        with Session(engine) as session:
+            track_count = session.exec(select(func.count(db.Track.id))).one()
+            album_count = session.exec(select(func.count(db.Album.id))).one()
+        engine.dispose()
+
+        context = multiprocessing.get_context("spawn")
+        ready = context.Event()
+        writer = context.Process(target=write, args=(library, db_path, workers, ready))
+        writer.start()
+        ready.wait()
+
+        # Запросы, похожие на просмотр библиотеки клиентом
+        rng = random.Random(0)
+        latencies: list[float] = []
+        errors = 0
+        writer_start = time.perf_counter()
+        while writer.is_alive():
+            start = time.perf_counter()
+            try:
+                with Session(engine) as session:
+                    match len(latencies) % 3:
+                        case 0:
+                            db_helpers.TrackDBHelper(session).get_track_by_id(
+                                rng.randint(1, track_count)
+                            )
+                        case 1:
+                            db_helpers.AlbumDBHelper(session).get_albums_by_name(
+                                50, rng.randrange(max(album_count - 50, 1))
+                            )
+                        case _:
+                            db_helpers.ArtistDBHelper(session).get_artists(
+                                50, 0, rng.choice("aeiou")
+                            )
+            except OperationalError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+        writer_elapsed = time.perf_counter() - writer_start
+        writer.join()
+
+    return {
+        "queries": len(latencies),
+        "errors": errors,
+        "p50Ms": round(common.percentile(latencies, 50), 3),
+        "p95Ms": round(common.percentile(latencies, 95), 3),
+        "p99Ms": round(common.percentile(latencies, 99), 3),
+        "maxMs": round(max(latencies, default=0.0), 3),
+        "writerElapsed": round(writer_elapsed, 3),
+    }
+
+
+def run_isolated(library: str, workers: int, profile: str) -> dict[str, float]:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.read_latency",
+            "--run-one",
+            library,
+            "--workers",
+            str(workers),
+        ],
+        env=os.environ | {"MUSIC_RITMO_SQLITE_TUNING": PROFILES[profile]},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return dict(json.loads(output.splitlines()[-1]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Read latency while the scanner is writing to the database"
+    )
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--profiles", nargs="+", default=list(PROFILES))
+    parser.add_argument("--library-dir", default="./benchmark-libraries")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(read_while_writing(args.run_one, args.workers)))
+        return
+
+    library = ensure_library(
+        os.path.join(args.library_dir, str(args.tracks)), args.tracks
+    )
+    results = {
+        f"read-latency-{args.tracks}-{profile}": run_isolated(
+            library, args.workers, profile
+        )
+        for profile in args.profiles
+    }
+    sys.exit(
+        common.report(
+            results, args.baseline, args.save_baseline, METRICS, args.tolerance
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import common
+from benchmarks.library import ensure_library
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {
+    "elapsed": False,
+    "filesPerSecond": True,
+    "rescanElapsed": False,
+    "peakRssMb": False,
+    "peakWorkerRssMb": False,
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "results", "scan.json")
+
+
+def run_scan(library: str, workers: int) -> dict[str, float]:
+    # Выполняется в отдельном процессе, чтобы пиковая память относилась
+    # только к сканированию, а не к генерации библиотеки
+    from src.app import db_loading
+
+    common.quiet_logging()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        common.use_database(os.path.join(tmp_dir, "benchmark.db"))
+
+        start = time.perf_counter()
+        db_loading.scan_and_load([library], workers)
+        elapsed = time.perf_counter() - start
+        status = db_loading.scanStatus.to_dict()
+
+        # Повторное сканирование без изменений проверяет только отпечатки файлов
+        start = time.perf_counter()
+        db_loading.scan_and_load([library], workers)
+        rescan_elapsed = time.perf_counter() - start
+        rescan_status = db_loading.scanStatus.to_dict()
+
+    result = {
+        "elapsed": round(elapsed, 3),
+        "filesPerSecond": round(status["parsed"] / elapsed, 1),
+        "parsed": status["parsed"],
+        "failed": status["failed"],
+        "rescanElapsed": round(rescan_elapsed, 3),
+        "rescanFilesPerSecond": round(rescan_status["skipped"] / rescan_elapsed, 1),
+        "peakRssMb": common.peak_rss_mb(),
+        "peakWorkerRssMb": common.peak_children_rss_mb(),
+    }
+    for phase, seconds in status["phaseTimes"].items():
+        result[f"{phase}Seconds"] = seconds
+    return result
+
+
+def run_isolated(library: str, workers: int) -> dict[str, float]:
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.scan",
+            "--run-one",
+            library,
+            "--workers",
+            str(workers),
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return dict(json.loads(output.splitlines()[-1]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Library scan benchmark")
+    parser.add_argument("--tracks", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--library-dir", default="./benchmark-libraries")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one is not None:
+        print(json.dumps(run_scan(args.run_one, args.workers)))
+        return
+
+    results = {}
+    for tracks in args.tracks:
+        library = ensure_library(os.path.join(args.library_dir, str(tracks)), tracks)
+        results[f"scan-{tracks}-w{args.workers}"] = run_isolated(library, args.workers)
+
+    sys.exit(
+        common.report(
+            results,
+            args.baseline,
+            args.save_baseline,
+            METRICS,
+            args.tolerance,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
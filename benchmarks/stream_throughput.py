@@ -0,0 +1,173 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks import common
+from benchmarks.concurrency import free_port, start_server, wait_until_ready
+
+
+# Метрики, по которым ищутся регрессии: имя -> больше значит лучше
+METRICS = {"throughputMbPerSecond": True, "seekP99Ms": False}
+DEFAULT_BASELINE = os.path.join(
+    os.path.dirname(__file__), "results", "stream_throughput.json"
+)
+# Столько байт плеер запрашивает после перемотки, прежде чем начать играть
+SEEK_BYTES = 256 * 1024
+
+
+def make_track_files(db_path: str, directory: str, count: int, size_mb: int) -> None:
+    # Содержимое файлов не важно, отдаются они как есть
+    rng = random.Random(0)
+    with sqlite3.connect(db_path) as connection:
+        for track_id in range(1, count + 1):
+            path = os.path.join(directory, f"{track_id}.flac")
+            with open(path, "wb") as f:
+                f.write(rng.randbytes(size_mb * 1024 * 1024))
+            connection.execute(
+                'UPDATE "Tracks" SET file_path = ?, file_size = ?, type = ? '
+                "WHERE id = ?",
+                (path, size_mb * 1024 * 1024, "audio/flac", track_id),
+            )
+
+
+async def player(
+    client: httpx.AsyncClient, files: int, offset: int, deadline: float
+) -> tuple[int, int]:
+    # Слушает треки целиком, один за другим
+    received = errors = 0
+    i = offset
+    while time.perf_counter() < deadline:
+        params = {"id": i % files + 1}
+        i += 1
+        async with client.stream("GET", "/rest/stream", params=params) as response:
+            async for chunk in response.aiter_raw():
+                received += len(chunk)
+        if response.status_code != 200:
+            errors += 1
+    return received, errors
+
+
+async def seeker(
+    client: httpx.AsyncClient,
+    files: int,
+    file_size: int,
+    deadline: float,
+    latencies: list[float],
+    rng: random.Random,
+) -> tuple[int, int]:
+    # Перематывает случайный трек на случайное место
+    received = errors = 0
+    while time.perf_counter() < deadline:
+        start_byte = rng.randrange(file_size - SEEK_BYTES)
+        headers = {"Range": f"bytes={start_byte}-{start_byte + SEEK_BYTES - 1}"}
+        start = time.perf_counter()
+        response = await client.get(
+            "/rest/stream", params={"id": rng.randrange(files) + 1}, headers=headers
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        received += len(response.content)
+        if response.status_code != 206 or len(response.content) != SEEK_BYTES:
+            errors += 1
+    return received, errors
+
+
+async def run_load(
+    port: int, files: int, file_size: int, players: int, seekers: int, duration: float
+) -> dict[str, float]:
+    limits = httpx.Limits(max_connections=players + seekers)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120
+    ) as client:
+        await wait_until_ready(client)
+        # Первые запросы прогревают кеш страниц с файлами
+        for track_id in range(1, files + 1):
+            await client.get("/rest/stream", params={"id": track_id})
+
+        seeks: list[float] = []
+        started = time.perf_counter()
+        deadline = started + duration
+        results = await asyncio.gather(
+            *(player(client, files, i, deadline) for i in range(players)),
+            *(
+                seeker(client, files, file_size, deadline, seeks, random.Random(i))
+                for i in range(seekers)
+            ),
+        )
+        elapsed = time.perf_counter() - started
+
+    received = sum(r[0] for r in results)
+    return {
+        "throughputMbPerSecond": round(received / 1024 / 1024 / elapsed, 1),
+        "errors": sum(r[1] for r in results),
+        "seeks": len(seeks),
+        "seekP50Ms": round(common.percentile(seeks, 50), 1),
+        "seekP99Ms": round(common.percentile(seeks, 99), 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Throughput of concurrent /rest/stream downloads and seeks"
+    )
+    parser.add_argument("--tracks", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--file-size-mb", type=int, default=32)
+    parser.add_argument("--players", type=int, default=8)
+    parser.add_argument("--seekers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "database.db")
+        # БД заполняется так же, как для benchmarks.list_queries
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.list_queries",
+                "--build",
+                db_path,
+                "--tracks",
+                str(args.tracks),
+            ],
+            check=True,
+        )
+        make_track_files(db_path, tmp_dir, args.files, args.file_size_mb)
+        port = free_port()
+        server = start_server(tmp_dir, port)
+        try:
+            result = asyncio.run(
+                run_load(
+                    port,
+                    args.files,
+                    args.file_size_mb * 1024 * 1024,
+                    args.players,
+                    args.seekers,
+                    args.duration,
+                )
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    case = f"stream-{args.file_size_mb}mb-{args.players}x{args.seekers}"
+    sys.exit(
+        common.report(
+            {case: result}, args.baseline, args.save_baseline, METRICS, args.tolerance
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
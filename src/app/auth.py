@@ -5,8 +5,8 @@ from . import database as db
 
 
 def authenticate_user(
-    u: str = Query(None),
-    p: str = Query(None),
+    u: str | None = Query(None),
+    p: str | None = Query(None),
     session: Session = Depends(db.get_session),
 ) -> db.User:
     user = session.exec(select(db.User).where(db.User.login == u)).first()
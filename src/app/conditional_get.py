@@ -0,0 +1,113 @@
+from datetime import datetime
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any
+from urllib.parse import parse_qs
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+
+from . import database as db
+from .response_cache import PLAY_COUNT_PATHS, response_cache, response_version
+
+
+# Ответы этих эндпоинтов зависят только от параметров запроса и данных в БД,
+# поэтому не меняются, пока не изменилась версия библиотеки
+# (и версия прослушиваний для PLAY_COUNT_PATHS)
+VERSIONED_PATHS = {
+    "/rest/getIndexes",
+    "/rest/getArtists",
+    "/rest/getArtist",
+    "/rest/getAlbum",
+    "/rest/getSong",
+    "/rest/getGenres",
+    "/rest/getSongsByGenre",
+    "/rest/getAlbumList",
+    "/rest/getAlbumList2",
+    "/rest/search2",
+    "/rest/search3",
+    "/rest/getPlaylists",
+    "/rest/getPlaylist",
+    "/rest/getStarred",
+    "/rest/getStarred2",
+    "/rest/getMusicFolders",
+    "/rest/getLyricsBySongId",
+    "/specific/getSortedArtistAlbums",
+    "/specific/getTags",
+}
+
+
+def is_versioned(scope: Any) -> bool:
+    if scope["method"] not in ("GET", "HEAD") or scope["path"] not in VERSIONED_PATHS:
+        return False
+    # Случайные альбомы разные при каждом запросе
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return "random" not in query.get("type", [])
+
+
+def modified_at(path: str, state: db.LibraryState) -> datetime:
+    if path in PLAY_COUNT_PATHS:
+        return state.plays_modified_at()
+    return state.modified_at()
+
+
+def make_etag(path: str, state: db.LibraryState) -> str:
+    # Время изменения отличает версии разных БД, например после init_db
+    stamp = int(modified_at(path, state).timestamp() * 1000)
+    version, plays_version = response_version(path, state)
+    return f'"{version}.{plays_version}-{stamp}"'
+
+
+def is_not_modified(
+    headers: Headers, etag: str, state: db.LibraryState, modified: datetime
+) -> bool:
+    # If-None-Match важнее If-Modified-Since (RFC 9110, 13.2.2)
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is None or state.version == 0:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # Last-Modified передаётся с точностью до секунды
+    return int(modified.timestamp()) <= since.timestamp()
+
+
+class ConditionalGetMiddleware:
+    # Отвечает 304 без вызова эндпоинта, если у клиента ответ той же версии
+    # библиотеки, и добавляет ETag и Last-Modified к остальным ответам
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or not is_versioned(scope):
+            await self.app(scope, receive, send)
+            return
+
+        state = await response_cache.library_state()
+        etag = make_etag(scope["path"], state)
+        modified = modified_at(scope["path"], state)
+        validators = {
+            "etag": etag,
+            "last-modified": format_datetime(modified, usegmt=True),
+            # Клиент может хранить ответ, но проверяет его при каждом запросе
+            "cache-control": "no-cache",
+        }
+
+        if is_not_modified(Headers(scope=scope), etag, state, modified):
+            await Response(status_code=304, headers=validators)(scope, receive, send)
+            return
+
+        async def send_with_validators(message: Any) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (name.encode(), value.encode())
+                    for name, value in validators.items()
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_with_validators)
@@ -0,0 +1,104 @@
+import os
+
+
+def get_int_env(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def get_float_env(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def get_list_env(name: str, default: list[str]) -> list[str]:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return [item.strip() for item in value.split(os.pathsep) if item.strip() != ""]
+
+
+def get_bool_env(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Сохранять БД между перезапусками и сканировать библиотеку в фоне
+PERSISTENT_DATABASE = get_bool_env("MUSIC_RITMO_PERSISTENT_DATABASE", False)
+
+# Сканировать библиотеку при запуске приложения
+SCAN_ON_STARTUP = get_bool_env("MUSIC_RITMO_SCAN_ON_STARTUP", True)
+
+MUSIC_DIRECTORY = os.environ.get("MUSIC_RITMO_MUSIC_DIRECTORY", "./tracks/")
+
+# Каталоги с музыкой через ":" (";" в Windows), каждый обходится отдельным потоком
+MUSIC_DIRECTORIES = get_list_env("MUSIC_RITMO_MUSIC_DIRECTORIES", [MUSIC_DIRECTORY])
+
+# 0 - по числу ядер, 1 - последовательное сканирование без пула процессов
+SCAN_WORKERS = get_int_env("MUSIC_RITMO_SCAN_WORKERS", 0)
+
+# Число файлов, записываемых в БД одной транзакцией
+SCAN_BATCH_SIZE = get_int_env("MUSIC_RITMO_SCAN_BATCH_SIZE", 200)
+
+# Число разобранных, но ещё не записанных в БД файлов
+SCAN_QUEUE_SIZE = get_int_env("MUSIC_RITMO_SCAN_QUEUE_SIZE", 256)
+
+# Отслеживать изменения в каталоге с музыкой через inotify (только Linux)
+WATCH_MUSIC_DIRECTORY = get_bool_env("MUSIC_RITMO_WATCH_MUSIC_DIRECTORY", False)
+
+# Сколько секунд каталог должен быть неизменным, прежде чем изменения попадут в БД
+WATCH_DEBOUNCE_SECONDS = get_float_env("MUSIC_RITMO_WATCH_DEBOUNCE_SECONDS", 2.0)
+
+# Профиль SQLite: WAL, synchronous=NORMAL, temp_store=MEMORY и настройки ниже
+SQLITE_TUNING = get_bool_env("MUSIC_RITMO_SQLITE_TUNING", True)
+
+# Размер отображаемой в память части файла БД в байтах
+SQLITE_MMAP_SIZE = get_int_env("MUSIC_RITMO_SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+
+# Размер кеша страниц на одно соединение в килобайтах
+SQLITE_CACHE_SIZE_KB = get_int_env("MUSIC_RITMO_SQLITE_CACHE_SIZE_KB", 64 * 1024)
+
+# Сколько миллисекунд ждать, пока другое соединение держит блокировку записи
+SQLITE_BUSY_TIMEOUT_MS = get_int_env("MUSIC_RITMO_SQLITE_BUSY_TIMEOUT_MS", 5000)
+
+# Потоков для синхронных эндпоинтов и зависимостей FastAPI (в anyio по умолчанию 40)
+THREADPOOL_SIZE = get_int_env("MUSIC_RITMO_THREADPOOL_SIZE", 40)
+
+# Соединений с БД у синхронных эндпоинтов, сканера и наблюдателя за каталогом
+DB_POOL_SIZE = get_int_env("MUSIC_RITMO_DB_POOL_SIZE", 16)
+
+# Соединений с БД у асинхронных эндпоинтов, у каждого соединения aiosqlite свой поток
+ASYNC_DB_POOL_SIZE = get_int_env("MUSIC_RITMO_ASYNC_DB_POOL_SIZE", 8)
+
+# Прослушивания копятся в памяти и записываются в БД раз в столько секунд
+SCROBBLE_FLUSH_SECONDS = get_float_env("MUSIC_RITMO_SCROBBLE_FLUSH_SECONDS", 10.0)
+
+# Столько накопленных прослушиваний записываются, не дожидаясь интервала
+SCROBBLE_BUFFER_SIZE = get_int_env("MUSIC_RITMO_SCROBBLE_BUFFER_SIZE", 500)
+
+# Добавлять к ответам заголовки X-DB-* с числом и временем SQL-запросов
+SQL_DEBUG_HEADERS = get_bool_env("MUSIC_RITMO_SQL_DEBUG_HEADERS", False)
+
+# Запросы дольше стольких миллисекунд пишутся в лог (0 — не писать)
+SLOW_QUERY_MS = get_float_env("MUSIC_RITMO_SLOW_QUERY_MS", 200.0)
+
+# Кодировщик ответов Subsonic API: orjson (если установлен) или json
+JSON_ENCODER = os.environ.get("MUSIC_RITMO_JSON_ENCODER", "orjson")
+
+# Память под кеш ответов эндпоинтов просмотра в мегабайтах (0 — без кеша)
+RESPONSE_CACHE_MB = get_int_env("MUSIC_RITMO_RESPONSE_CACHE_MB", 64)
+
+# Артикли через пробел, которые не учитываются при сортировке исполнителей
+IGNORED_ARTICLES = os.environ.get(
+    "MUSIC_RITMO_IGNORED_ARTICLES", "The El La Los Las Le Les"
+).split()
+
+# Размер куска в килобайтах, которыми читается файл при отдаче трека,
+# если сервер не умеет отправлять файлы сам через sendfile
+STREAM_CHUNK_KB = get_int_env("MUSIC_RITMO_STREAM_CHUNK_KB", 256)
@@ -1,8 +1,95 @@
-from typing import Any, Generator
-from sqlmodel import SQLModel, Session, create_engine, Field, Relationship
+import logging
+from datetime import datetime, timezone
+from itertools import chain
+from typing import (
+    Any,
+    AsyncGenerator,
+    Awaitable,
+    Callable,
+    Generator,
+    Iterable,
+    TypeVar,
+    cast,
+)
+from sqlalchemy import (
+    Connection,
+    Engine,
+    Index,
+    Integer,
+    delete,
+    event,
+    func,
+    insert,
+    inspect,
+    text,
+    make_url,
+    update,
+)
+from sqlalchemy import cast as sql_cast
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.orm import ORMExecuteState
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlmodel import SQLModel, Session, col, create_engine, Field, Relationship, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import config
+from .sql_stats import instrument_engine
 
 DATABASE_URL = "sqlite:///database.db"
-engine = create_engine(DATABASE_URL, echo=False)
+
+T = TypeVar("T")
+
+
+def set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    # В режиме WAL запросы читают БД, пока сканер пишет в неё, а
+    # synchronous=NORMAL делает fsync только при переносе журнала в файл БД
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA mmap_size={config.SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{config.SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA busy_timeout={config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def create_db_engine(url: str = DATABASE_URL) -> Engine:
+    engine = create_engine(
+        url, echo=False, pool_size=config.DB_POOL_SIZE, max_overflow=0
+    )
+    if config.SQLITE_TUNING:
+        event.listen(engine, "connect", set_sqlite_pragmas)
+    instrument_engine(engine)
+    return engine
+
+
+# Асинхронные эндпоинты работают с той же БД через aiosqlite: запрос
+# выполняется в потоке соединения, а цикл событий обслуживает другие запросы
+def create_async_db_engine(url: str = DATABASE_URL) -> AsyncEngine:
+    # Для файловой БД aiosqlite по умолчанию открывает новое соединение
+    # (и поток) на каждый запрос, пул держит их открытыми
+    engine = create_async_engine(
+        make_url(url).set(drivername="sqlite+aiosqlite"),
+        echo=False,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=config.ASYNC_DB_POOL_SIZE,
+        max_overflow=0,
+    )
+    if config.SQLITE_TUNING:
+        event.listen(engine.sync_engine, "connect", set_sqlite_pragmas)
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+engine = create_db_engine()
+async_engine = create_async_db_engine()
+
+# aiosqlite пишет в DEBUG каждый вызов в потоке соединения
+logging.getLogger("aiosqlite").setLevel(logging.INFO)
+
+
+logger = logging.getLogger(__name__)
 
 
 def init_db() -> None:
@@ -10,32 +97,421 @@ def init_db() -> None:
     SQLModel.metadata.create_all(engine)
 
 
+def upgrade_db() -> None:
+    # Создаёт недостающие таблицы и столбцы, не трогая существующие данные
+    existing_tables = set(inspect(engine).get_table_names())
+    SQLModel.metadata.create_all(engine)
+    schema_changed = len(set(SQLModel.metadata.tables) - existing_tables) > 0
+
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in SQLModel.metadata.sorted_tables:
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                # SQLite не добавляет NOT NULL столбцы без значения по умолчанию,
+                # поэтому в старых строках новые столбцы остаются NULL
+                column_type = column.type.compile(engine.dialect)
+                connection.execute(
+                    text(
+                        f'ALTER TABLE "{table.name}" '
+                        f'ADD COLUMN "{column.name}" {column_type}'
+                    )
+                )
+                logger.info(f"Added column {table.name}.{column.name}")
+                schema_changed = True
+
+            # create_all не создаёт индексы у уже существующих таблиц
+            existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    logger.info(f"Created index {index.name}")
+
+    # Новые агрегатные столбцы и таблицы заполняются по уже загруженной библиотеке
+    if schema_changed:
+        with Session(engine) as session:
+            update_album_aggregates(session)
+            update_library_aggregates(session)
+            session.commit()
+        logger.info("Recalculated library aggregates")
+
+    # Указатель исполнителей перестраивается, только если изменились
+    # IGNORED_ARTICLES с прошлого запуска
+    articles = " ".join(config.IGNORED_ARTICLES)
+    with Session(engine) as session:
+        if get_library_state(session).ignored_articles != articles:
+            update_artist_index(session, rebuild=True)
+            save_ignored_articles(session, articles)
+            session.commit()
+            logger.info("Rebuilt artist index")
+
+
+def optimize_db() -> None:
+    # Обновляет статистику планировщика запросов по изменившимся таблицам
+    # и новым индексам. SQLite советует делать это перед закрытием соединений,
+    # analysis_limit ограничивает время анализа больших таблиц
+    with engine.begin() as connection:
+        connection.execute(text("PRAGMA analysis_limit=400"))
+        connection.execute(text("PRAGMA optimize=0x10002"))
+
+
+# Число треков, длительность и жанры альбомов, счётчики жанров и исполнителей
+# и длительность плейлистов хранятся в их строках, чтобы списки не загружали
+# треки. Пересчитываются там, где меняются треки и плейлисты
+def total_duration() -> Any:
+    # Длительности треков от mutagen дробные, а Subsonic отдаёт целые секунды
+    return sql_cast(func.coalesce(func.sum(Track.duration), 0), Integer)
+
+
+def update_album_aggregates(
+    session: Session, album_ids: Iterable[int] | None = None
+) -> None:
+    albums = update(Album).values(
+        total_tracks=select(func.count())
+        .where(col(Track.album_id) == Album.id)
+        .scalar_subquery(),
+        duration=select(total_duration())
+        .where(col(Track.album_id) == Album.id)
+        .scalar_subquery(),
+    )
+    genre_albums = delete(GenreAlbum)
+    album_genres = (
+        select(GenreTrack.genre_id, Track.album_id)
+        .join(Track, col(Track.id) == GenreTrack.track_id)
+        .where(col(Track.album_id).is_not(None))
+        .distinct()
+    )
+    if album_ids is not None:
+        album_ids = list(album_ids)
+        if len(album_ids) == 0:
+            return
+        albums = albums.where(col(Album.id).in_(album_ids))
+        genre_albums = genre_albums.where(col(GenreAlbum.album_id).in_(album_ids))
+        album_genres = album_genres.where(col(Track.album_id).in_(album_ids))
+
+    session.execute(albums)
+    session.execute(genre_albums)
+    session.execute(
+        insert(GenreAlbum).from_select(["genre_id", "album_id"], album_genres)
+    )
+
+
+def update_playlist_aggregates(
+    session: Session, playlist_ids: Iterable[int] | None = None
+) -> None:
+    playlists = update(Playlist).values(
+        total_tracks=select(func.count())
+        .where(col(PlaylistTrack.playlist_id) == Playlist.id)
+        .scalar_subquery(),
+        duration=select(total_duration())
+        .join(PlaylistTrack, col(PlaylistTrack.track_id) == Track.id)
+        .where(col(PlaylistTrack.playlist_id) == Playlist.id)
+        .scalar_subquery(),
+    )
+    if playlist_ids is not None:
+        playlists = playlists.where(col(Playlist.id).in_(list(playlist_ids)))
+    session.execute(playlists)
+
+
+def update_library_aggregates(session: Session) -> None:
+    # Несколько запросов по индексам связующих таблиц, поэтому
+    # выполняется целиком в конце загрузки, а не на каждую пачку треков
+    session.execute(
+        update(Genre).values(
+            song_count=select(func.count())
+            .where(col(GenreTrack.genre_id) == Genre.id)
+            .scalar_subquery(),
+            album_count=select(func.count())
+            .where(col(GenreAlbum.genre_id) == Genre.id)
+            .scalar_subquery(),
+        )
+    )
+    session.execute(
+        update(Artist).values(
+            album_count=select(func.count())
+            .where(col(ArtistAlbum.artist_id) == Artist.id)
+            .scalar_subquery()
+        )
+    )
+    update_playlist_aggregates(session)
+    update_artist_index(session)
+
+
+def artist_index_key(name: str) -> tuple[str, str]:
+    # Буква указателя и ключ сортировки без артикля из IGNORED_ARTICLES:
+    # "The Beatles" попадает в B. Считаются в Python, потому что lower и
+    # upper в SQLite понимают только ASCII
+    sort_name = normalize_search_text(name.strip()).casefold()
+    for article in config.IGNORED_ARTICLES:
+        prefix = f"{article.casefold()} "
+        if sort_name.startswith(prefix) and len(sort_name) > len(prefix):
+            sort_name = sort_name[len(prefix) :].lstrip()
+            break
+    letter = sort_name[:1].upper()
+    return (letter if letter.isalpha() else "#"), sort_name
+
+
+def update_artist_index(session: Session, rebuild: bool = False) -> None:
+    # Обычно пересчитываются только новые исполнители, целиком указатель
+    # перестраивается при запуске, если изменились IGNORED_ARTICLES
+    query = select(Artist.id, Artist.name, Artist.index_letter, Artist.sort_name)
+    if not rebuild:
+        query = query.where(col(Artist.sort_name).is_(None))
+    rows = []
+    for id, name, index_letter, sort_name in session.exec(query):
+        letter, key = artist_index_key(name)
+        if (letter, key) != (index_letter, sort_name):
+            rows.append({"id": id, "index_letter": letter, "sort_name": key})
+    if len(rows) > 0:
+        session.execute(update(Artist), rows)
+
+
+# Версия библиотеки растёт с каждой транзакцией, изменившей данные, которые
+# видны в ответах API: сканирование, теги, плейлисты, избранное.
+# По ней отвечают на ifModifiedSince и условные GET-запросы.
+# Прослушивания меняют только счётчики треков и увеличивают свою версию,
+# чтобы каждый scrobble не сбрасывал кеш всей библиотеки
+UNVERSIONED_TABLES = {"ScanCheckpoints", "LibraryState", "PlayHistory", "Users"}
+LIBRARY_STATE_ID = 1
+
+
+def initial_library_state() -> "LibraryState":
+    return LibraryState(
+        id=LIBRARY_STATE_ID,
+        version=0,
+        updated_at=str(datetime.fromtimestamp(0, timezone.utc)),
+    )
+
+
+def get_library_state(session: Session) -> "LibraryState":
+    return session.get(LibraryState, LIBRARY_STATE_ID) or initial_library_state()
+
+
+def bump_library_version(session: Session) -> None:
+    now = str(datetime.now(timezone.utc))
+    session.execute(
+        sqlite_insert(LibraryState)
+        .values(id=LIBRARY_STATE_ID, version=1, updated_at=now)
+        .on_conflict_do_update(
+            index_elements=["id"],
+            set_={"version": col(LibraryState.version) + 1, "updated_at": now},
+        )
+    )
+
+
+def bump_plays_version(session: Session) -> None:
+    state = initial_library_state()
+    now = str(datetime.now(timezone.utc))
+    session.execute(
+        sqlite_insert(LibraryState)
+        .values(
+            id=state.id,
+            version=state.version,
+            updated_at=state.updated_at,
+            plays_version=1,
+            plays_updated_at=now,
+        )
+        .on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "plays_version": func.coalesce(col(LibraryState.plays_version), 0) + 1,
+                "plays_updated_at": now,
+            },
+        )
+    )
+
+
+def save_ignored_articles(session: Session, articles: str) -> None:
+    state = initial_library_state()
+    session.execute(
+        sqlite_insert(LibraryState)
+        .values(
+            id=state.id,
+            version=state.version,
+            updated_at=state.updated_at,
+            ignored_articles=articles,
+        )
+        .on_conflict_do_update(
+            index_elements=["id"], set_={"ignored_articles": articles}
+        )
+    )
+
+
+def mark_library_changed(session: Session, flush_context: Any) -> None:
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if getattr(obj, "__tablename__", None) not in UNVERSIONED_TABLES:
+            session.info["library_changed"] = True
+            return
+
+
+def mark_library_dml(state: ORMExecuteState) -> None:
+    # Массовые INSERT/UPDATE/DELETE сканера проходят мимо flush
+    if state.is_insert or state.is_update or state.is_delete:
+        table = getattr(state.statement, "table", None)
+        if table is not None and table.name not in UNVERSIONED_TABLES:
+            state.session.info["library_changed"] = True
+
+
+def bump_library_version_on_commit(session: Session) -> None:
+    # Версия меняется в той же транзакции, что и данные
+    session.flush()
+    if session.info.pop("library_changed", False):
+        bump_library_version(session)
+        session.info["library_version_bumped"] = True
+    if session.info.pop("plays_changed", False):
+        bump_plays_version(session)
+        session.info["plays_version_bumped"] = True
+
+
+def forget_library_changes(session: Session, *args: Any) -> None:
+    for key in (
+        "library_changed",
+        "library_version_bumped",
+        "plays_changed",
+        "plays_version_bumped",
+    ):
+        session.info.pop(key, None)
+
+
+event.listen(Session, "after_flush", mark_library_changed)
+event.listen(Session, "do_orm_execute", mark_library_dml)
+event.listen(Session, "before_commit", bump_library_version_on_commit)
+event.listen(Session, "after_rollback", forget_library_changes)
+
+
+# Полнотекстовый поиск: на каждую сущность своя таблица FTS5 с названием.
+# unicode61 приводит к одному регистру буквы любых алфавитов и убирает
+# диакритику, но ё и е для него разные буквы, поэтому ё заменяется заранее.
+# Таблицы без содержимого (content=''), индекс обновляют триггеры
+SEARCH_COLUMNS = {"Artists": "name", "Albums": "name", "Tracks": "title"}
+
+
+def search_table_name(table: str) -> str:
+    return f"{table}_Search"
+
+
+def normalize_search_text(value: str) -> str:
+    return value.replace("ё", "е").replace("Ё", "Е")
+
+
+def normalize_search_sql(value: str) -> str:
+    return f"replace(replace({value}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_search_indexes(target: Any, connection: Connection, **kw: Any) -> None:
+    existing_tables = set(inspect(connection).get_table_names())
+    for table, column in SEARCH_COLUMNS.items():
+        search_table = search_table_name(table)
+        if search_table not in existing_tables:
+            connection.execute(
+                text(
+                    f'CREATE VIRTUAL TABLE "{search_table}" USING fts5("{column}", '
+                    "content='', tokenize='unicode61 remove_diacritics 2', "
+                    "prefix='2 3')"
+                )
+            )
+            connection.execute(
+                text(
+                    f'INSERT INTO "{search_table}" (rowid, "{column}") '
+                    f'SELECT id, {normalize_search_sql(column)} FROM "{table}"'
+                )
+            )
+            logger.info(f"Created search index {search_table}")
+
+        insert_row = (
+            f'INSERT INTO "{search_table}" (rowid, "{column}") '
+            f"VALUES (new.id, {normalize_search_sql('new.' + column)});"
+        )
+        # Из таблицы без содержимого строка удаляется командой 'delete'
+        # с теми же значениями, что были записаны
+        delete_row = (
+            f'INSERT INTO "{search_table}" ("{search_table}", rowid, "{column}") '
+            f"VALUES ('delete', old.id, {normalize_search_sql('old.' + column)});"
+        )
+        for name, trigger_event, body in (
+            ("insert", "INSERT", insert_row),
+            ("delete", "DELETE", delete_row),
+            ("update", f'UPDATE OF "{column}"', delete_row + " " + insert_row),
+        ):
+            connection.execute(
+                text(
+                    f'CREATE TRIGGER IF NOT EXISTS "{search_table}_{name}" '
+                    f'AFTER {trigger_event} ON "{table}" BEGIN {body} END'
+                )
+            )
+
+
+def drop_search_indexes(target: Any, connection: Connection, **kw: Any) -> None:
+    for table in SEARCH_COLUMNS:
+        connection.execute(text(f'DROP TABLE IF EXISTS "{search_table_name(table)}"'))
+
+
+event.listen(SQLModel.metadata, "after_create", create_search_indexes)
+event.listen(SQLModel.metadata, "before_drop", drop_search_indexes)
+
+
 def get_session() -> Generator[Session, Any, None]:
     with Session(engine) as session:
         yield session
 
 
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+def run_sync(session: AsyncSession, fn: Callable[[Session], T]) -> Awaitable[T]:
+    # Синхронный код из db_helpers и service_layer выполняется с синхронной
+    # сессией SQLModel, обращения к БД внутри него не блокируют цикл событий
+    return session.run_sync(lambda sync_session: fn(cast(Session, sync_session)))
+
+
 # Таблицы связи "многие к многим"
 class GenreTrack(SQLModel, table=True):
     __tablename__ = "Genre_Tracks"
+    __table_args__ = (
+        Index("ix_Genre_Tracks_track_id_genre_id", "track_id", "genre_id"),
+    )
     genre_id: int = Field(primary_key=True, foreign_key="Genres.id")
     track_id: int = Field(primary_key=True, foreign_key="Tracks.id")
 
 
 class ArtistTrack(SQLModel, table=True):
     __tablename__ = "Artist_Tracks"
+    __table_args__ = (
+        Index("ix_Artist_Tracks_track_id_artist_id", "track_id", "artist_id"),
+    )
     artist_id: int = Field(primary_key=True, foreign_key="Artists.id")
     track_id: int = Field(primary_key=True, foreign_key="Tracks.id")
 
 
 class ArtistAlbum(SQLModel, table=True):
     __tablename__ = "Artist_Albums"
+    __table_args__ = (
+        Index("ix_Artist_Albums_album_id_artist_id", "album_id", "artist_id"),
+    )
     artist_id: int = Field(primary_key=True, foreign_key="Artists.id")
     album_id: int = Field(primary_key=True, foreign_key="Albums.id")
 
 
+class GenreAlbum(SQLModel, table=True):
+    __tablename__ = "Genre_Albums"
+    __table_args__ = (
+        Index("ix_Genre_Albums_album_id_genre_id", "album_id", "genre_id"),
+    )
+    genre_id: int = Field(primary_key=True, foreign_key="Genres.id")
+    album_id: int = Field(primary_key=True, foreign_key="Albums.id")
+
+
 class CustomTagTrack(SQLModel, table=True):
     __tablename__ = "CustomTag_Tracks"
+    __table_args__ = (
+        Index(
+            "ix_CustomTag_Tracks_track_id_custom_tag_id", "track_id", "custom_tag_id"
+        ),
+    )
     custom_tag_id: int = Field(primary_key=True, foreign_key="CustomTags.id")
     track_id: int = Field(primary_key=True, foreign_key="Tracks.id")
 
@@ -43,7 +519,7 @@ class CustomTagTrack(SQLModel, table=True):
 class PlaylistTrack(SQLModel, table=True):
     __tablename__ = "Playlist_Tracks"
     playlist_id: int = Field(primary_key=True, foreign_key="Playlists.id")
-    track_id: int = Field(primary_key=True, foreign_key="Tracks.id")
+    track_id: int = Field(primary_key=True, foreign_key="Tracks.id", index=True)
     added_at: str
 
     playlist: "Playlist" = Relationship(back_populates="playlist_tracks")
@@ -53,7 +529,7 @@ class PlaylistTrack(SQLModel, table=True):
 class FavouriteTrack(SQLModel, table=True):
     __tablename__ = "Favourite_Tracks"
     user_id: int = Field(primary_key=True, foreign_key="Users.id")
-    track_id: int = Field(primary_key=True, foreign_key="Tracks.id")
+    track_id: int = Field(primary_key=True, foreign_key="Tracks.id", index=True)
     added_at: str
 
     user: "User" = Relationship(back_populates="favourite_tracks")
@@ -63,7 +539,7 @@ class FavouriteTrack(SQLModel, table=True):
 class FavouriteAlbum(SQLModel, table=True):
     __tablename__ = "Favourite_Albums"
     user_id: int = Field(primary_key=True, foreign_key="Users.id")
-    album_id: int = Field(primary_key=True, foreign_key="Albums.id")
+    album_id: int = Field(primary_key=True, foreign_key="Albums.id", index=True)
     added_at: str
 
     user: "User" = Relationship(back_populates="favourite_albums")
@@ -73,7 +549,7 @@ class FavouriteAlbum(SQLModel, table=True):
 class FavouritePlaylist(SQLModel, table=True):
     __tablename__ = "Favourite_Playlists"
     user_id: int = Field(primary_key=True, foreign_key="Users.id")
-    playlist_id: int = Field(primary_key=True, foreign_key="Playlists.id")
+    playlist_id: int = Field(primary_key=True, foreign_key="Playlists.id", index=True)
     added_at: str
 
     user: "User" = Relationship(back_populates="favourite_playlists")
@@ -83,7 +559,7 @@ class FavouritePlaylist(SQLModel, table=True):
 class FavouriteArtist(SQLModel, table=True):
     __tablename__ = "Favourite_Artists"
     user_id: int = Field(primary_key=True, foreign_key="Users.id")
-    artist_id: int = Field(primary_key=True, foreign_key="Artists.id")
+    artist_id: int = Field(primary_key=True, foreign_key="Artists.id", index=True)
     added_at: str
 
     user: "User" = Relationship(back_populates="favourite_artists")
@@ -94,7 +570,7 @@ class FavouriteArtist(SQLModel, table=True):
 class User(SQLModel, table=True):
     __tablename__ = "Users"
     id: int = Field(primary_key=True)
-    login: str
+    login: str = Field(index=True)
     password: str
     avatar: str
 
@@ -105,15 +581,33 @@ class User(SQLModel, table=True):
     favourite_artists: list["FavouriteArtist"] = Relationship(back_populates="user")
 
 
+class MusicFolder(SQLModel, table=True):
+    __tablename__ = "MusicFolders"
+    id: int = Field(primary_key=True)
+    name: str
+    path: str
+
+    tracks: list["Track"] = Relationship(back_populates="music_folder")
+
+
 class Track(SQLModel, table=True):
     __tablename__ = "Tracks"
+    # Треки альбома сразу в порядке номеров (get_first_track, загрузка альбома)
+    __table_args__ = (
+        Index("ix_Tracks_album_id_album_position", "album_id", "album_position"),
+    )
     id: int = Field(primary_key=True)
-    file_path: str
+    music_folder_id: int | None = Field(
+        default=None, foreign_key="MusicFolders.id", index=True
+    )
+    file_path: str = Field(index=True)
     file_size: int
+    file_mtime: int | None = None
+    file_inode: int | None = None
     type: str
     title: str = Field(index=True)
     album_id: int | None = Field(foreign_key="Albums.id")
-    album_artist_id: int | None = Field(foreign_key="Artists.id")
+    album_artist_id: int | None = Field(foreign_key="Artists.id", index=True)
     album_position: int | None
     year: str | None
     plays_count: int
@@ -126,6 +620,7 @@ class Track(SQLModel, table=True):
     channels: int
     duration: int
 
+    music_folder: "MusicFolder" = Relationship(back_populates="tracks")
     album: "Album" = Relationship(back_populates="tracks")
     genres: list["Genre"] = Relationship(back_populates="tracks", link_model=GenreTrack)
     artists: list["Artist"] = Relationship(
@@ -140,8 +635,16 @@ class Track(SQLModel, table=True):
 
 class Artist(SQLModel, table=True):
     __tablename__ = "Artists"
+    # Порядок исполнителей в getIndexes и getArtists
+    __table_args__ = (
+        Index("ix_Artists_index_letter_sort_name", "index_letter", "sort_name"),
+    )
     id: int = Field(primary_key=True)
     name: str = Field(index=True)
+    album_count: int = 0
+    # Заполняются update_artist_index
+    sort_name: str | None = None
+    index_letter: str | None = None
 
     tracks: list["Track"] = Relationship(
         back_populates="artists", link_model=ArtistTrack
@@ -157,10 +660,12 @@ class Artist(SQLModel, table=True):
 
 class Album(SQLModel, table=True):
     __tablename__ = "Albums"
+    __table_args__ = (Index("ix_Albums_year_name", "year", "name"),)
     id: int = Field(primary_key=True)
     name: str = Field(index=True)
-    album_artist_id: int | None = Field(foreign_key="Artists.id")
+    album_artist_id: int | None = Field(foreign_key="Artists.id", index=True)
     total_tracks: int
+    duration: int = 0
     year: str | None
     cover: bytes | None
 
@@ -168,6 +673,7 @@ class Album(SQLModel, table=True):
     artists: list["Artist"] = Relationship(
         back_populates="albums", link_model=ArtistAlbum
     )
+    genres: list["Genre"] = Relationship(back_populates="albums", link_model=GenreAlbum)
     album_favourites: list["FavouriteAlbum"] = Relationship(back_populates="album")
 
 
@@ -177,6 +683,7 @@ class Playlist(SQLModel, table=True):
     name: str = Field(index=True)
     user_id: int = Field(foreign_key="Users.id")
     total_tracks: int
+    duration: int = 0
     create_date: str
 
     user: "User" = Relationship(back_populates="playlists")
@@ -192,8 +699,11 @@ class Genre(SQLModel, table=True):
     __tablename__ = "Genres"
     id: int = Field(primary_key=True)
     name: str = Field(index=True)
+    song_count: int = 0
+    album_count: int = 0
 
     tracks: list["Track"] = Relationship(back_populates="genres", link_model=GenreTrack)
+    albums: list["Album"] = Relationship(back_populates="genres", link_model=GenreAlbum)
 
     def __hash__(self) -> int:
         return hash(self.name)
@@ -209,3 +719,62 @@ class CustomTag(SQLModel, table=True):
     tracks: list["Track"] = Relationship(
         back_populates="custom_tags", link_model=CustomTagTrack
     )
+
+
+# Служебные таблицы
+class ScanCheckpoint(SQLModel, table=True):
+    __tablename__ = "ScanCheckpoints"
+    id: int = Field(primary_key=True)
+    directory: str
+    full_scan: bool
+    # Все файлы до last_path в порядке обхода каталога уже записаны в БД
+    last_path: str | None = None
+    started_at: str
+
+
+class LibraryState(SQLModel, table=True):
+    __tablename__ = "LibraryState"
+    # Единственная строка с версией библиотеки
+    id: int = Field(primary_key=True)
+    version: int
+    updated_at: str
+    # Артикли, с которыми построен указатель исполнителей
+    ignored_articles: str | None = None
+    # Версия счётчиков прослушиваний треков
+    plays_version: int | None = None
+    plays_updated_at: str | None = None
+
+    def modified_at(self) -> datetime:
+        return datetime.fromisoformat(self.updated_at)
+
+    def plays_modified_at(self) -> datetime:
+        # Время последнего изменения библиотеки или счётчиков прослушиваний
+        if self.plays_updated_at is None:
+            return self.modified_at()
+        return max(self.modified_at(), datetime.fromisoformat(self.plays_updated_at))
+
+
+class PlayHistory(SQLModel, table=True):
+    __tablename__ = "PlayHistory"
+    # Покрывает группировку прослушиваний пользователя по трекам
+    # в списках альбомов
+    __table_args__ = (
+        Index(
+            "ix_PlayHistory_user_id_track_id_played_at",
+            "user_id",
+            "track_id",
+            "played_at",
+        ),
+    )
+    id: int = Field(primary_key=True)
+    track_id: int = Field(foreign_key="Tracks.id")
+    user_id: int = Field(foreign_key="Users.id")
+    # Время в UTC
+    played_at: datetime
+
+
+if __name__ == "__main__":
+    # Обновление схемы существующей БД без запуска приложения
+    logging.basicConfig(level=logging.INFO)
+    upgrade_db()
+    optimize_db()
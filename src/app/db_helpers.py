@@ -1,36 +1,296 @@
+import base64
+import json
+import os
+import re
 from datetime import datetime
-from sqlalchemy import desc, func
-from sqlmodel import Session, select
-from typing import List, Optional, Sequence
+from sqlalchemy import (
+    Select,
+    String,
+    and_,
+    column,
+    desc,
+    func,
+    or_,
+    table,
+    type_coerce,
+    union,
+)
+from sqlalchemy.orm import aliased, defer, joinedload, selectinload
+from sqlmodel import Session, col, select
+from sqlmodel.sql.expression import SelectOfScalar
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypeVar
 from . import database as db
+from . import dto
+
+T = TypeVar("T")
+PageQuery = TypeVar("PageQuery", bound=Select[Any])
+SearchModel = TypeVar("SearchModel", db.Artist, db.Album, db.Track)
+
+
+# Стратегии загрузки связей, которые читают fill_* из service_layer.
+# Каждая связь подгружается одним запросом на всю выборку, а не ленивым
+# запросом на каждую строку, поэтому число запросов не зависит от размера ответа.
+# Обложки в JSON не попадают и загружаются, только если к ним обратились
+def track_loaders() -> List[Any]:
+    return [
+        defer(db.Track.cover),  # type: ignore
+        joinedload(db.Track.album).options(  # type: ignore
+            defer(db.Album.cover),  # type: ignore
+            selectinload(db.Album.artists),  # type: ignore
+        ),
+        selectinload(db.Track.artists),  # type: ignore
+        selectinload(db.Track.genres),  # type: ignore
+    ]
+
+
+def album_loaders(with_songs: bool = False) -> List[Any]:
+    loaders = [
+        defer(db.Album.cover),  # type: ignore
+        selectinload(db.Album.artists),  # type: ignore
+        selectinload(db.Album.genres),  # type: ignore
+    ]
+    if with_songs:
+        # Track.album у треков альбома берётся из identity map без запроса
+        loaders.append(
+            selectinload(db.Album.tracks).options(  # type: ignore
+                defer(db.Track.cover),  # type: ignore
+                selectinload(db.Track.artists),  # type: ignore
+                selectinload(db.Track.genres),  # type: ignore
+            )
+        )
+    return loaders
+
+
+def artist_loaders(with_albums: bool = False, with_songs: bool = False) -> List[Any]:
+    if not with_albums:
+        return []
+    return [
+        selectinload(db.Artist.albums).options(  # type: ignore
+            *album_loaders(with_songs=with_songs)
+        )
+    ]
+
+
+def playlist_loaders(with_songs: bool = False) -> List[Any]:
+    loaders = [joinedload(db.Playlist.user)]  # type: ignore
+    if with_songs:
+        loaders.append(
+            selectinload(db.Playlist.playlist_tracks)  # type: ignore
+            .joinedload(db.PlaylistTrack.track)  # type: ignore
+            .options(*track_loaders())
+        )
+    return loaders
+
+
+# Фильтры по каталогу с музыкой идут через индекс Tracks.music_folder_id
+def artist_ids_in_folder(music_folder_id: int) -> Any:
+    return union(
+        select(db.ArtistTrack.artist_id)
+        .join(db.Track)
+        .where(db.Track.music_folder_id == music_folder_id),
+        select(db.Track.album_artist_id).where(
+            db.Track.music_folder_id == music_folder_id
+        ),
+    )
+
+
+def album_ids_in_folder(music_folder_id: int) -> Any:
+    return select(db.Track.album_id).where(db.Track.music_folder_id == music_folder_id)
+
+
+# Ключ сортировки страницы: выражение и признак сортировки по убыванию
+SortKey = Tuple[Any, bool]
+
+
+# Курсор - значения ключей сортировки последней строки страницы. Следующая
+# страница начинается сразу после них, поэтому её стоимость не зависит от
+# глубины, а строки, добавленные сканером выше, не сдвигают её
+def encode_cursor(values: Sequence[Any]) -> str:
+    data = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, length: int) -> List[Any]:
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(data)
+    except ValueError as e:
+        raise ValueError("Invalid cursor") from e
+    if (
+        not isinstance(values, list)
+        or len(values) != length
+        or not all(isinstance(v, (str, int, float)) for v in values)
+    ):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def after_cursor(keys: Sequence[SortKey], values: Sequence[Any]) -> Any:
+    # (a, b) > (x, y) записывается как a >= x AND (a > x OR a = x AND b > y),
+    # чтобы условие на первый ключ ограничивало диапазон индекса
+    def after(key: SortKey, value: Any) -> Any:
+        expression, descending = key
+        return expression < value if descending else expression > value
+
+    conditions = [
+        and_(
+            *(k == v for (k, _), v in zip(keys[:i], values[:i])),
+            after(keys[i], values[i]),
+        )
+        for i in range(len(keys))
+    ]
+    first, descending = keys[0]
+    bound = first <= values[0] if descending else first >= values[0]
+    return and_(bound, or_(*conditions))
+
+
+def paginate(
+    query: PageQuery,
+    keys: Sequence[SortKey],
+    size: int | None,
+    offset: int = 0,
+    cursor: str | None = None,
+) -> PageQuery:
+    if cursor is not None:
+        query = query.where(after_cursor(keys, decode_cursor(cursor, len(keys))))
+    else:
+        query = query.offset(offset)
+    return query.order_by(*(desc(k) if d else k for k, d in keys)).limit(size)
+
+
+def fetch_page(
+    session: Session,
+    query: SelectOfScalar[T],
+    keys: Sequence[SortKey],
+    size: int | None,
+    offset: int = 0,
+    cursor: str | None = None,
+    cursor_prefix: Sequence[Any] = (),
+) -> dto.Page[T]:
+    # Ключи выбираются вместе со строками, из последней строится курсор
+    page = paginate(query, keys, size, offset, cursor).add_columns(
+        *(k for k, _ in keys)
+    )
+    rows = session.execute(page).all()
+    next_cursor = None
+    if size is not None and size > 0 and len(rows) == size:
+        next_cursor = encode_cursor([*cursor_prefix, *rows[-1][1:]])
+    return dto.Page([row[0] for row in rows], next_cursor)
+
+
+# Каждое слово запроса ищется как начало слова в названии, результаты
+# упорядочены по релевантности (bm25). Страница выбирается по одному индексу
+# поиска, так что строки сущности читаются только для неё.
+# Ранг bm25 зависит от всего индекса, поэтому курсор поиска содержит версию
+# библиотеки и после её изменения отвергается
+def search_page(
+    session: Session,
+    query: SelectOfScalar[SearchModel],
+    model: type[SearchModel],
+    value: str,
+    size: int | None = None,
+    offset: int = 0,
+    cursor: str | None = None,
+) -> dto.Page[SearchModel]:
+    table_name = str(model.__tablename__)
+    column_name = db.SEARCH_COLUMNS[table_name]
+    words = re.findall(r"\w+", db.normalize_search_text(value))
+    if len(words) == 0:
+        # Знаки препинания не попадают в полнотекстовый индекс; % и _ в запросе
+        # ищутся как обычные символы
+        query = query.where(
+            func.lower(getattr(model, column_name)).contains(
+                value.lower(), autoescape=True
+            )
+        )
+        return fetch_page(
+            session, query, [(col(model.id), False)], size, offset, cursor
+        )
+
+    search_table = table(
+        db.search_table_name(table_name),
+        column("rowid"),
+        column(column_name),
+        column("rank"),
+    )
+    match = " ".join(f'"{word}"*' for word in words)
+    keys: list[SortKey] = [(search_table.c.rank, False), (search_table.c.rowid, False)]
+    search_query = select(search_table.c.rowid, search_table.c.rank).where(
+        search_table.c[column_name].op("MATCH")(match)
+    )
+    version = db.get_library_state(session).version
+    if cursor is not None:
+        cursor_version, *values = decode_cursor(cursor, len(keys) + 1)
+        if cursor_version != version:
+            raise ValueError("Stale cursor")
+        search_query = search_query.where(after_cursor(keys, values))
+        offset = 0
+    search = paginate(search_query, keys, size, offset).subquery()
+    return fetch_page(
+        session,
+        query.join(search, search.c.rowid == model.id),
+        [(search.c.rank, False), (search.c.rowid, False)],
+        size,
+        cursor_prefix=[version],
+    )
 
 
 class ArtistDBHelper:
     def __init__(self, session: Session):
         self.session = session
 
-    def get_all_artists(self, filter_name: str | None = None) -> Sequence[db.Artist]:
-        query = select(db.Artist)
+    def get_all_artists(
+        self,
+        filter_name: str | None = None,
+        music_folder_id: int | None = None,
+        with_albums: bool = False,
+        with_songs: bool = False,
+    ) -> Sequence[db.Artist]:
+        query = select(db.Artist).options(*artist_loaders(with_albums, with_songs))
+        if music_folder_id is not None:
+            query = query.where(
+                col(db.Artist.id).in_(artist_ids_in_folder(music_folder_id))
+            )
         if filter_name:
+            return search_page(self.session, query, db.Artist, filter_name).items
+        return self.session.exec(query).all()
+
+    def get_artist_index(
+        self, music_folder_id: int | None = None
+    ) -> Sequence[db.Artist]:
+        # Исполнители в порядке указателя, без альбомов
+        query = select(db.Artist).order_by(
+            col(db.Artist.index_letter), col(db.Artist.sort_name), col(db.Artist.id)
+        )
+        if music_folder_id is not None:
             query = query.where(
-                func.lower(db.Artist.name).like(f"%{filter_name.lower()}%")
+                col(db.Artist.id).in_(artist_ids_in_folder(music_folder_id))
             )
         return self.session.exec(query).all()
 
     def get_artists(
-        self, size: int, offset: int, filter_name: str | None = None
-    ) -> Sequence[db.Artist]:
+        self,
+        size: int,
+        offset: int,
+        filter_name: str | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Artist]:
         query = select(db.Artist)
         if filter_name:
-            query = query.where(
-                func.lower(db.Artist.name).like(f"%{filter_name.lower()}%")
+            return search_page(
+                self.session, query, db.Artist, filter_name, size, offset, cursor
             )
-        query = query.limit(size).offset(offset)
-        return self.session.exec(query).all()
+        return fetch_page(
+            self.session, query, [(col(db.Artist.id), False)], size, offset, cursor
+        )
 
-    def get_artist_by_id(self, id: int) -> db.Artist | None:
+    def get_artist_by_id(
+        self, id: int, with_albums: bool = False, with_songs: bool = False
+    ) -> db.Artist | None:
         return self.session.exec(
-            select(db.Artist).where(db.Artist.id == id)
+            select(db.Artist)
+            .where(db.Artist.id == id)
+            .options(*artist_loaders(with_albums, with_songs))
         ).one_or_none()
 
 
@@ -39,34 +299,181 @@ class AlbumDBHelper:
         self.session = session
         self.track_db_helper = TrackDBHelper(session)
 
-    def get_all_albums(self, filter_name: str | None = None) -> Sequence[db.Album]:
-        query = select(db.Album)
-        if filter_name:
+    def get_all_albums(
+        self, filter_name: str | None = None, music_folder_id: int | None = None
+    ) -> Sequence[db.Album]:
+        query = select(db.Album).options(*album_loaders())
+        if music_folder_id is not None:
             query = query.where(
-                func.lower(db.Album.name).like(f"%{filter_name.lower()}%")
+                col(db.Album.id).in_(album_ids_in_folder(music_folder_id))
             )
+        if filter_name:
+            return search_page(self.session, query, db.Album, filter_name).items
         return self.session.exec(query).all()
 
     def get_albums(
-        self, size: int, offset: int, filter_name: str | None = None
-    ) -> Sequence[db.Album]:
-        query = select(db.Album)
+        self,
+        size: int,
+        offset: int,
+        filter_name: str | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        query = select(db.Album).options(*album_loaders())
         if filter_name:
-            query = query.where(
-                func.lower(db.Album.name).like(f"%{filter_name.lower()}%")
+            return search_page(
+                self.session, query, db.Album, filter_name, size, offset, cursor
             )
-        query = query.limit(size).offset(offset)
-        return self.session.exec(query).all()
+        return fetch_page(
+            self.session, query, [(col(db.Album.id), False)], size, offset, cursor
+        )
 
-    def get_album_by_id(self, id: int) -> db.Album | None:
+    def get_album_by_id(self, id: int, with_songs: bool = False) -> db.Album | None:
         return self.session.exec(
-            select(db.Album).where(db.Album.id == id)
+            select(db.Album)
+            .where(db.Album.id == id)
+            .options(*album_loaders(with_songs))
         ).one_or_none()
 
-    def get_albums_by_name(self, size: int, offset: int) -> Sequence[db.Album]:
-        return self.session.exec(
-            select(db.Album).order_by(db.Album.name).limit(size).offset(offset)
-        ).all()
+    def albums_in_folder(self, music_folder_id: int | None) -> SelectOfScalar[db.Album]:
+        query = select(db.Album).options(*album_loaders())
+        if music_folder_id is not None:
+            query = query.where(
+                col(db.Album.id).in_(album_ids_in_folder(music_folder_id))
+            )
+        return query
+
+    def get_albums_by_name(
+        self,
+        size: int,
+        offset: int,
+        music_folder_id: int | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        keys = [(col(db.Album.name), False), (col(db.Album.id), False)]
+        query = self.albums_in_folder(music_folder_id)
+        return fetch_page(self.session, query, keys, size, offset, cursor)
+
+    def get_random_albums(
+        self, size: int, music_folder_id: int | None = None
+    ) -> Sequence[db.Album]:
+        query = self.albums_in_folder(music_folder_id)
+        return self.session.exec(query.order_by(func.random()).limit(size)).all()
+
+    def get_albums_by_year(
+        self,
+        from_year: str,
+        to_year: str,
+        size: int,
+        offset: int,
+        music_folder_id: int | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        # Если fromYear больше toYear, альбомы идут от новых к старым
+        descending = from_year > to_year
+        keys = [
+            (col(db.Album.year), descending),
+            (col(db.Album.name), descending),
+            (col(db.Album.id), descending),
+        ]
+        query = self.albums_in_folder(music_folder_id).where(
+            col(db.Album.year).between(min(from_year, to_year), max(from_year, to_year))
+        )
+        return fetch_page(self.session, query, keys, size, offset, cursor)
+
+    def get_albums_by_artist(
+        self,
+        size: int,
+        offset: int,
+        music_folder_id: int | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        # Исполнитель альбома определяется по первому треку, как в
+        # get_album_artist, но сразу для всех альбомов одним подзапросом
+        first_tracks = (
+            select(
+                db.Track.id,
+                db.Track.album_id,
+                db.Track.album_artist_id,
+                func.row_number()
+                .over(
+                    partition_by=col(db.Track.album_id),
+                    order_by=col(db.Track.album_position),
+                )
+                .label("position"),
+            )
+        ).subquery()
+        album_artist = aliased(db.Artist)
+        track_artist = aliased(db.Artist)
+        track_artist_id = (
+            select(func.min(db.ArtistTrack.artist_id))
+            .where(db.ArtistTrack.track_id == first_tracks.c.id)
+            .scalar_subquery()
+        )
+        artist_names = (
+            select(
+                first_tracks.c.album_id,
+                func.coalesce(album_artist.name, track_artist.name, "").label("name"),
+            )
+            .outerjoin(
+                album_artist, col(album_artist.id) == first_tracks.c.album_artist_id
+            )
+            .outerjoin(track_artist, col(track_artist.id) == track_artist_id)
+            .where(first_tracks.c.position == 1)
+        ).subquery()
+        query = self.albums_in_folder(music_folder_id).outerjoin(
+            artist_names, artist_names.c.album_id == db.Album.id
+        )
+        keys = [
+            (func.coalesce(artist_names.c.name, ""), False),
+            (col(db.Album.id), False),
+        ]
+        return fetch_page(self.session, query, keys, size, offset, cursor)
+
+    def played_albums(
+        self, user_id: int, music_folder_id: int | None
+    ) -> Tuple[SelectOfScalar[db.Album], Any]:
+        # Прослушивания пользователя из истории, собранные по альбомам.
+        # Время сравнивается строкой, как хранится в SQLite, чтобы попасть в курсор
+        plays = (
+            select(
+                db.Track.album_id,
+                func.count().label("plays"),
+                type_coerce(func.max(db.PlayHistory.played_at), String).label(
+                    "played_at"
+                ),
+            )
+            .join(db.PlayHistory, col(db.PlayHistory.track_id) == db.Track.id)
+            .where(db.PlayHistory.user_id == user_id)
+            .group_by(col(db.Track.album_id))
+        ).subquery()
+        query = self.albums_in_folder(music_folder_id).join(
+            plays, plays.c.album_id == db.Album.id
+        )
+        return query, plays
+
+    def get_frequent_albums(
+        self,
+        user_id: int,
+        size: int,
+        offset: int,
+        music_folder_id: int | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        query, plays = self.played_albums(user_id, music_folder_id)
+        keys = [(plays.c.plays, True), (col(db.Album.id), False)]
+        return fetch_page(self.session, query, keys, size, offset, cursor)
+
+    def get_recent_albums(
+        self,
+        user_id: int,
+        size: int,
+        offset: int,
+        music_folder_id: int | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Album]:
+        query, plays = self.played_albums(user_id, music_folder_id)
+        keys = [(plays.c.played_at, True), (col(db.Album.id), False)]
+        return fetch_page(self.session, query, keys, size, offset, cursor)
 
     def get_first_track(self, albumId: int) -> db.Track | None:
         return self.session.exec(
@@ -81,46 +488,88 @@ class AlbumDBHelper:
         return self.track_db_helper.get_album_artist(track.id) if track else None
 
     def get_sorted_artist_albums(
-        self, artist_id: int, size: int, offset: int
-    ) -> Sequence[db.Album]:
-        return self.session.exec(
+        self, artist_id: int, size: int, offset: int, cursor: str | None = None
+    ) -> dto.Page[db.Album]:
+        # Альбомы без года идут последними, как и при сортировке NULL по убыванию
+        keys = [
+            (func.coalesce(db.Album.year, ""), True),
+            (col(db.Album.name), False),
+            (col(db.Album.id), False),
+        ]
+        query = (
             select(db.Album)
+            .options(*album_loaders())
             .join(db.ArtistAlbum)
             .where(db.ArtistAlbum.album_id == db.Album.id)
             .where(db.ArtistAlbum.artist_id == artist_id)
-            .distinct()
-            .order_by(desc(db.Album.year), db.Album.name)  # type: ignore
-            .limit(size)
-            .offset(offset)
-        ).all()
+        )
+        return fetch_page(self.session, query, keys, size, offset, cursor)
 
 
 class TrackDBHelper:
     def __init__(self, session: Session):
         self.session = session
 
-    def get_all_tracks(self, filter_title: str | None = None) -> Sequence[db.Track]:
-        query = select(db.Track)
+    def get_all_tracks(
+        self, filter_title: str | None = None, music_folder_id: int | None = None
+    ) -> Sequence[db.Track]:
+        query = select(db.Track).options(*track_loaders())
+        if music_folder_id is not None:
+            query = query.where(db.Track.music_folder_id == music_folder_id)
         if filter_title:
-            query = query.where(
-                func.lower(db.Track.title).like(f"%{filter_title.lower()}%")
-            )
+            return search_page(self.session, query, db.Track, filter_title).items
         return self.session.exec(query).all()
 
-    def get_tracks(
-        self, size: int, offset: int, filter_title: str | None = None
+    def get_folder_root_tracks(
+        self, music_folder_id: int | None = None
     ) -> Sequence[db.Track]:
-        query = select(db.Track)
+        # Файлы, лежащие прямо в каталоге музыки, а не в его подкаталогах.
+        # Пути проверяются по индексу file_path, строки читаются только у них
+        folders = select(db.MusicFolder.path)
+        if music_folder_id is not None:
+            folders = folders.where(db.MusicFolder.id == music_folder_id)
+        conditions = []
+        for path in self.session.exec(folders):
+            prefix = os.path.join(path, "")
+            conditions.append(
+                and_(
+                    col(db.Track.file_path) > prefix,
+                    col(db.Track.file_path) < prefix[:-1] + chr(ord(prefix[-1]) + 1),
+                    func.instr(func.substr(db.Track.file_path, len(prefix) + 1), os.sep)
+                    == 0,
+                )
+            )
+        if len(conditions) == 0:
+            return []
+        root_ids = select(db.Track.id).where(or_(*conditions))
+        return self.session.exec(
+            select(db.Track)
+            .options(*track_loaders())
+            .where(col(db.Track.id).in_(root_ids))
+            .order_by(col(db.Track.file_path))
+        ).all()
+
+    def get_tracks(
+        self,
+        size: int,
+        offset: int,
+        filter_title: str | None = None,
+        cursor: str | None = None,
+    ) -> dto.Page[db.Track]:
+        query = select(db.Track).options(*track_loaders())
         if filter_title:
-            query = query.where(
-                func.lower(db.Track.title).like(f"%{filter_title.lower()}%")
+            return search_page(
+                self.session, query, db.Track, filter_title, size, offset, cursor
             )
-        query = query.limit(size).offset(offset)
-        return self.session.exec(query).all()
+        return fetch_page(
+            self.session, query, [(col(db.Track.id), False)], size, offset, cursor
+        )
 
     def get_track_by_id(self, id: int) -> db.Track | None:
         return self.session.exec(
-            select(db.Track).where(db.Track.id == id)
+            select(db.Track)
+            .where(db.Track.id == id)
+            .options(defer(db.Track.cover))  # type: ignore
         ).one_or_none()
 
     def get_album_artist(self, track_id: int) -> db.Artist | None:
@@ -144,22 +593,52 @@ class TrackDBHelper:
         ).one()
 
     def get_tracks_by_genre_name(
-        self, genre_name: str, size: int | None = None, offset: int | None = None
+        self,
+        genre_name: str,
+        size: int | None = None,
+        offset: int | None = None,
+        music_folder_id: int | None = None,
     ) -> Sequence[db.Track]:
         query = (
             select(db.Track)
+            .options(*track_loaders())
             .join(db.GenreTrack)
             .where(db.GenreTrack.track_id == db.Track.id)
             .join(db.Genre)
             .where(db.GenreTrack.genre_id == db.Genre.id)
             .where(db.Genre.name == genre_name)
         )
+        if music_folder_id is not None:
+            query = query.where(db.Track.music_folder_id == music_folder_id)
         if size:
             query = query.limit(size)
         if offset:
             query = query.offset(offset)
         return self.session.exec(query).all()
 
+    def get_random_tracks(
+        self,
+        size: int,
+        genre_name: str | None = None,
+        from_year: str | None = None,
+        to_year: str | None = None,
+        music_folder_id: int | None = None,
+    ) -> Sequence[db.Track]:
+        query = select(db.Track).options(*track_loaders())
+        if genre_name:
+            query = (
+                query.join(db.GenreTrack)
+                .join(db.Genre)
+                .where(db.Genre.name == genre_name)
+            )
+        if from_year:
+            query = query.where(col(db.Track.year) >= from_year)
+        if to_year:
+            query = query.where(col(db.Track.year) <= to_year)
+        if music_folder_id is not None:
+            query = query.where(db.Track.music_folder_id == music_folder_id)
+        return self.session.exec(query.order_by(func.random()).limit(size)).all()
+
 
 class GenresDBHelper:
     def __init__(self, session: Session):
@@ -276,7 +755,9 @@ class FavouriteDBHelper:
 
     def get_starred_tracks(self, user_id: int) -> Sequence[db.Track]:
         return self.session.exec(
-            select(db.Track).where(
+            select(db.Track)
+            .options(*track_loaders())
+            .where(
                 (
                     (db.FavouriteTrack.track_id == db.Track.id)
                     & (db.FavouriteTrack.user_id == user_id)
@@ -286,7 +767,9 @@ class FavouriteDBHelper:
 
     def get_starred_artists(self, user_id: int) -> Sequence[db.Artist]:
         return self.session.exec(
-            select(db.Artist).where(
+            select(db.Artist)
+            .options(*artist_loaders())
+            .where(
                 (
                     (db.FavouriteArtist.artist_id == db.Artist.id)
                     & (db.FavouriteArtist.user_id == user_id)
@@ -296,7 +779,9 @@ class FavouriteDBHelper:
 
     def get_starred_albums(self, user_id: int) -> Sequence[db.Album]:
         return self.session.exec(
-            select(db.Album).where(
+            select(db.Album)
+            .options(*album_loaders())
+            .where(
                 (
                     (db.FavouriteAlbum.album_id == db.Album.id)
                     & (db.FavouriteAlbum.user_id == user_id)
@@ -306,7 +791,9 @@ class FavouriteDBHelper:
 
     def get_starred_playlists(self, user_id: int) -> Sequence[db.Playlist]:
         return self.session.exec(
-            select(db.Playlist).where(
+            select(db.Playlist)
+            .options(*playlist_loaders())
+            .where(
                 (
                     (db.FavouritePlaylist.playlist_id == db.Playlist.id)
                     & (db.FavouritePlaylist.user_id == user_id)
@@ -335,9 +822,15 @@ class PlaylistDBHelper:
             )
             playlist.playlist_tracks.append(playlist_track)
         self.session.add(playlist)
+        self.session.flush()
+        db.update_playlist_aggregates(self.session, [playlist.id])
         self.session.commit()
-        self.session.refresh(playlist)
-        return playlist
+        # После commit связи устарели и загружаются заново одним набором запросов
+        return self.session.exec(
+            select(db.Playlist)
+            .where(db.Playlist.id == playlist.id)
+            .options(*playlist_loaders(with_songs=True))
+        ).one()
 
     def update_playlist(
         self,
@@ -367,7 +860,8 @@ class PlaylistDBHelper:
                     added_at=now, track_id=t, playlist_id=id
                 )
                 playlist.playlist_tracks.append(playlist_track)
-            playlist.total_tracks = len(playlist.playlist_tracks)
+            self.session.flush()
+            db.update_playlist_aggregates(self.session, [playlist.id])
             self.session.commit()
             self.session.refresh(playlist)
         return playlist
@@ -382,13 +876,25 @@ class PlaylistDBHelper:
             return True
         return False
 
-    def get_playlist(self, id: int) -> db.Playlist | None:
+    def get_playlist(self, id: int, with_songs: bool = False) -> db.Playlist | None:
         return self.session.exec(
-            select(db.Playlist).where(db.Playlist.id == id)
+            select(db.Playlist)
+            .where(db.Playlist.id == id)
+            .options(*playlist_loaders(with_songs))
         ).one_or_none()
 
     def get_all_playlists(self) -> Sequence[db.Playlist]:
-        return self.session.exec(select(db.Playlist)).all()
+        return self.session.exec(select(db.Playlist).options(*playlist_loaders())).all()
+
+
+class MusicFolderDBHelper:
+    def __init__(self, session: Session):
+        self.session = session
+
+    def get_all_music_folders(self) -> Sequence[db.MusicFolder]:
+        return self.session.exec(
+            select(db.MusicFolder).order_by(col(db.MusicFolder.id))
+        ).all()
 
 
 class UserDBHelper:
@@ -1,12 +1,28 @@
 import logging
 import os
+import queue
 import re
+import threading
+import time
 
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import closing
+from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
+from sqlalchemy import String, literal, union
 from mutagen.flac import FLAC
 from mutagen.mp3 import MP3
-from sqlmodel import Session, select
+from sqlmodel import Session, col, delete, func, insert, select, update
+from typing import Any, Callable, Generator, Iterable, Iterator, Sequence, cast
 
+from . import config
 from . import database as db
 from . import utils
 
@@ -14,12 +30,105 @@ from . import utils
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
 
-scanStatus = {"scanning": True, "count": 0}
+PHASES = ("walk", "parse", "thumbnail", "dbWrite")
+
+
+class ScanStatus:
+    # Счётчики текущего сканирования. Обновляются потоком обхода каталога
+    # и потоком записи в БД, читаются обработчиками getScanStatus
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.start()
+
+    def start(self) -> None:
+        with self.lock:
+            self.scanning = True
+            self.walk_finished = False
+            self.started_at = time.monotonic()
+            self.finished_at: float | None = None
+            self.discovered = 0
+            self.parsed = 0
+            self.failed = 0
+            self.skipped = 0
+            self.bytes_read = 0
+            self.phase_times = dict.fromkeys(PHASES, 0.0)
+
+    def finish(self) -> None:
+        with self.lock:
+            self.scanning = False
+            self.finished_at = time.monotonic()
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        with self.lock:
+            self.phase_times[phase] += seconds
+
+    def add_discovered(self, walk_time: float) -> None:
+        with self.lock:
+            self.discovered += 1
+            self.phase_times["walk"] += walk_time
+
+    def set_walk_finished(self) -> None:
+        with self.lock:
+            self.walk_finished = True
+
+    def add_skipped(self) -> None:
+        with self.lock:
+            self.skipped += 1
+
+    def add_failed(self) -> None:
+        with self.lock:
+            self.failed += 1
+
+    def add_parsed(self, audio_info: "AudioInfo") -> None:
+        with self.lock:
+            self.parsed += 1
+            self.bytes_read += audio_info.file_size
+            self.phase_times["parse"] += audio_info.parse_time
+            self.phase_times["thumbnail"] += audio_info.thumbnail_time
+
+    def to_dict(self) -> dict[str, Any]:
+        with self.lock:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            elapsed = end - self.started_at
+            processed = self.parsed + self.failed + self.skipped
+            files_per_second = processed / elapsed if elapsed > 0 else 0.0
+
+            # Оценка появляется, когда известно общее число файлов
+            eta: float | None = None
+            if self.scanning and self.walk_finished and files_per_second > 0:
+                eta = max(self.discovered - processed, 0) / files_per_second
+
+            return {
+                "scanning": self.scanning,
+                "count": self.parsed + self.skipped,
+                "discovered": self.discovered,
+                "parsed": self.parsed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "bytesRead": self.bytes_read,
+                "elapsed": round(elapsed, 3),
+                "filesPerSecond": round(files_per_second, 1),
+                "eta": round(eta, 1) if eta is not None else None,
+                "phaseTimes": {
+                    phase: round(seconds, 3)
+                    for phase, seconds in self.phase_times.items()
+                },
+            }
+
+
+scanStatus = ScanStatus()
+
+# Сканирование и наблюдатель за каталогом не пишут в библиотеку одновременно
+library_lock = threading.Lock()
+
+AUDIO_EXTENSIONS = (".mp3", ".flac")
 
 
 class AudioInfo:
     file_path: str
     file_size: int
+    file_mtime: int
+    file_inode: int
     type: str
     title: str
     artists: list[str]
@@ -36,10 +145,20 @@ class AudioInfo:
     sample_rate: int
     channels: int
     duration: int
+    # Время разбора файла и построения превью обложки в процессе-обработчике
+    parse_time: float = 0.0
+    thumbnail_time: float = 0.0
 
     def __init__(self, file_path: str):
         self.file_path = file_path
-        self.file_size = os.path.getsize(file_path)
+        self.file_size, self.file_mtime, self.file_inode = get_file_fingerprint(
+            file_path
+        )
+
+
+def get_file_fingerprint(file_path: str) -> tuple[int, int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns, stat.st_ino
 
 
 def extract_metadata_mp3(audio_file: MP3, audio_info: AudioInfo) -> None:
@@ -69,9 +188,7 @@ def extract_metadata_mp3(audio_file: MP3, audio_info: AudioInfo) -> None:
         int(str(audio_file["TRCK"])) if "TRCK" in audio_file.tags else None
     )
     audio_info.year = str(audio_file["TDRC"]) if "TDRC" in audio_file.tags else None
-    audio_info.cover, audio_info.cover_type = utils.get_cover_preview(
-        utils.get_cover_from_mp3(audio_file)
-    )
+    set_cover_preview(audio_info, utils.get_cover_from_mp3(audio_file))
     audio_info.custom_tags = utils.get_custom_tags_mp3(audio_file)
     audio_info.bit_rate = audio_file.info.bitrate
     audio_info.bits_per_sample = int(
@@ -110,9 +227,7 @@ def extract_metadata_flac(audio_file: FLAC, audio_info: AudioInfo) -> None:
         else None
     )
     audio_info.year = str(audio_file["DATE"][0]) if "DATE" in audio_file.tags else None  # type: ignore[operator]
-    audio_info.cover, audio_info.cover_type = utils.get_cover_preview(
-        utils.get_cover_from_flac(audio_file)
-    )
+    set_cover_preview(audio_info, utils.get_cover_from_flac(audio_file))
     audio_info.custom_tags = utils.get_custom_tags_flac(audio_file)
     audio_info.bit_rate = audio_file.info.bitrate
     audio_info.bits_per_sample = audio_file.info.bits_per_sample
@@ -121,159 +236,976 @@ def extract_metadata_flac(audio_file: FLAC, audio_info: AudioInfo) -> None:
     audio_info.duration = audio_file.info.length
 
 
-def scan_directory_for_audio_files(dir: str) -> list[AudioInfo]:
-    data = []
+def set_cover_preview(audio_info: AudioInfo, image_bytes: bytes | None) -> None:
+    start = time.perf_counter()
+    audio_info.cover, audio_info.cover_type = utils.get_cover_preview(image_bytes)
+    audio_info.thumbnail_time = time.perf_counter() - start
+
+
+def is_same_or_nested(path: str, directory: str) -> bool:
+    return path == directory or path.startswith(os.path.join(directory, ""))
+
+
+def is_audio_file(file_path: str) -> bool:
+    return file_path.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def iter_audio_file_paths(dir: str) -> Iterator[str]:
+    # Порядок обхода постоянный, на нём основаны контрольные точки сканирования
+    for root, dirs, files in os.walk(dir):
+        dirs.sort()
+        for file in sorted(files):
+            if is_audio_file(file):
+                yield os.path.join(root, file)
+
+
+def walk_order_key(dir: str, file_path: str) -> tuple[tuple[int, str], ...]:
+    # Файлы каталога обходятся раньше его подкаталогов
+    parts = Path(file_path).relative_to(dir).parts
+    return tuple((1, part) for part in parts[:-1]) + ((0, parts[-1]),)
+
+
+def parse_audio_file(file_path: str) -> AudioInfo | None:
+    try:
+        start = time.perf_counter()
+        audio_info = AudioInfo(file_path)
+
+        if file_path.lower().endswith(".mp3"):
+            extract_metadata_mp3(MP3(file_path), audio_info)
+            logger.info(f"Parsed mp3 file {file_path}")
+        elif file_path.lower().endswith(".flac"):
+            extract_metadata_flac(FLAC(file_path), audio_info)
+            logger.info(f"Parsed flac file {file_path}")
+        else:
+            raise Exception("Unsupported file")
+
+        audio_info.parse_time = time.perf_counter() - start - audio_info.thumbnail_time
+        return audio_info
+
+    except Exception as e:
+        logger.warning(f"Error while parsing file {file_path}: {e}")
+        return None
+
+
+def get_scan_workers(workers: int) -> int:
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def parse_audio_files(
+    file_paths: Iterable[str],
+    workers: int = config.SCAN_WORKERS,
+    on_parsed: Callable[[str, AudioInfo | None], None] | None = None,
+) -> Generator[AudioInfo, None, None]:
+    # Разбор тегов и превью обложек идут в пуле процессов,
+    # результаты отдаются загрузчику по мере готовности
+    workers = get_scan_workers(workers)
+
+    def parsed(file_path: str, audio_info: AudioInfo | None) -> Iterator[AudioInfo]:
+        if on_parsed is not None:
+            on_parsed(file_path, audio_info)
+        if audio_info is not None:
+            yield audio_info
+
+    if workers == 1:
+        for file_path in file_paths:
+            yield from parsed(file_path, parse_audio_file(file_path))
+        return
+
+    # Число задач в пуле ограничено, чтобы обход каталога не убегал вперёд
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight: dict[Future[AudioInfo | None], str] = {}
+        for file_path in file_paths:
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from parsed(in_flight.pop(future), future.result())
+            in_flight[executor.submit(parse_audio_file, file_path)] = file_path
+
+        for future in as_completed(in_flight):
+            yield from parsed(in_flight[future], future.result())
+
+
+def stream_audio_files(
+    file_paths: Iterable[str],
+    workers: int = config.SCAN_WORKERS,
+    queue_size: int = config.SCAN_QUEUE_SIZE,
+    on_parsed: Callable[[str, AudioInfo | None], None] | None = None,
+) -> Generator[AudioInfo, None, None]:
+    return stream_audio_file_sources([file_paths], workers, queue_size, on_parsed)
+
 
-    for root, _, files in os.walk(dir):
-        for file in files:
-            file_path = os.path.join(root, file)
+def stream_audio_file_sources(
+    sources: Sequence[Iterable[str]],
+    workers: int = config.SCAN_WORKERS,
+    queue_size: int = config.SCAN_QUEUE_SIZE,
+    on_parsed: Callable[[str, AudioInfo | None], None] | None = None,
+) -> Generator[AudioInfo, None, None]:
+    # Обход и разбор файлов идут в отдельных потоках, запись в БД - в текущем.
+    # Между ними ограниченная очередь, поэтому память зависит от её длины,
+    # а не от размера библиотеки. У каждого источника (каталога) свой поток
+    # и свой пул процессов, поэтому медленный диск не задерживает остальные
+    audio_queue: queue.Queue[AudioInfo | None] = queue.Queue(maxsize=max(queue_size, 1))
+    stopped = threading.Event()
+    errors: list[BaseException] = []
+    source_workers = max(get_scan_workers(workers) // max(len(sources), 1), 1)
+
+    def put(audio_info: AudioInfo | None) -> bool:
+        while not stopped.is_set():
             try:
-                audio_info = AudioInfo(file_path)
-
-                if file.lower().endswith(".mp3"):
-                    extract_metadata_mp3(MP3(file_path), audio_info)
-                    logger.info(f"Parsed mp3 file {file_path}")
-                elif file.lower().endswith(".flac"):
-                    extract_metadata_flac(FLAC(file_path), audio_info)
-                    logger.info(f"Parsed flac file {file_path}")
-                else:
-                    raise Exception("Unsupported file")
+                audio_queue.put(audio_info, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
-                data.append(audio_info)
+    def produce(file_paths: Iterable[str]) -> None:
+        try:
+            with closing(
+                parse_audio_files(file_paths, source_workers, on_parsed)
+            ) as audio_files:
+                for audio_info in audio_files:
+                    if not put(audio_info):
+                        return
+        except BaseException as e:
+            errors.append(e)
+            stopped.set()
+        finally:
+            put(None)
 
-            except Exception as e:
-                logger.warning(f"Error while parsing file {file_path}: {e}")
+    producers = [
+        threading.Thread(
+            target=produce, args=(file_paths,), name="scan-producer", daemon=True
+        )
+        for file_paths in sources
+    ]
+    for producer in producers:
+        producer.start()
+    try:
+        running = len(producers)
+        while running > 0 and not stopped.is_set():
+            try:
+                audio_info = audio_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if audio_info is None:
+                running -= 1
+            else:
+                yield audio_info
+    finally:
+        stopped.set()
+        for producer in producers:
+            producer.join()
 
-    return data
+    if len(errors) > 0:
+        raise errors[0]
 
 
-def load_audio_data(audio_info: AudioInfo) -> None:
-    with Session(db.engine) as session:
-        artists = []
-        for name in audio_info.artists:
-            artist = session.exec(
-                select(db.Artist).where(db.Artist.name == name)
-            ).one_or_none()
-            if artist is None:
-                artist = db.Artist(name=name)
-                session.add(artist)
-                session.commit()
-                session.refresh(artist)
-            artists.append(artist)
-
-        album_artists = []
-        album_artist_id: int | None = None
-        if (
-            audio_info.album_artist is not None
-            and audio_info.album_artist != "Various Artists"
+def scan_audio_files(
+    dir: str, workers: int = config.SCAN_WORKERS
+) -> Iterator[AudioInfo]:
+    return parse_audio_files(iter_audio_file_paths(dir), workers)
+
+
+def scan_directory_for_audio_files(dir: str) -> list[AudioInfo]:
+    return list(scan_audio_files(dir, workers=1))
+
+
+@dataclass
+class AlbumState:
+    id: int
+    album_artist_id: int | None
+    artist_ids: list[int]
+    changed: bool = False
+
+
+@dataclass
+class TrackState:
+    id: int
+    album_id: int | None
+
+
+class AudioDataLoader:
+    # Пишет треки пачками: одна транзакция на batch_size файлов,
+    # id исполнителей, альбомов, жанров и тегов кешируются в памяти
+    def __init__(
+        self,
+        session: Session,
+        batch_size: int = config.SCAN_BATCH_SIZE,
+        preload: bool = False,
+        before_commit: Callable[[Session, list[str]], None] | None = None,
+    ):
+        self.session = session
+        self.batch_size = max(batch_size, 1)
+        self.before_commit = before_commit
+        self.preloaded = False
+        self.pending: dict[str, AudioInfo] = {}
+
+        self.artist_ids: dict[str, int] = {}
+        self.genre_ids: dict[str, int] = {}
+        self.custom_tag_ids: dict[tuple[str, str], int] = {}
+        self.albums: dict[str, AlbumState] = {}
+        self.tracks: dict[str, TrackState] = {}
+        self.music_folders: list[tuple[str, int]] | None = None
+        self.written = False
+
+        if preload:
+            self.preload()
+
+    def __enter__(self) -> "AudioDataLoader":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc_type is None:
+            self.flush()
+            if self.written:
+                db.update_library_aggregates(self.session)
+                self.session.commit()
+
+    def preload(self) -> None:
+        for id, name in self.session.exec(select(db.Artist.id, db.Artist.name)):
+            self.artist_ids.setdefault(name, id)
+        for id, name in self.session.exec(select(db.Genre.id, db.Genre.name)):
+            self.genre_ids.setdefault(name, id)
+        for id, name, value in self.session.exec(
+            select(db.CustomTag.id, db.CustomTag.name, db.CustomTag.value)
         ):
-            album_artist = session.exec(
-                select(db.Artist).where(db.Artist.name == audio_info.album_artist)
-            ).one_or_none()
-            if album_artist is None:
-                album_artist = db.Artist(name=audio_info.album_artist)
-                session.add(album_artist)
-                session.commit()
-                session.refresh(album_artist)
-            album_artist_id = album_artist.id
-            album_artists = [album_artist]
-        else:
-            album_artists = artists
-
-        album = session.exec(
-            select(db.Album).where(db.Album.name == audio_info.album)
-        ).one_or_none()
-        if album is None:
-            album = db.Album(
-                name=audio_info.album,
-                album_artist_id=album_artist_id,
-                total_tracks=1,
-                year=audio_info.year,
-                cover=audio_info.cover,
-                artists=album_artists,
+            self.custom_tag_ids.setdefault((name, value), id)
+
+        album_artist_ids: dict[int, list[int]] = {}
+        for artist_id, artist_album_id in self.session.exec(
+            select(db.ArtistAlbum.artist_id, db.ArtistAlbum.album_id)
+        ):
+            album_artist_ids.setdefault(artist_album_id, []).append(artist_id)
+        for id, name, album_artist_id in self.session.exec(
+            select(db.Album.id, db.Album.name, db.Album.album_artist_id)
+        ):
+            self.albums.setdefault(
+                name, AlbumState(id, album_artist_id, album_artist_ids.get(id, []))
             )
-            session.add(album)
-            session.commit()
-            session.refresh(album)
-        elif album.album_artist_id is None:
-            if album_artist_id is not None:
-                album.album_artist_id = album_artist_id
+
+        for id, file_path, album_id in self.session.exec(
+            select(db.Track.id, db.Track.file_path, db.Track.album_id)
+        ):
+            self.tracks[file_path] = TrackState(id, album_id)
+
+        self.preloaded = True
+
+    def add(self, audio_info: AudioInfo) -> None:
+        self.pending.pop(audio_info.file_path, None)
+        self.pending[audio_info.file_path] = audio_info
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+
+        new_tracks: list[dict[str, Any]] = []
+        new_track_links: list[tuple[list[int], list[int], list[int]]] = []
+        updated_tracks: list[dict[str, Any]] = []
+        artist_tracks: list[dict[str, int]] = []
+        genre_tracks: list[dict[str, int]] = []
+        custom_tag_tracks: list[dict[str, int]] = []
+        artist_albums: list[dict[str, int]] = []
+        changed_album_ids: set[int] = set()
+
+        for audio_info in self.pending.values():
+            artist_ids = [self.get_artist_id(name) for name in audio_info.artists]
+            artist_ids = list(dict.fromkeys(artist_ids))
+
+            album_artist_id: int | None = None
+            if (
+                audio_info.album_artist is not None
+                and audio_info.album_artist != "Various Artists"
+            ):
+                album_artist_id = self.get_artist_id(audio_info.album_artist)
+                album_artist_ids = [album_artist_id]
             else:
-                album.artists = list(set(album.artists).union(artists))
-        elif album_artist_id is not None and album.album_artist_id != album_artist_id:
-            album.album_artist_id = album_artist_id
-
-        genres = []
-        for name in audio_info.genres:
-            genre = session.exec(
-                select(db.Genre).where(db.Genre.name == name)
-            ).one_or_none()
-            if genre is None:
-                genre = db.Genre(name=name)
-                session.add(genre)
-                session.commit()
-                session.refresh(genre)
-            genres.append(genre)
-
-        custom_tags: list[db.CustomTag] = []
-        for name, value in audio_info.custom_tags:
-            tag = session.exec(
-                select(db.CustomTag)
+                album_artist_ids = artist_ids
+
+            album = self.get_album(audio_info.album)
+            if album is None:
+                album = self.create_album(audio_info, album_artist_id)
+                for artist_id in album_artist_ids:
+                    album.artist_ids.append(artist_id)
+                    artist_albums.append({"artist_id": artist_id, "album_id": album.id})
+            elif album.album_artist_id is None:
+                if album_artist_id is not None:
+                    album.album_artist_id = album_artist_id
+                    album.changed = True
+                else:
+                    for artist_id in artist_ids:
+                        if artist_id not in album.artist_ids:
+                            album.artist_ids.append(artist_id)
+                            artist_albums.append(
+                                {"artist_id": artist_id, "album_id": album.id}
+                            )
+            elif (
+                album_artist_id is not None and album.album_artist_id != album_artist_id
+            ):
+                album.album_artist_id = album_artist_id
+                album.changed = True
+
+            genre_ids = [self.get_genre_id(name) for name in audio_info.genres]
+            genre_ids = list(dict.fromkeys(genre_ids))
+            custom_tag_ids = [
+                self.get_custom_tag_id(name, value)
+                for name, value in audio_info.custom_tags
+            ]
+            custom_tag_ids = list(dict.fromkeys(custom_tag_ids))
+
+            values: dict[str, Any] = {
+                "music_folder_id": self.get_music_folder_id(audio_info.file_path),
+                "file_size": audio_info.file_size,
+                "file_mtime": audio_info.file_mtime,
+                "file_inode": audio_info.file_inode,
+                "type": audio_info.type,
+                "title": audio_info.title,
+                "album_id": album.id,
+                "album_artist_id": album_artist_id,
+                "album_position": audio_info.track_number,
+                "year": audio_info.year,
+                "cover": audio_info.cover,
+                "cover_type": audio_info.cover_type,
+                "bit_rate": audio_info.bit_rate,
+                "bits_per_sample": audio_info.bits_per_sample,
+                "sample_rate": audio_info.sample_rate,
+                "channels": audio_info.channels,
+                "duration": audio_info.duration,
+            }
+
+            changed_album_ids.add(album.id)
+            track = self.get_track(audio_info.file_path)
+            if track is None:
+                new_tracks.append(
+                    values | {"file_path": audio_info.file_path, "plays_count": 0}
+                )
+                new_track_links.append((artist_ids, genre_ids, custom_tag_ids))
+                continue
+
+            if track.album_id != album.id:
+                if track.album_id is not None:
+                    changed_album_ids.add(track.album_id)
+                track.album_id = album.id
+            updated_tracks.append(values | {"id": track.id})
+            artist_tracks += [
+                {"artist_id": i, "track_id": track.id} for i in artist_ids
+            ]
+            genre_tracks += [{"genre_id": i, "track_id": track.id} for i in genre_ids]
+            custom_tag_tracks += [
+                {"custom_tag_id": i, "track_id": track.id} for i in custom_tag_ids
+            ]
+
+        if len(new_tracks) > 0:
+            track_ids = (
+                self.session.execute(
+                    insert(db.Track).returning(
+                        col(db.Track.id), sort_by_parameter_order=True
+                    ),
+                    new_tracks,
+                )
+                .scalars()
+                .all()
+            )
+            for track_id, row, (artist_ids, genre_ids, custom_tag_ids) in zip(
+                track_ids, new_tracks, new_track_links
+            ):
+                self.tracks[row["file_path"]] = TrackState(track_id, row["album_id"])
+                artist_tracks += [
+                    {"artist_id": i, "track_id": track_id} for i in artist_ids
+                ]
+                genre_tracks += [
+                    {"genre_id": i, "track_id": track_id} for i in genre_ids
+                ]
+                custom_tag_tracks += [
+                    {"custom_tag_id": i, "track_id": track_id} for i in custom_tag_ids
+                ]
+
+        if len(updated_tracks) > 0:
+            self.session.execute(update(db.Track), updated_tracks)
+            updated_ids = [row["id"] for row in updated_tracks]
+            for link_table in (db.ArtistTrack, db.GenreTrack, db.CustomTagTrack):
+                self.session.execute(
+                    delete(link_table).where(col(link_table.track_id).in_(updated_ids))
+                )
+
+        for table, rows in (
+            (db.ArtistTrack, artist_tracks),
+            (db.GenreTrack, genre_tracks),
+            (db.CustomTagTrack, custom_tag_tracks),
+            (db.ArtistAlbum, artist_albums),
+        ):
+            if len(rows) > 0:
+                self.session.execute(insert(table), rows)
+
+        changed_albums = [
+            {"id": album.id, "album_artist_id": album.album_artist_id}
+            for album in self.albums.values()
+            if album.changed
+        ]
+        if len(changed_albums) > 0:
+            self.session.execute(update(db.Album), changed_albums)
+        for album in self.albums.values():
+            album.changed = False
+        db.update_album_aggregates(self.session, changed_album_ids)
+
+        if self.before_commit is not None:
+            self.before_commit(self.session, list(self.pending))
+        self.session.commit()
+        self.pending.clear()
+        self.written = True
+
+    def get_artist_id(self, name: str) -> int:
+        id = self.artist_ids.get(name)
+        if id is None and not self.preloaded:
+            id = self.session.exec(
+                select(db.Artist.id).where(db.Artist.name == name)
+            ).first()
+        if id is None:
+            id = self.insert_row(db.Artist, name=name)
+        self.artist_ids[name] = id
+        return id
+
+    def get_genre_id(self, name: str) -> int:
+        id = self.genre_ids.get(name)
+        if id is None and not self.preloaded:
+            id = self.session.exec(
+                select(db.Genre.id).where(db.Genre.name == name)
+            ).first()
+        if id is None:
+            id = self.insert_row(db.Genre, name=name)
+        self.genre_ids[name] = id
+        return id
+
+    def get_custom_tag_id(self, name: str, value: str) -> int:
+        id = self.custom_tag_ids.get((name, value))
+        if id is None and not self.preloaded:
+            id = self.session.exec(
+                select(db.CustomTag.id)
                 .where(db.CustomTag.name == name)
                 .where(db.CustomTag.value == value)
-            ).one_or_none()
-            if tag is None:
-                tag = db.CustomTag(name=name, value=value, updated=False)
-                session.add(tag)
-                session.commit()
-                session.refresh(tag)
-            custom_tags.append(tag)
-
-        track = session.exec(
-            select(db.Track).where(db.Track.file_path == audio_info.file_path)
-        ).one_or_none()
-        if track is None:
-            track = db.Track(
-                file_path=audio_info.file_path,
-                file_size=audio_info.file_size,
-                type=audio_info.type,
-                title=audio_info.title,
-                album_id=album.id,
-                album_artist_id=album_artist_id,
-                album_position=audio_info.track_number,
-                year=audio_info.year,
-                plays_count=0,
-                cover=audio_info.cover,
-                cover_type=audio_info.cover_type,
-                bit_rate=audio_info.bit_rate,
-                bits_per_sample=audio_info.bits_per_sample,
-                sample_rate=audio_info.sample_rate,
-                channels=audio_info.channels,
-                duration=audio_info.duration,
-                genres=genres,
-                artists=artists,
-                custom_tags=custom_tags,
+            ).first()
+        if id is None:
+            id = self.insert_row(db.CustomTag, name=name, value=value, updated=False)
+        self.custom_tag_ids[(name, value)] = id
+        return id
+
+    def get_album(self, name: str) -> AlbumState | None:
+        album = self.albums.get(name)
+        if album is not None or self.preloaded:
+            return album
+
+        row = self.session.exec(
+            select(db.Album.id, db.Album.album_artist_id).where(db.Album.name == name)
+        ).first()
+        if row is None:
+            return None
+        id, album_artist_id = row
+        artist_ids = self.session.exec(
+            select(db.ArtistAlbum.artist_id).where(db.ArtistAlbum.album_id == id)
+        ).all()
+        album = AlbumState(id, album_artist_id, list(artist_ids))
+        self.albums[name] = album
+        return album
+
+    def create_album(
+        self, audio_info: AudioInfo, album_artist_id: int | None
+    ) -> AlbumState:
+        id = self.insert_row(
+            db.Album,
+            name=audio_info.album,
+            album_artist_id=album_artist_id,
+            total_tracks=0,
+            year=audio_info.year,
+            cover=audio_info.cover,
+        )
+        album = AlbumState(id, album_artist_id, [])
+        self.albums[audio_info.album] = album
+        return album
+
+    def get_track(self, file_path: str) -> TrackState | None:
+        track = self.tracks.get(file_path)
+        if track is not None or self.preloaded:
+            return track
+
+        row = self.session.exec(
+            select(db.Track.id, db.Track.album_id).where(
+                db.Track.file_path == file_path
             )
-            album.total_tracks = album.total_tracks + 1
-        else:
-            track.title = audio_info.title
-            track.artists = artists
-            track.album_id = album.id
-            track.album_artist_id = album_artist_id
-            track.album_position = audio_info.track_number
-            track.year = audio_info.year
-            track.genres = genres
-            track.custom_tags = custom_tags
-
-        session.add(track)
+        ).first()
+        if row is None:
+            return None
+        track = TrackState(*row)
+        self.tracks[file_path] = track
+        return track
+
+    def get_music_folder_id(self, file_path: str) -> int | None:
+        if self.music_folders is None:
+            # Вложенные каталоги проверяются раньше внешних
+            self.music_folders = sorted(
+                (
+                    (path, id)
+                    for id, path in self.session.exec(
+                        select(db.MusicFolder.id, db.MusicFolder.path)
+                    )
+                ),
+                key=lambda folder: len(folder[0]),
+                reverse=True,
+            )
+        for path, id in self.music_folders:
+            if is_same_or_nested(file_path, path):
+                return id
+        return None
+
+    def insert_row(self, table: Any, **values: Any) -> int:
+        return cast(
+            int,
+            self.session.execute(
+                insert(table).returning(table.id), values
+            ).scalar_one(),
+        )
+
+
+def load_audio_data(audio_info: AudioInfo) -> None:
+    with Session(db.engine) as session:
+        with AudioDataLoader(session, batch_size=1) as loader:
+            loader.add(audio_info)
+
+
+def get_known_files(session: Session) -> dict[str, tuple[int, tuple[int, ...]]]:
+    rows = session.exec(
+        select(  # type: ignore[call-overload]
+            db.Track.id,
+            db.Track.file_path,
+            db.Track.file_size,
+            db.Track.file_mtime,
+            db.Track.file_inode,
+        )
+    ).all()
+    return {
+        file_path: (id, (file_size, file_mtime or 0, file_inode or 0))
+        for id, file_path, file_size, file_mtime, file_inode in rows
+    }
+
+
+def remove_tracks(session: Session, track_ids: Sequence[int]) -> None:
+    if len(track_ids) == 0:
+        return
+
+    album_ids = session.exec(
+        select(db.Track.album_id).where(col(db.Track.id).in_(track_ids)).distinct()
+    ).all()
+    playlist_ids = session.exec(
+        select(db.PlaylistTrack.playlist_id)
+        .where(col(db.PlaylistTrack.track_id).in_(track_ids))
+        .distinct()
+    ).all()
+
+    for link_table in (
+        db.GenreTrack,
+        db.ArtistTrack,
+        db.CustomTagTrack,
+        db.PlaylistTrack,
+        db.PlayHistory,
+        db.FavouriteTrack,
+    ):
+        session.execute(
+            delete(link_table).where(col(link_table.track_id).in_(track_ids))
+        )
+    session.execute(delete(db.Track).where(col(db.Track.id).in_(track_ids)))
+
+    db.update_album_aggregates(session, [id for id in album_ids if id is not None])
+    db.update_playlist_aggregates(session, playlist_ids)
+
+
+def remove_orphans(session: Session) -> None:
+    used_albums = select(db.Track.album_id).where(col(db.Track.album_id).is_not(None))
+    for link_table in (db.ArtistAlbum, db.GenreAlbum, db.FavouriteAlbum):
+        session.execute(
+            delete(link_table).where(col(link_table.album_id).not_in(used_albums))
+        )
+    session.execute(delete(db.Album).where(col(db.Album.id).not_in(used_albums)))
+
+    session.execute(
+        delete(db.Genre).where(col(db.Genre.id).not_in(select(db.GenreTrack.genre_id)))
+    )
+    session.execute(
+        delete(db.CustomTag).where(
+            col(db.CustomTag.id).not_in(select(db.CustomTagTrack.custom_tag_id))
+        )
+    )
+
+    used_artists = union(
+        select(db.ArtistTrack.artist_id),
+        select(db.ArtistAlbum.artist_id),
+        select(db.Album.album_artist_id).where(
+            col(db.Album.album_artist_id).is_not(None)
+        ),
+        select(db.Track.album_artist_id).where(
+            col(db.Track.album_artist_id).is_not(None)
+        ),
+    )
+    session.execute(
+        delete(db.FavouriteArtist).where(
+            col(db.FavouriteArtist.artist_id).not_in(used_artists)
+        )
+    )
+    session.execute(delete(db.Artist).where(col(db.Artist.id).not_in(used_artists)))
+
+    db.update_library_aggregates(session)
+
+
+def get_track_ids_by_paths(session: Session, paths: Iterable[str]) -> list[int]:
+    track_ids: list[int] = []
+    for path in paths:
+        track_ids += session.exec(
+            select(db.Track.id).where(
+                (col(db.Track.file_path) == path)
+                | col(db.Track.file_path).startswith(
+                    os.path.join(path, ""), autoescape=True
+                )
+            )
+        ).all()
+    return track_ids
+
+
+def rename_tracks(session: Session, old_path: str, new_path: str) -> None:
+    renamed_track = session.exec(
+        select(db.Track.id).where(db.Track.file_path == old_path)
+    ).first()
+    if renamed_track is not None:
+        # Переименованный файл заменил другой трек
+        remove_tracks(
+            session,
+            session.exec(
+                select(db.Track.id).where(db.Track.file_path == new_path)
+            ).all(),
+        )
+
+    session.execute(
+        update(db.Track)
+        .where(col(db.Track.file_path) == old_path)
+        .values(file_path=new_path)
+    )
+
+    old_prefix = os.path.join(old_path, "")
+    session.execute(
+        update(db.Track)
+        .where(col(db.Track.file_path).startswith(old_prefix, autoescape=True))
+        .values(
+            file_path=literal(os.path.join(new_path, ""))
+            + func.substr(db.Track.file_path, len(old_prefix) + 1, type_=String)
+        )
+    )
+
+
+def update_library_files(
+    changed_paths: Iterable[str],
+    deleted_paths: Iterable[str] = [],
+    renamed_paths: Iterable[tuple[str, str]] = [],
+    workers: int = 1,
+) -> None:
+    with library_lock, Session(db.engine) as session:
+        for old_path, new_path in renamed_paths:
+            rename_tracks(session, old_path, new_path)
+        remove_tracks(session, get_track_ids_by_paths(session, deleted_paths))
+        session.commit()
+
+        with AudioDataLoader(session) as loader:
+            for audio_info in stream_audio_files(changed_paths, workers):
+                loader.add(audio_info)
+
+        remove_orphans(session)
+        session.commit()
+
+
+class CheckpointTracker:
+    # Файлы приходят из пула процессов не по порядку, поэтому контрольная точка -
+    # последний файл, до которого включительно всё уже записано в БД
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.outstanding: dict[str, bool] = {}
+        self.last_path: str | None = None
+
+    def discovered(self, file_path: str) -> None:
+        with self.lock:
+            self.outstanding[file_path] = False
+
+    def done(self, file_paths: Iterable[str]) -> None:
+        with self.lock:
+            for file_path in file_paths:
+                if file_path in self.outstanding:
+                    self.outstanding[file_path] = True
+            while len(self.outstanding) > 0:
+                first = next(iter(self.outstanding))
+                if not self.outstanding[first]:
+                    break
+                del self.outstanding[first]
+                self.last_path = first
+
+
+def get_scan_checkpoints() -> Sequence[db.ScanCheckpoint]:
+    with Session(db.engine) as session:
+        return session.exec(select(db.ScanCheckpoint)).all()
+
+
+def start_scan_checkpoints(
+    directory_paths: Sequence[str], full_scan: bool
+) -> dict[str, tuple[bool, str | None]]:
+    # Для каждого каталога возвращает режим сканирования и точку, с которой
+    # продолжить прерванное перезапуском сканирование
+    scans: dict[str, tuple[bool, str | None]] = {}
+    with Session(db.engine) as session:
+        checkpoints = {
+            checkpoint.directory: checkpoint
+            for checkpoint in session.exec(
+                select(db.ScanCheckpoint).where(
+                    col(db.ScanCheckpoint.directory).in_(directory_paths)
+                )
+            )
+        }
+        for directory_path in directory_paths:
+            checkpoint = checkpoints.get(directory_path)
+            if checkpoint is not None and (checkpoint.full_scan or not full_scan):
+                logger.info(
+                    f"Resuming interrupted scan of {directory_path} "
+                    f"after {checkpoint.last_path}"
+                )
+                scans[directory_path] = (checkpoint.full_scan, checkpoint.last_path)
+                continue
+
+            if checkpoint is not None:
+                session.delete(checkpoint)
+            session.add(
+                db.ScanCheckpoint(
+                    directory=directory_path,
+                    full_scan=full_scan,
+                    started_at=datetime.now().isoformat(),
+                )
+            )
+            scans[directory_path] = (full_scan, None)
+        session.commit()
+    return scans
+
+
+def delete_scan_checkpoints(directory_paths: Sequence[str]) -> None:
+    with Session(db.engine) as session:
+        session.execute(
+            delete(db.ScanCheckpoint).where(
+                col(db.ScanCheckpoint.directory).in_(directory_paths)
+            )
+        )
         session.commit()
-        session.refresh(track)
 
 
-def scan_and_load(directory_path: str = "./tracks/") -> None:
-    audio_files = scan_directory_for_audio_files(directory_path)
-    for file in audio_files:
-        load_audio_data(file)
-        scanStatus["count"] = scanStatus["count"] + 1
+def sync_music_folders(directory_paths: Sequence[str]) -> None:
+    # Каталоги, убранные из настроек, удаляются вместе с треками
+    keep = list(dict.fromkeys([*config.MUSIC_DIRECTORIES, *directory_paths]))
+    with Session(db.engine) as session:
+        folders = {
+            folder.path: folder for folder in session.exec(select(db.MusicFolder))
+        }
+        for path, folder in list(folders.items()):
+            if path in keep:
+                continue
+            remove_tracks(
+                session,
+                session.exec(
+                    select(db.Track.id).where(db.Track.music_folder_id == folder.id)
+                ).all(),
+            )
+            session.delete(folder)
+            del folders[path]
+            logger.info(f"Removed music folder {path}")
+
+        for path in keep:
+            if path not in folders:
+                folder = db.MusicFolder(
+                    name=os.path.basename(os.path.normpath(path)), path=path
+                )
+                session.add(folder)
+                session.flush()
+                folders[path] = folder
+
+        # Треки из БД прежних версий получают каталог по пути файла,
+        # вложенные каталоги проверяются раньше внешних
+        for path in sorted(keep, key=len, reverse=True):
+            session.execute(
+                update(db.Track)
+                .where(col(db.Track.music_folder_id).is_(None))
+                .where(
+                    col(db.Track.file_path).startswith(
+                        os.path.join(path, ""), autoescape=True
+                    )
+                )
+                .values(music_folder_id=folders[path].id)
+            )
+        remove_tracks(
+            session,
+            session.exec(
+                select(db.Track.id).where(col(db.Track.music_folder_id).is_(None))
+            ).all(),
+        )
+        remove_orphans(session)
+        session.commit()
 
-    scanStatus["scanning"] = False
+
+def scan_and_load(
+    directory_paths: Sequence[str] = config.MUSIC_DIRECTORIES,
+    workers: int = config.SCAN_WORKERS,
+    full_scan: bool = False,
+    cancelled: threading.Event | None = None,
+) -> bool:
+    # Возвращает False, если сканирование было отменено
+    with library_lock:
+        scanStatus.start()
+        try:
+            sync_music_folders(directory_paths)
+            scans = start_scan_checkpoints(directory_paths, full_scan)
+            completed = load_directories(scans, workers, cancelled)
+            delete_scan_checkpoints(directory_paths)
+        finally:
+            scanStatus.finish()
+
+    status = scanStatus.to_dict()
+    logger.info(
+        f"Scan {'finished' if completed else 'cancelled'} in {status['elapsed']}s: "
+        f"{status['parsed']} parsed, {status['skipped']} unchanged, "
+        f"{status['failed']} failed, {status['filesPerSecond']} files/s, "
+        f"phases {status['phaseTimes']}"
+    )
+    return completed
+
+
+def load_directories(
+    scans: dict[str, tuple[bool, str | None]],
+    workers: int,
+    cancelled: threading.Event | None = None,
+) -> bool:
+    # Повторно разбираются только новые и изменённые файлы,
+    # у неизменённых треков сохраняются id, прослушивания и избранное.
+    # scans: каталог -> (полное сканирование, контрольная точка)
+    with Session(db.engine) as session:
+        known_files = get_known_files(session)
+    found_files: set[str] = set()
+    trackers = {directory_path: CheckpointTracker() for directory_path in scans}
+    finished_walks: list[str] = []
+
+    def is_cancelled() -> bool:
+        return cancelled is not None and cancelled.is_set()
+
+    def get_tracker(file_path: str) -> CheckpointTracker | None:
+        for directory_path, tracker in trackers.items():
+            if is_same_or_nested(file_path, directory_path):
+                return tracker
+        return None
+
+    def changed_file_paths(
+        directory_path: str, full_scan: bool, resume_after: str | None
+    ) -> Iterator[str]:
+        tracker = trackers[directory_path]
+        resume_key = None
+        if resume_after is not None:
+            resume_key = walk_order_key(directory_path, resume_after)
+
+        file_paths = iter_audio_file_paths(directory_path)
+        while not is_cancelled():
+            start = time.perf_counter()
+            file_path = next(file_paths, None)
+            if file_path is None:
+                finished_walks.append(directory_path)
+                if len(finished_walks) == len(scans):
+                    scanStatus.set_walk_finished()
+                return
+            found_files.add(file_path)
+            tracker.discovered(file_path)
+
+            # До контрольной точки файлы уже записаны этим же сканированием
+            unchanged = False
+            if resume_key is not None:
+                if walk_order_key(directory_path, file_path) > resume_key:
+                    resume_key = None
+                else:
+                    unchanged = file_path in known_files
+            if not unchanged and not full_scan and file_path in known_files:
+                try:
+                    fingerprint = get_file_fingerprint(file_path)
+                except OSError:
+                    scanStatus.add_discovered(time.perf_counter() - start)
+                    scanStatus.add_failed()
+                    tracker.done([file_path])
+                    continue
+                unchanged = known_files[file_path][1] == fingerprint
+
+            scanStatus.add_discovered(time.perf_counter() - start)
+            if unchanged:
+                scanStatus.add_skipped()
+                tracker.done([file_path])
+                continue
+            yield file_path
+
+    def on_parsed(file_path: str, audio_info: AudioInfo | None) -> None:
+        if audio_info is None:
+            scanStatus.add_failed()
+            tracker = get_tracker(file_path)
+            if tracker is not None:
+                tracker.done([file_path])
+        else:
+            scanStatus.add_parsed(audio_info)
+
+    def save_checkpoints(session: Session, file_paths: list[str]) -> None:
+        for directory_path, tracker in trackers.items():
+            tracker.done(
+                file_path
+                for file_path in file_paths
+                if is_same_or_nested(file_path, directory_path)
+            )
+            if tracker.last_path is not None:
+                session.execute(
+                    update(db.ScanCheckpoint)
+                    .where(col(db.ScanCheckpoint.directory) == directory_path)
+                    .values(last_path=tracker.last_path)
+                )
+
+    sources = [
+        changed_file_paths(directory_path, full_scan, resume_after)
+        for directory_path, (full_scan, resume_after) in scans.items()
+    ]
+    with Session(db.engine) as session:
+        with AudioDataLoader(
+            session, preload=True, before_commit=save_checkpoints
+        ) as loader:
+            with closing(
+                stream_audio_file_sources(sources, workers, on_parsed=on_parsed)
+            ) as files:
+                for file in files:
+                    if is_cancelled():
+                        break
+                    start = time.perf_counter()
+                    loader.add(file)
+                    scanStatus.add_time("dbWrite", time.perf_counter() - start)
+            start = time.perf_counter()
+        scanStatus.add_time("dbWrite", time.perf_counter() - start)
+
+    # Без полного обхода нельзя понять, какие файлы исчезли
+    if is_cancelled():
+        return False
+
+    start = time.perf_counter()
+    with Session(db.engine) as session:
+        remove_tracks(
+            session,
+            [
+                track_id
+                for file_path, (track_id, _) in known_files.items()
+                if file_path not in found_files
+                and any(is_same_or_nested(file_path, path) for path in scans)
+            ],
+        )
+        remove_orphans(session)
+        session.commit()
+    scanStatus.add_time("dbWrite", time.perf_counter() - start)
+    return True
@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List
+from typing import Generic, List, TypeVar
+
+T = TypeVar("T")
 
 
 @dataclass
@@ -77,6 +79,8 @@ class Album:
 class Artist:
     id: int
     name: str
+    album_count: int | None = None
+    cover_art_id: int | None = None
     artist_image_url: str | None = None
     starred: datetime | None = None
     albums: List[Album] = field(default_factory=list)
@@ -111,3 +115,15 @@ class Playlist:
     cover_art_id: int | None = None
     allowed_users: List[str] = field(default_factory=list)
     tracks: List[Track] = field(default_factory=list)
+
+
+@dataclass
+class MusicFolder:
+    id: int
+    name: str
+
+
+@dataclass
+class Page(Generic[T]):
+    items: List[T]
+    next_cursor: str | None = None
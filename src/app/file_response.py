@@ -0,0 +1,237 @@
+import os
+import re
+import stat
+from email.utils import formatdate
+from secrets import token_hex
+from typing import BinaryIO
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+from starlette.types import Receive, Scope, Send
+
+from . import config
+
+# Расширения ASGI, через которые сервер сам отдаёт файл через os.sendfile
+ZEROCOPY_EXTENSION = "http.response.zerocopysend"
+PATHSEND_EXTENSION = "http.response.pathsend"
+# Плееры запрашивают один-два диапазона, а сотни мелких диапазонов
+# превращают отдачу файла в сотни чтений
+MAX_RANGES = 16
+
+_RANGE_SPEC = re.compile(r"(\d*)-(\d*)", re.ASCII)
+
+# Кусок тела: готовые байты или (смещение, длина) в файле
+Segment = bytes | tuple[int, int]
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    # None — заголовок некорректен и игнорируется, пустой список — ни один
+    # диапазон не попадает в файл. Концы диапазонов включительно
+    units, _, spec = header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    parts = [part.strip() for part in spec.split(",") if part.strip()]
+    if not parts or len(parts) > MAX_RANGES:
+        return None
+
+    ranges: list[tuple[int, int]] = []
+    for part in parts:
+        match = _RANGE_SPEC.fullmatch(part)
+        if match is None or match.group(1) == match.group(2) == "":
+            return None
+        first, last = match.groups()
+        if first == "":
+            # Последние N байт файла
+            suffix = int(last)
+            if suffix > 0 and size > 0:
+                ranges.append((max(size - suffix, 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+
+    # Пересекающиеся и соседние диапазоны склеиваются
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(value: str, etag: str, last_modified: str) -> bool:
+    # Подходят только сильный ETag или точная дата (RFC 9110, 13.1.5)
+    if value.startswith(('"', "W/")):
+        return value == etag
+    return value == last_modified
+
+
+def make_etag(file_stat: os.stat_result) -> str:
+    return f'"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"'
+
+
+def open_file(path: str) -> BinaryIO:
+    return open(path, "rb", buffering=0)
+
+
+class TrackFileResponse(Response):
+    def __init__(self, path: str, media_type: str | None = None) -> None:
+        self.path = path
+        self.status_code = 200
+        self.media_type = media_type or "application/octet-stream"
+        self.background = None
+        self.init_headers({"accept-ranges": "bytes"})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            file = await anyio.to_thread.run_sync(open_file, self.path)
+        except OSError:
+            response: Response = JSONResponse(
+                {"detail": "File not found"}, status_code=404
+            )
+            return await response(scope, receive, send)
+
+        try:
+            file_stat = os.fstat(file.fileno())
+            if not stat.S_ISREG(file_stat.st_mode):
+                response = JSONResponse({"detail": "File not found"}, status_code=404)
+                return await response(scope, receive, send)
+            segments = self.prepare(Headers(scope=scope), file_stat)
+            if segments is None:
+                response = Response(
+                    status_code=416,
+                    headers={"content-range": f"bytes */{file_stat.st_size}"},
+                )
+                return await response(scope, receive, send)
+
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if scope["method"] != "HEAD":
+                extensions = scope.get("extensions") or {}
+                if self.status_code == 200 and PATHSEND_EXTENSION in extensions:
+                    # Сервер сам отправит весь файл и завершит ответ
+                    path = os.path.abspath(self.path)
+                    return await send({"type": PATHSEND_EXTENSION, "path": path})
+                await self.send_until_disconnect(scope, receive, send, file, segments)
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            file.close()
+
+    def prepare(
+        self, request_headers: Headers, file_stat: os.stat_result
+    ) -> list[Segment] | None:
+        # Выставляет статус и заголовки ответа и возвращает куски тела
+        # или None, если запрошенные диапазоны не попадают в файл
+        size = file_stat.st_size
+        etag = make_etag(file_stat)
+        last_modified = formatdate(file_stat.st_mtime, usegmt=True)
+        self.headers["etag"] = etag
+        self.headers["last-modified"] = last_modified
+
+        ranges = None
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header is not None and (
+            if_range is None or if_range_matches(if_range, etag, last_modified)
+        ):
+            ranges = parse_range(range_header, size)
+
+        if ranges is None:
+            self.headers["content-length"] = str(size)
+            return [(0, size)]
+        if not ranges:
+            return None
+
+        self.status_code = 206
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+            self.headers["content-length"] = str(end - start + 1)
+            return [(start, end - start + 1)]
+
+        boundary = token_hex(13)
+        segments: list[Segment] = []
+        for start, end in ranges:
+            segments.append(
+                (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {self.media_type}\r\n"
+                    f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+                ).encode("latin-1")
+            )
+            segments.append((start, end - start + 1))
+        segments.append(f"\r\n--{boundary}--\r\n".encode("latin-1"))
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(
+            sum(len(s) if isinstance(s, bytes) else s[1] for s in segments)
+        )
+        return segments
+
+    async def send_until_disconnect(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        file: BinaryIO,
+        segments: list[Segment],
+    ) -> None:
+        # uvicorn молча отбрасывает тело после обрыва соединения, а плееры
+        # обрывают его при каждой перемотке, поэтому файл дальше не читается
+        async with anyio.create_task_group() as task_group:
+
+            async def cancel_on_disconnect() -> None:
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(cancel_on_disconnect)
+            await self.send_segments(scope, send, file, segments)
+            task_group.cancel_scope.cancel()
+
+    async def send_segments(
+        self, scope: Scope, send: Send, file: BinaryIO, segments: list[Segment]
+    ) -> None:
+        extensions = scope.get("extensions") or {}
+        for segment in segments:
+            if isinstance(segment, bytes):
+                await send(
+                    {"type": "http.response.body", "body": segment, "more_body": True}
+                )
+                continue
+
+            offset, count = segment
+            if ZEROCOPY_EXTENSION in extensions:
+                await send(
+                    {
+                        "type": ZEROCOPY_EXTENSION,
+                        "file": file,
+                        "offset": offset,
+                        "count": count,
+                        "more_body": True,
+                    }
+                )
+                continue
+
+            chunk_size = config.STREAM_CHUNK_KB * 1024
+            while count > 0:
+                chunk = await anyio.to_thread.run_sync(
+                    os.pread, file.fileno(), min(chunk_size, count), offset
+                )
+                if not chunk:
+                    # Длина уже отправлена в заголовках, ответ не дописать
+                    raise RuntimeError(f"File {self.path} was truncated")
+                offset += len(chunk)
+                count -= len(chunk)
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
@@ -13,6 +13,7 @@ from . import db_loading
 from . import database as db
 from . import service_layer
 from . import utils
+from .response_cache import response_cache
 
 frontend_router = APIRouter(prefix="/specific")
 
@@ -33,13 +34,19 @@ def get_sorted_artist_albums(
     id: int,
     size: int = 10,
     offset: int = 0,
+    cursor: str | None = None,
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     album_service = service_layer.AlbumService(session)
-    sortedAlbums = album_service.get_sorted_artist_albums(id, size, offset)
+    try:
+        sortedAlbums = album_service.get_sorted_artist_albums(id, size, offset, cursor)
+    except ValueError:
+        return JSONResponse({"detail": "Invalid cursor"}, status_code=400)
 
     rsp = SubsonicResponse()
-    rsp.data["sortedAlbums"] = OpenSubsonicFormatter.format_albums(sortedAlbums)
+    rsp.data["sortedAlbums"] = OpenSubsonicFormatter.format_albums(
+        sortedAlbums.items, sortedAlbums.next_cursor
+    )
     return rsp.to_json_rsp()
 
 
@@ -87,3 +94,10 @@ def update_tags(
     db_loading.load_audio_data(audio_info)
 
     return JSONResponse({"detail": "success"})
+
+
+@frontend_router.get("/getResponseCacheStats")
+def get_response_cache_stats() -> JSONResponse:
+    rsp = SubsonicResponse()
+    rsp.data["responseCache"] = response_cache.stats()
+    return rsp.to_json_rsp()
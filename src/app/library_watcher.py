@@ -0,0 +1,264 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from . import config
+from . import db_loading
+from .scan_manager import scan_manager
+
+
+logger = logging.getLogger(__name__)
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+# Небольшие пачки файлов разбираются без пула процессов
+MIN_FILES_FOR_WORKERS = 16
+
+
+class Inotify:
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd: int = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd: int = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def remove_watch(self, wd: int) -> None:
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float) -> list[tuple[int, int, int, str]]:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class LibraryWatcher(threading.Thread):
+    # Собирает события inotify и применяет их к БД, когда каталог
+    # не менялся debounce_seconds секунд (например, после копирования альбома)
+    def __init__(
+        self,
+        directory: str,
+        debounce_seconds: float = config.WATCH_DEBOUNCE_SECONDS,
+        workers: int = config.SCAN_WORKERS,
+    ):
+        super().__init__(name="library-watcher", daemon=True)
+        self.directory = directory
+        self.debounce_seconds = debounce_seconds
+        self.workers = workers
+        self.stopped = threading.Event()
+
+        self.inotify = Inotify()
+        self.watches: dict[int, str] = {}
+
+        self.changed: set[str] = set()
+        self.deleted: set[str] = set()
+        self.renamed: list[tuple[str, str]] = []
+        self.moved_from: dict[int, str] = {}
+        self.rescan_required = False
+        self.last_event_time = 0.0
+
+        self.watch_tree(directory)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def run(self) -> None:
+        try:
+            while not self.stopped.is_set():
+                timeout = min(self.debounce_seconds, 0.5)
+                for wd, mask, cookie, name in self.inotify.read_events(timeout):
+                    self.handle_event(wd, mask, cookie, name)
+
+                quiet_time = time.monotonic() - self.last_event_time
+                if self.has_pending() and quiet_time >= self.debounce_seconds:
+                    self.apply_pending()
+        finally:
+            self.inotify.close()
+
+    def watch_tree(self, directory: str) -> None:
+        for root, _, _ in os.walk(directory):
+            try:
+                self.watches[self.inotify.add_watch(root, WATCH_MASK)] = root
+            except OSError as e:
+                logger.warning(f"Can not watch directory {root}: {e}")
+
+    def unwatch_tree(self, directory: str) -> None:
+        for wd, path in list(self.watches.items()):
+            if db_loading.is_same_or_nested(path, directory):
+                self.inotify.remove_watch(wd)
+                del self.watches[wd]
+
+    def has_pending(self) -> bool:
+        return (
+            self.rescan_required
+            or len(self.changed) > 0
+            or len(self.deleted) > 0
+            or len(self.renamed) > 0
+            or len(self.moved_from) > 0
+        )
+
+    def handle_event(self, wd: int, mask: int, cookie: int, name: str) -> None:
+        self.last_event_time = time.monotonic()
+
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("Inotify queue overflow, full rescan is scheduled")
+            self.rescan_required = True
+            return
+
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return
+        if mask & IN_DELETE_SELF:
+            if directory == self.directory:
+                logger.warning(f"Watched directory {directory} was removed")
+            return
+
+        path = os.path.join(directory, name)
+        is_dir = mask & IN_ISDIR != 0
+
+        if mask & IN_MOVED_FROM:
+            self.moved_from[cookie] = path
+        elif mask & IN_MOVED_TO:
+            old_path = self.moved_from.pop(cookie, None)
+            if old_path is None:
+                self.add_created(path, is_dir)
+            else:
+                self.add_renamed(old_path, path, is_dir)
+        elif mask & IN_CREATE:
+            if is_dir:
+                self.add_created(path, is_dir)
+        elif mask & IN_CLOSE_WRITE:
+            if not db_loading.is_audio_file(path):
+                return
+            self.changed.add(path)
+            self.deleted.discard(path)
+        elif mask & IN_DELETE:
+            self.deleted.add(path)
+            self.changed.discard(path)
+
+    def add_created(self, path: str, is_dir: bool) -> None:
+        if is_dir:
+            # Файлы могли появиться раньше, чем на каталог была поставлена watch
+            self.watch_tree(path)
+            self.changed.update(db_loading.iter_audio_file_paths(path))
+        elif db_loading.is_audio_file(path):
+            self.changed.add(path)
+        self.deleted.discard(path)
+
+    def add_renamed(self, old_path: str, new_path: str, is_dir: bool) -> None:
+        if not is_dir and not db_loading.is_audio_file(new_path):
+            # Трек, переименованный в неаудиофайл, пропадает из библиотеки
+            self.deleted.add(old_path)
+            self.changed.discard(old_path)
+            return
+
+        self.renamed.append((old_path, new_path))
+        for path in list(self.changed):
+            if db_loading.is_same_or_nested(path, old_path):
+                self.changed.discard(path)
+                self.changed.add(new_path + path[len(old_path) :])
+
+        if is_dir:
+            for wd, path in self.watches.items():
+                if db_loading.is_same_or_nested(path, old_path):
+                    self.watches[wd] = new_path + path[len(old_path) :]
+        else:
+            # Файл мог быть заменён новой версией (запись во временный файл)
+            self.changed.add(new_path)
+        self.deleted.discard(new_path)
+
+    def apply_pending(self) -> None:
+        changed = sorted(self.changed)
+        deleted = sorted(self.deleted | set(self.moved_from.values()))
+        renamed = self.renamed
+        rescan_required = self.rescan_required
+
+        for path in self.moved_from.values():
+            self.unwatch_tree(path)
+        self.changed = set()
+        self.deleted = set()
+        self.renamed = []
+        self.moved_from = {}
+        self.rescan_required = False
+
+        try:
+            if rescan_required:
+                # Пока идёт другое сканирование, пересканирование откладывается
+                if not scan_manager.start([self.directory], self.workers):
+                    self.rescan_required = True
+                return
+
+            logger.info(
+                f"Applying library changes: {len(changed)} changed, "
+                f"{len(deleted)} deleted, {len(renamed)} renamed"
+            )
+            workers = self.workers if len(changed) >= MIN_FILES_FOR_WORKERS else 1
+            db_loading.update_library_files(changed, deleted, renamed, workers)
+        except Exception:
+            logger.exception("Error while applying library changes")
+
+
+def start_library_watcher(directory: str) -> LibraryWatcher | None:
+    if not sys.platform.startswith("linux"):
+        logger.warning("Library watcher requires inotify and works only on Linux")
+        return None
+
+    try:
+        watcher = LibraryWatcher(directory)
+    except OSError as e:
+        logger.warning(f"Can not start library watcher: {e}")
+        return None
+
+    watcher.start()
+    return watcher
@@ -1,19 +1,49 @@
-import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from anyio import to_thread
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from . import config
 from .open_subsonic_api import open_subsonic_router
-from .db_loading import scan_and_load
+from .db_loading import get_scan_checkpoints, scan_and_load
+from .scan_manager import scan_manager
+from .scrobble_buffer import scrobble_buffer
+from .sql_stats import QueryStatsMiddleware
+from .conditional_get import ConditionalGetMiddleware
+from .response_cache import ResponseCacheMiddleware, response_cache
+from .library_watcher import start_library_watcher
 from .frontend_endpoints import frontend_router
-from .database import init_db
+from . import database as db
+from .database import init_db, upgrade_db
 from .utils import create_default_user
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Синхронные эндпоинты выполняются в пуле потоков anyio
+    to_thread.current_default_thread_limiter().total_tokens = config.THREADPOOL_SIZE
+    # init_db пересоздаёт таблицы мимо сессий, версия читается заново
+    response_cache.invalidate()
+    yield
+    # Накопленные прослушивания записываются до закрытия соединений
+    await to_thread.run_sync(scrobble_buffer.stop)
+    if config.PERSISTENT_DATABASE:
+        await to_thread.run_sync(db.optimize_db)
+    # Соединения aiosqlite держат свои потоки, пока их не закроют
+    await db.async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
 ]
 
+app.add_middleware(ResponseCacheMiddleware)
+app.add_middleware(ConditionalGetMiddleware)
+app.add_middleware(QueryStatsMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -23,9 +53,20 @@ app.add_middleware(
 )
 
 
-init_db()
-create_default_user()
-scan_and_load()
+if config.PERSISTENT_DATABASE:
+    upgrade_db()
+    create_default_user()
+    # Сканирование, прерванное остановкой приложения, продолжается в любом случае
+    if config.SCAN_ON_STARTUP or len(get_scan_checkpoints()) > 0:
+        scan_manager.start()
+else:
+    init_db()
+    create_default_user()
+    if config.SCAN_ON_STARTUP:
+        scan_and_load()
+if config.WATCH_MUSIC_DIRECTORY:
+    for directory in config.MUSIC_DIRECTORIES:
+        start_library_watcher(directory)
 
 app.include_router(open_subsonic_router)
 
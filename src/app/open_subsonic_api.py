@@ -1,10 +1,11 @@
+from datetime import datetime, timezone
 from typing import Optional, List
-import asyncio
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import JSONResponse, FileResponse, Response
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
 from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from PIL import Image
 
 from src.app.open_subsonic_formatter import OpenSubsonicFormatter
@@ -16,6 +17,9 @@ from . import database as db
 from . import service_layer
 from . import db_helpers
 from . import db_loading
+from .scan_manager import scan_manager
+from .scrobble_buffer import scrobble_buffer
+from .file_response import TrackFileResponse
 from . import utils
 
 open_subsonic_router = APIRouter(prefix="/rest")
@@ -26,9 +30,12 @@ async def create_user(
     username: str = Query(...),
     password: str = Query(...),
     email: str = Query(default=""),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    _, err = service_layer.create_user(session, username, password)
+    _, err = await db.run_sync(
+        session,
+        lambda session: service_layer.create_user(session, username, password),
+    )
     if err:
         return JSONResponse({"detail": err}, status_code=400)
 
@@ -40,12 +47,14 @@ async def create_user(
 async def delete_user(
     username: str = Query(...),
     current_user: db.User = Depends(authenticate_user),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    user = session.exec(select(db.User).where(db.User.login == username)).one_or_none()
+    user = (
+        await session.exec(select(db.User).where(db.User.login == username))
+    ).one_or_none()
     if user:
-        session.delete(user)
-        session.commit()
+        await session.delete(user)
+        await session.commit()
     rsp = SubsonicResponse()
     return rsp.to_json_rsp()
 
@@ -56,16 +65,18 @@ async def update_user(
     password: str = "",
     newUsername: str = "",
     current_user: db.User = Depends(authenticate_user),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    user = session.exec(select(db.User).where(db.User.login == username)).one_or_none()
+    user = (
+        await session.exec(select(db.User).where(db.User.login == username))
+    ).one_or_none()
     if not user:
         return JSONResponse({"detail": "User not found"}, status_code=404)
     if newUsername:
         user.login = newUsername
     if password:
         user.password = password
-    session.commit()
+    await session.commit()
     rsp = SubsonicResponse()
     return rsp.to_json_rsp()
 
@@ -75,9 +86,11 @@ async def change_password(
     username: str = Query(...),
     password: str = Query(...),
     current_user: db.User = Depends(authenticate_user),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    user = session.exec(select(db.User).where(db.User.login == username)).one_or_none()
+    user = (
+        await session.exec(select(db.User).where(db.User.login == username))
+    ).one_or_none()
     if not user:
         return JSONResponse({"detail": "User not found"}, status_code=404)
     rsp = SubsonicResponse()
@@ -85,7 +98,7 @@ async def change_password(
         rsp.set_error(50, "The user can only change his password")
     else:
         user.password = password
-        session.commit()
+        await session.commit()
     return rsp.to_json_rsp()
 
 
@@ -93,9 +106,11 @@ async def change_password(
 async def get_user(
     username: str = Query(..., description="Имя пользователя"),
     current_user: db.User = Depends(authenticate_user),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    user = session.exec(select(db.User).where(db.User.login == username)).one_or_none()
+    user = (
+        await session.exec(select(db.User).where(db.User.login == username))
+    ).one_or_none()
     if not user:
         return JSONResponse({"detail": "User not found"}, status_code=404)
     rsp = SubsonicResponse()
@@ -106,9 +121,9 @@ async def get_user(
 @open_subsonic_router.get("/getUsers")
 async def get_users(
     current_user: db.User = Depends(authenticate_user),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    users = session.exec(select(db.User)).all()
+    users = (await session.exec(select(db.User))).all()
 
     rsp = SubsonicResponse()
     rsp.data["users"] = {
@@ -125,25 +140,38 @@ async def ping() -> JSONResponse:
 
 @open_subsonic_router.get("/getPlaylists")
 async def get_playlists(
-    username: str = "", session: Session = Depends(db.get_session)
+    username: str = "", session: AsyncSession = Depends(db.get_async_session)
 ) -> JSONResponse:
-    service = service_layer.PlaylistService(session)
-    playlists = service.get_playlists()
+    playlists = await db.run_sync(
+        session, lambda session: service_layer.PlaylistService(session).get_playlists()
+    )
 
     rsp = SubsonicResponse()
     rsp.data["playlists"] = OpenSubsonicFormatter.format_playlists(playlists)
     return rsp.to_json_rsp()
 
 
+@open_subsonic_router.get("/scrobble")
 @open_subsonic_router.get("/scroble")
-def scroble(id: int, session: Session = Depends(db.get_session)) -> JSONResponse:
-    track = session.exec(select(db.Track).where(db.Track.id == id)).first()
-    if track is None:
+def scrobble(
+    id: int,
+    time: Optional[int] = None,
+    submission: bool = True,
+    current_user: db.User = Depends(authenticate_user),
+    session: Session = Depends(db.get_session),
+) -> JSONResponse:
+    track_id = session.exec(select(db.Track.id).where(db.Track.id == id)).first()
+    if track_id is None:
         return JSONResponse({"detail": "No such id"}, status_code=404)
 
-    track.plays_count += 1
-    session.add(track)
-    session.commit()
+    # Уведомление о начале воспроизведения не считается прослушиванием
+    if submission:
+        played_at = (
+            None
+            if time is None
+            else datetime.fromtimestamp(time / 1000, tz=timezone.utc)
+        )
+        scrobble_buffer.add(track_id, current_user.id, played_at)
 
     rsp = SubsonicResponse()
     return rsp.to_json_rsp()
@@ -151,31 +179,51 @@ def scroble(id: int, session: Session = Depends(db.get_session)) -> JSONResponse
 
 @open_subsonic_router.get("/getSongsByGenre")
 def get_songs_by_genre(
-    genre: str, session: Session = Depends(db.get_session)
+    genre: str,
+    count: int = 10,
+    offset: int = 0,
+    musicFolderId: Optional[int] = None,
+    session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     rsp = SubsonicResponse()
     service = service_layer.TrackService(session)
-    tracks = service.get_songs_by_genre(genre)
+    tracks = service.get_songs_by_genre(genre, count, offset, musicFolderId)
     rsp.data["songsByGenre"] = OpenSubsonicFormatter.format_tracks(tracks)
     return rsp.to_json_rsp()
 
 
 @open_subsonic_router.get("/download")
-async def download(id: int, session: Session = Depends(db.get_session)) -> Response:
-    track = session.exec(select(db.Track).where(db.Track.id == id)).first()
+async def download(
+    id: int, session: AsyncSession = Depends(db.get_async_session)
+) -> Response:
+    # Обложка трека для отдачи файла не нужна
+    track = (
+        await session.exec(
+            select(db.Track.file_path, db.Track.type).where(db.Track.id == id)
+        )
+    ).first()
     if track is None:
         return JSONResponse({"detail": "No such id"}, status_code=404)
 
-    return FileResponse(track.file_path)
+    file_path, media_type = track
+    return TrackFileResponse(file_path, media_type)
 
 
 @open_subsonic_router.get("/stream")
-async def stream(id: int, session: Session = Depends(db.get_session)) -> Response:
-    track = session.exec(select(db.Track).where(db.Track.id == id)).first()
+async def stream(
+    id: int, session: AsyncSession = Depends(db.get_async_session)
+) -> Response:
+    # Обложка трека для отдачи файла не нужна
+    track = (
+        await session.exec(
+            select(db.Track.file_path, db.Track.type).where(db.Track.id == id)
+        )
+    ).first()
     if track is None:
         return JSONResponse({"detail": "No such id"}, status_code=404)
 
-    return FileResponse(track.file_path)
+    file_path, media_type = track
+    return TrackFileResponse(file_path, media_type)
 
 
 @open_subsonic_router.get("/search2")
@@ -187,15 +235,23 @@ async def search2(
     albumOffset: int = Query(default=0),
     songCount: int = Query(default=20),
     songOffset: int = Query(default=0),
-    session: Session = Depends(db.get_session),
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    service = service_layer.SearchService(session)
-    artists, albums, tracks = service.search2(
-        query, artistCount, artistOffset, albumCount, albumOffset, songCount, songOffset
+    artists, albums, tracks = await db.run_sync(
+        session,
+        lambda session: service_layer.SearchService(session).search2(
+            query,
+            artistCount,
+            artistOffset,
+            albumCount,
+            albumOffset,
+            songCount,
+            songOffset,
+        ),
     )
     rsp = SubsonicResponse()
     rsp.data["searchResult2"] = OpenSubsonicFormatter.format_combination(
-        artists, albums, tracks
+        artists.items, albums.items, tracks.items
     )
 
     return rsp.to_json_rsp()
@@ -210,24 +266,49 @@ async def search3(
     albumOffset: int = Query(default=0),
     songCount: int = Query(default=20),
     songOffset: int = Query(default=0),
-    session: Session = Depends(db.get_session),
+    artistCursor: Optional[str] = None,
+    albumCursor: Optional[str] = None,
+    songCursor: Optional[str] = None,
+    session: AsyncSession = Depends(db.get_async_session),
 ) -> JSONResponse:
-    service = service_layer.SearchService(session)
-    artists, albums, tracks = service.search3(
-        query, artistCount, artistOffset, albumCount, albumOffset, songCount, songOffset
-    )
+    try:
+        artists, albums, tracks = await db.run_sync(
+            session,
+            lambda session: service_layer.SearchService(session).search3(
+                query,
+                artistCount,
+                artistOffset,
+                albumCount,
+                albumOffset,
+                songCount,
+                songOffset,
+                artistCursor,
+                albumCursor,
+                songCursor,
+            ),
+        )
+    except ValueError:
+        return JSONResponse({"detail": "Invalid cursor"}, status_code=400)
     rsp = SubsonicResponse()
     rsp.data["searchResult3"] = OpenSubsonicFormatter.format_combination(
-        artists, albums, tracks
+        artists.items,
+        albums.items,
+        tracks.items,
+        next_artist_cursor=artists.next_cursor,
+        next_album_cursor=albums.next_cursor,
+        next_song_cursor=tracks.next_cursor,
     )
 
     return rsp.to_json_rsp()
 
 
 @open_subsonic_router.get("/getGenres")
-async def get_genres(session: Session = Depends(db.get_session)) -> JSONResponse:
-    service = service_layer.GenreService(session)
-    genres: List[dto.Genre] = service.get_genres()
+async def get_genres(
+    session: AsyncSession = Depends(db.get_async_session),
+) -> JSONResponse:
+    genres: List[dto.Genre] = await db.run_sync(
+        session, lambda session: service_layer.GenreService(session).get_genres()
+    )
 
     rsp = SubsonicResponse()
     rsp.data["genres"] = OpenSubsonicFormatter.format_genres(genres)
@@ -253,10 +334,11 @@ def get_random_songs(
     genre: Optional[str] = None,
     fromYear: Optional[str] = None,
     toYear: Optional[str] = None,
+    musicFolderId: Optional[int] = None,
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     service = service_layer.TrackService(session)
-    tracks = service.get_random_songs(size, genre, fromYear, toYear)
+    tracks = service.get_random_songs(size, genre, fromYear, toYear, musicFolderId)
     if tracks is None:
         return JSONResponse({"detail": "No page found"}, status_code=404)
 
@@ -368,7 +450,7 @@ def update_playlist(
 
 @open_subsonic_router.get("/getIndexes")
 def get_indexes(
-    musicFolderId: str = Query(default=""),
+    musicFolderId: Optional[int] = None,
     ifModifiedSince: int = Query(default=0),
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
@@ -385,13 +467,14 @@ def get_indexes(
 
 @open_subsonic_router.get("/getArtists")
 def get_artists(
-    musicFolderId: str = Query(default=""),
+    musicFolderId: Optional[int] = None,
+    ifModifiedSince: int = Query(default=0),
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     index_service = service_layer.IndexService(session)
 
     indexes: dto.Indexes = index_service.get_indexes_artists(
-        musicFolderId, with_childs=False
+        musicFolderId, ifModifiedSince
     )
 
     rsp = SubsonicResponse()
@@ -460,25 +543,42 @@ def get_starred2(
 
 
 @open_subsonic_router.get("/startScan")
-async def start_scan(session: Session = Depends(db.get_session)) -> JSONResponse:
-    db_loading.scanStatus["scanning"] = True
-    db_loading.scanStatus["count"] = 0
+def start_scan(fullScan: bool = False) -> JSONResponse:
+    scan_manager.start(full_scan=fullScan)
 
-    utils.clear_media(session)
-    asyncio.get_running_loop().run_in_executor(None, db_loading.scan_and_load)
+    rsp = SubsonicResponse()
+    rsp.data["scanStatus"] = db_loading.scanStatus.to_dict()
+    return rsp.to_json_rsp()
+
+
+@open_subsonic_router.get("/cancelScan")
+def cancel_scan() -> JSONResponse:
+    scan_manager.cancel()
 
     rsp = SubsonicResponse()
-    rsp.data["scanStatus"] = db_loading.scanStatus
+    rsp.data["scanStatus"] = db_loading.scanStatus.to_dict()
     return rsp.to_json_rsp()
 
 
 @open_subsonic_router.get("/getScanStatus")
 def get_scan_status() -> JSONResponse:
     rsp = SubsonicResponse()
-    rsp.data["scanStatus"] = db_loading.scanStatus
+    rsp.data["scanStatus"] = db_loading.scanStatus.to_dict()
     return rsp.to_json_rsp()
 
 
+def album_list_user_id(
+    type: str,
+    u: Optional[str] = None,
+    p: Optional[str] = None,
+    session: Session = Depends(db.get_session),
+) -> int | None:
+    # Списки по истории прослушиваний у каждого пользователя свои
+    if type not in ("frequent", "recent"):
+        return None
+    return authenticate_user(u, p, session).id
+
+
 @open_subsonic_router.get("/getAlbumList")
 def get_album_list(
     type: str,
@@ -487,7 +587,9 @@ def get_album_list(
     fromYear: Optional[str] = None,
     toYear: Optional[str] = None,
     genre: Optional[str] = None,
-    musicFolderId: Optional[str] = None,
+    musicFolderId: Optional[int] = None,
+    cursor: Optional[str] = None,
+    user_id: int | None = Depends(album_list_user_id),
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     album_service = service_layer.AlbumService(session)
@@ -502,20 +604,37 @@ def get_album_list(
             request_type = service_layer.RequestType.BY_ARTIST
         case "byYear":
             request_type = service_layer.RequestType.BY_YEAR
-        case "newest" | "highest" | "frequent" | "recent" | "byGenre":
+        case "frequent":
+            request_type = service_layer.RequestType.FREQUENT
+        case "recent":
+            request_type = service_layer.RequestType.RECENT
+        case "newest" | "highest" | "byGenre":
             # Not implemented
             request_type = service_layer.RequestType.BY_NAME
         case _:
             return JSONResponse({"detail": "Invalid arguments"}, status_code=400)
 
-    albums = album_service.get_album_list(
-        request_type, size, offset, fromYear, toYear, genre, musicFolderId
-    )
+    try:
+        albums = album_service.get_album_list(
+            request_type,
+            size,
+            offset,
+            fromYear,
+            toYear,
+            genre,
+            musicFolderId,
+            cursor,
+            user_id,
+        )
+    except ValueError:
+        return JSONResponse({"detail": "Invalid cursor"}, status_code=400)
     if albums is None:
         return JSONResponse({"detail": "Invalid arguments"}, status_code=400)
 
     rsp = SubsonicResponse()
-    rsp.data["albumList"] = OpenSubsonicFormatter.format_albums(albums)
+    rsp.data["albumList"] = OpenSubsonicFormatter.format_albums(
+        albums.items, albums.next_cursor
+    )
     return rsp.to_json_rsp()
 
 
@@ -527,7 +646,9 @@ def get_album_list2(
     fromYear: Optional[str] = None,
     toYear: Optional[str] = None,
     genre: Optional[str] = None,
-    musicFolderId: Optional[str] = None,
+    musicFolderId: Optional[int] = None,
+    cursor: Optional[str] = None,
+    user_id: int | None = Depends(album_list_user_id),
     session: Session = Depends(db.get_session),
 ) -> JSONResponse:
     album_service = service_layer.AlbumService(session)
@@ -542,20 +663,37 @@ def get_album_list2(
             request_type = service_layer.RequestType.BY_ARTIST
         case "byYear":
             request_type = service_layer.RequestType.BY_YEAR
-        case "newest" | "highest" | "frequent" | "recent" | "byGenre":
+        case "frequent":
+            request_type = service_layer.RequestType.FREQUENT
+        case "recent":
+            request_type = service_layer.RequestType.RECENT
+        case "newest" | "highest" | "byGenre":
             # Not implemented
             request_type = service_layer.RequestType.BY_NAME
         case _:
             return JSONResponse({"detail": "Invalid arguments"}, status_code=400)
 
-    albums = album_service.get_album_list(
-        request_type, size, offset, fromYear, toYear, genre, musicFolderId
-    )
+    try:
+        albums = album_service.get_album_list(
+            request_type,
+            size,
+            offset,
+            fromYear,
+            toYear,
+            genre,
+            musicFolderId,
+            cursor,
+            user_id,
+        )
+    except ValueError:
+        return JSONResponse({"detail": "Invalid cursor"}, status_code=400)
     if albums is None:
         return JSONResponse({"detail": "Invalid arguments"}, status_code=400)
 
     rsp = SubsonicResponse()
-    rsp.data["albumList2"] = OpenSubsonicFormatter.format_albums(albums)
+    rsp.data["albumList2"] = OpenSubsonicFormatter.format_albums(
+        albums.items, albums.next_cursor
+    )
     return rsp.to_json_rsp()
 
 
@@ -569,9 +707,12 @@ def get_open_subsonic_extensions() -> JSONResponse:
 
 
 @open_subsonic_router.get("/getMusicFolders")
-def get_music_folders() -> JSONResponse:
+def get_music_folders(session: Session = Depends(db.get_session)) -> JSONResponse:
+    service = service_layer.MusicFolderService(session)
     rsp = SubsonicResponse()
-    rsp.data["musicFolders"] = {"musicFolder": [{"id": 1, "name": "tracks"}]}
+    rsp.data["musicFolders"] = OpenSubsonicFormatter.format_music_folders(
+        service.get_music_folders()
+    )
     return rsp.to_json_rsp()
 
 
@@ -637,6 +778,14 @@ def get_cover_art(
         if artist is None:
             return JSONResponse({"detail": "No such artist id"}, status_code=404)
 
+        # Обложка исполнителя - обложка его последнего альбома
+        album_helpers = db_helpers.AlbumDBHelper(session)
+        artist_albums = album_helpers.get_sorted_artist_albums(artist.id, 1, 0).items
+        if len(artist_albums) > 0:
+            track = album_helpers.get_first_track(artist_albums[0].id)
+            if track is not None:
+                image_bytes = utils.get_cover_art(track)
+
     else:
         return JSONResponse({"detail": "No such prefix"}, status_code=404)
 
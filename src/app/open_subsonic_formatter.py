@@ -38,7 +38,7 @@ def add_datetime_if_not_none(
     rsp: Dict[str, Any], attr: str, dt: datetime | None
 ) -> None:
     if dt is not None:
-        rsp[attr] = dt.isoformat()
+        rsp[attr] = dt
 
 
 class OpenSubsonicFormatter:
@@ -63,7 +63,11 @@ class OpenSubsonicFormatter:
         result = {"id": artist_item.id, "name": artist_item.name}
 
         add_if_not_none(result, "albumCount", artist_item.album_count)
-        add_if_not_none(result, "coverArt", artist_item.cover_art_id)
+        add_if_not_none(
+            result,
+            "coverArt",
+            f"ar-{artist_item.cover_art_id}" if artist_item.cover_art_id else None,
+        )
         add_datetime_if_not_none(result, "coverArt", artist_item.starred)
 
         return result
@@ -163,8 +167,12 @@ class OpenSubsonicFormatter:
         return result
 
     @staticmethod
-    def format_albums(albums: Sequence[Album]) -> dict[str, Any]:
-        return {"album": list(map(OpenSubsonicFormatter.format_album, albums))}
+    def format_albums(
+        albums: Sequence[Album], next_cursor: str | None = None
+    ) -> dict[str, Any]:
+        result = {"album": list(map(OpenSubsonicFormatter.format_album, albums))}
+        add_if_not_none(result, "nextCursor", next_cursor)
+        return result
 
     @staticmethod
     def format_artist(artist: Artist) -> dict[str, Any]:
@@ -173,6 +181,12 @@ class OpenSubsonicFormatter:
             "name": artist.name,
         }
 
+        add_if_not_none(result, "albumCount", artist.album_count)
+        add_if_not_none(
+            result,
+            "coverArt",
+            f"ar-{artist.cover_art_id}" if artist.cover_art_id else None,
+        )
         add_if_not_none(result, "artistImageUrl", artist.artist_image_url)
 
         add_datetime_if_not_none(result, "starred", artist.starred)
@@ -195,6 +209,9 @@ class OpenSubsonicFormatter:
         albums: Sequence[Album] = [],
         tracks: Sequence[Track] = [],
         playlists: Sequence[Playlist] = [],
+        next_artist_cursor: str | None = None,
+        next_album_cursor: str | None = None,
+        next_song_cursor: str | None = None,
     ) -> dict[str, Any]:
         result: dict[str, Any] = {}
 
@@ -222,6 +239,10 @@ class OpenSubsonicFormatter:
             list(map(OpenSubsonicFormatter.format_playlist, playlists)),
         )
 
+        add_if_not_none(result, "nextArtistCursor", next_artist_cursor)
+        add_if_not_none(result, "nextAlbumCursor", next_album_cursor)
+        add_if_not_none(result, "nextSongCursor", next_song_cursor)
+
         return result
 
     @staticmethod
@@ -244,7 +265,7 @@ class OpenSubsonicFormatter:
     def format_indexes(indexes: Indexes) -> dict[str, Any]:
         result = {
             "ignoredArticles": " ".join(indexes.ignored_articles),
-            "lastModified": indexes.last_modified.timestamp() * 1000,
+            "lastModified": int(indexes.last_modified.timestamp() * 1000),
         }
 
         add_list_if_not_empty(
@@ -274,8 +295,8 @@ class OpenSubsonicFormatter:
             "name": playlist.name,
             "songCount": playlist.song_count,
             "duration": playlist.duration,
-            "created": playlist.created.isoformat(),
-            "changed": playlist.changed.isoformat(),
+            "created": playlist.created,
+            "changed": playlist.changed,
         }
 
         add_if_not_none(result, "comment", playlist.comment)
@@ -295,3 +316,15 @@ class OpenSubsonicFormatter:
     @staticmethod
     def format_playlists(playlists: Sequence[Playlist]) -> dict[str, Any]:
         return {"playlist": list(map(OpenSubsonicFormatter.format_playlist, playlists))}
+
+    @staticmethod
+    def format_music_folder(music_folder: MusicFolder) -> dict[str, Any]:
+        return {"id": music_folder.id, "name": music_folder.name}
+
+    @staticmethod
+    def format_music_folders(music_folders: Sequence[MusicFolder]) -> dict[str, Any]:
+        return {
+            "musicFolder": list(
+                map(OpenSubsonicFormatter.format_music_folder, music_folders)
+            )
+        }
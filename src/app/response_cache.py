@@ -0,0 +1,224 @@
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import event
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from . import config
+from . import database as db
+
+
+# Ответы этих эндпоинтов не зависят от пользователя и меняются только
+# вместе с версией библиотеки (и прослушиваний для PLAY_COUNT_PATHS),
+# кроме списков из UNCACHED_TYPES
+CACHED_PATHS = {
+    "/rest/getIndexes",
+    "/rest/getArtists",
+    "/rest/getArtist",
+    "/rest/getAlbum",
+    "/rest/getGenres",
+    "/rest/getAlbumList",
+    "/rest/getAlbumList2",
+}
+# Параметры авторизации и клиента не влияют на ответ, без них
+# разные клиенты получают одну и ту же запись кеша
+IGNORED_PARAMS = {"u", "p", "t", "s", "c", "v", "f"}
+# Случайные списки разные при каждом запросе, а списки по истории
+# прослушиваний у каждого пользователя свои
+UNCACHED_TYPES = {"random", "frequent", "recent"}
+# В ответах этих эндпоинтов есть счётчики прослушиваний треков,
+# поэтому они зависят ещё и от версии прослушиваний
+PLAY_COUNT_PATHS = {
+    "/rest/getIndexes",
+    "/rest/getAlbum",
+    "/rest/getSong",
+    "/rest/getSongsByGenre",
+    "/rest/search2",
+    "/rest/search3",
+    "/rest/getPlaylist",
+    "/rest/getStarred",
+    "/rest/getStarred2",
+}
+
+# Путь, параметры, версия библиотеки и версия прослушиваний
+CacheKey = tuple[str, str, int, int]
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+
+    def size(self) -> int:
+        return len(self.body) + sum(len(k) + len(v) for k, v in self.headers)
+
+
+def response_version(path: str, state: db.LibraryState) -> tuple[int, int]:
+    if path in PLAY_COUNT_PATHS:
+        return state.version, state.plays_version or 0
+    return state.version, 0
+
+
+def normalized_params(scope: Any) -> list[tuple[str, str]]:
+    params = parse_qsl(scope.get("query_string", b"").decode("latin-1"))
+    return sorted((k, v) for k, v in params if k not in IGNORED_PARAMS)
+
+
+class ResponseCache:
+    # LRU-кеш готовых ответов в пределах max_bytes. Вместе с ответами хранит
+    # версии библиотеки и прослушиваний, чтобы повторные запросы
+    # не обращались к SQLite.
+    # Кеш сбрасывается после каждой транзакции, увеличившей версию; изменения
+    # из других процессов он не видит
+    def __init__(self, max_bytes: int = config.RESPONSE_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[CacheKey, CachedResponse] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.state: db.LibraryState | None = None
+        # Растёт при сбросе, чтобы не сохранить версию, прочитанную до него
+        self.generation = 0
+
+    def invalidate(self, plays_only: bool = False) -> None:
+        with self.lock:
+            if plays_only:
+                # Ответы без счётчиков прослушиваний остаются в кеше
+                for key in [k for k in self.entries if k[0] in PLAY_COUNT_PATHS]:
+                    self.size -= self.entries.pop(key).size()
+            else:
+                self.entries.clear()
+                self.size = 0
+            self.state = None
+            self.generation += 1
+
+    async def library_state(self) -> db.LibraryState:
+        with self.lock:
+            state, generation = self.state, self.generation
+        if state is not None:
+            return state
+
+        async with AsyncSession(db.async_engine) as session:
+            state = (
+                await session.get(db.LibraryState, db.LIBRARY_STATE_ID)
+                or db.initial_library_state()
+            )
+        with self.lock:
+            if self.generation == generation:
+                self.state = state
+        return state
+
+    def get(self, key: CacheKey) -> CachedResponse | None:
+        with self.lock:
+            response = self.entries.get(key)
+            if response is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key: CacheKey, response: CachedResponse) -> None:
+        size = response.size()
+        with self.lock:
+            # Ответ, посчитанный до смены версии, уже никому не нужен
+            if self.state is None or response_version(key[0], self.state) != key[2:]:
+                return
+            if size > self.max_bytes or key in self.entries:
+                return
+            self.entries[key] = response
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size()
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "sizeBytes": self.size,
+                "maxBytes": self.max_bytes,
+            }
+
+
+response_cache = ResponseCache()
+
+
+def invalidate_on_commit(session: Session) -> None:
+    plays_bumped = session.info.pop("plays_version_bumped", False)
+    if session.info.pop("library_version_bumped", False):
+        response_cache.invalidate()
+    elif plays_bumped:
+        response_cache.invalidate(plays_only=True)
+
+
+event.listen(Session, "after_commit", invalidate_on_commit)
+
+
+class ResponseCacheMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+        self.cache = response_cache
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or scope["path"] not in CACHED_PATHS
+            or self.cache.max_bytes <= 0
+        ):
+            await self.app(scope, receive, send)
+            return
+        params = normalized_params(scope)
+        if any(k == "type" and v in UNCACHED_TYPES for k, v in params):
+            await self.app(scope, receive, send)
+            return
+
+        state = await self.cache.library_state()
+        key = (
+            scope["path"],
+            urlencode(params),
+            *response_version(scope["path"], state),
+        )
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": cached.status,
+                    "headers": cached.headers,
+                }
+            )
+            await send({"type": "http.response.body", "body": cached.body})
+            return
+
+        start: dict[str, Any] = {}
+        chunks: list[bytes] = []
+
+        async def send_and_capture(message: Any) -> None:
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False) and start["status"] == 200:
+                    self.cache.put(
+                        key,
+                        CachedResponse(
+                            start["status"],
+                            list(start.get("headers", [])),
+                            b"".join(chunks),
+                        ),
+                    )
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
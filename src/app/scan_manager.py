@@ -0,0 +1,71 @@
+import logging
+import threading
+
+from typing import Sequence
+
+from . import config
+from . import db_loading
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScanManager:
+    # Одновременно выполняется не больше одного сканирования,
+    # повторный запуск во время сканирования присоединяется к текущему
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.cancelled = threading.Event()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(
+        self,
+        directory_paths: Sequence[str] = config.MUSIC_DIRECTORIES,
+        workers: int = config.SCAN_WORKERS,
+        full_scan: bool = False,
+    ) -> bool:
+        with self.lock:
+            if self.is_running():
+                return False
+
+            self.cancelled = threading.Event()
+            db_loading.scanStatus.start()
+            self.thread = threading.Thread(
+                target=self.run,
+                args=(directory_paths, workers, full_scan, self.cancelled),
+                name="library-scan",
+                daemon=True,
+            )
+            self.thread.start()
+            return True
+
+    def cancel(self) -> bool:
+        with self.lock:
+            if not self.is_running():
+                return False
+            self.cancelled.set()
+            return True
+
+    def wait(self, timeout: float | None = None) -> None:
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def run(
+        self,
+        directory_paths: Sequence[str],
+        workers: int,
+        full_scan: bool,
+        cancelled: threading.Event,
+    ) -> None:
+        try:
+            db_loading.scan_and_load(directory_paths, workers, full_scan, cancelled)
+        except Exception:
+            logger.exception("Error while scanning library")
+            db_loading.scanStatus.finish()
+
+
+scan_manager = ScanManager()
@@ -0,0 +1,139 @@
+import logging
+import threading
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, insert, update
+from sqlmodel import Session, col, select
+
+from . import config
+from . import database as db
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Scrobble:
+    track_id: int
+    user_id: int
+    played_at: datetime
+
+
+def write_scrobbles(session: Session, scrobbles: list[Scrobble]) -> None:
+    # Треки могли удалить, пока прослушивания ждали записи
+    track_ids = {s.track_id for s in scrobbles}
+    existing = set(
+        session.exec(select(db.Track.id).where(col(db.Track.id).in_(track_ids))).all()
+    )
+    scrobbles = [s for s in scrobbles if s.track_id in existing]
+    if len(scrobbles) == 0:
+        return
+
+    # Счётчик увеличивается в самом UPDATE, а не перезаписывается
+    # прочитанным значением, поэтому параллельные прослушивания не теряются.
+    # UPDATE идёт мимо сессии и увеличивает версию прослушиваний, а не библиотеки
+    session.info["plays_changed"] = True
+    session.connection().execute(
+        update(db.Track)
+        .where(col(db.Track.id) == bindparam("b_id"))
+        .values(plays_count=col(db.Track.plays_count) + bindparam("b_count")),
+        [
+            {"b_id": track_id, "b_count": count}
+            for track_id, count in Counter(s.track_id for s in scrobbles).items()
+        ],
+    )
+    session.execute(
+        insert(db.PlayHistory),
+        [
+            {
+                "track_id": s.track_id,
+                "user_id": s.user_id,
+                # Время без часового пояса считается местным
+                "played_at": s.played_at.astimezone(timezone.utc),
+            }
+            for s in scrobbles
+        ],
+    )
+
+
+class ScrobbleBuffer:
+    # Прослушивания копятся в памяти и записываются одной транзакцией
+    # раз в flush_interval секунд или когда их набралось max_size
+    def __init__(
+        self,
+        flush_interval: float = config.SCROBBLE_FLUSH_SECONDS,
+        max_size: int = config.SCROBBLE_BUFFER_SIZE,
+    ) -> None:
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending: list[Scrobble] = []
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def add(
+        self, track_id: int, user_id: int, played_at: datetime | None = None
+    ) -> None:
+        scrobble = Scrobble(track_id, user_id, played_at or datetime.now(timezone.utc))
+        with self.lock:
+            self.pending.append(scrobble)
+            full = len(self.pending) >= self.max_size
+            if self.thread is None or not self.thread.is_alive():
+                self.stopped = threading.Event()
+                self.thread = threading.Thread(
+                    target=self.run,
+                    args=(self.stopped,),
+                    name="scrobble-flush",
+                    daemon=True,
+                )
+                self.thread.start()
+        if full:
+            self.wakeup.set()
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self.pending)
+
+    def flush(self) -> int:
+        with self.flush_lock:
+            with self.lock:
+                scrobbles, self.pending = self.pending, []
+            if len(scrobbles) == 0:
+                return 0
+            try:
+                with Session(db.engine) as session:
+                    write_scrobbles(session, scrobbles)
+                    session.commit()
+            except Exception:
+                # Прослушивания возвращаются в буфер и запишутся в следующий раз
+                with self.lock:
+                    self.pending = scrobbles + self.pending
+                raise
+            return len(scrobbles)
+
+    def stop(self) -> None:
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+            self.stopped.set()
+        self.wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+
+    def run(self, stopped: threading.Event) -> None:
+        while not stopped.is_set():
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Error while writing scrobbles")
+
+
+scrobble_buffer = ScrobbleBuffer()
@@ -4,13 +4,15 @@ from enum import Enum
 from dataclasses import dataclass
 from datetime import datetime
 from functools import partial
-from typing import List, Optional, Dict, Sequence, Set, Tuple, Union, Any, cast
+from itertools import groupby
+from typing import List, Optional, Dict, Sequence, Tuple, Union, Any, cast
 
 from sqlmodel import Session, select
 from mutagen.id3 import USLT  # type: ignore
 
 from src.app import dto
 
+from . import config
 from . import database as db
 from . import db_helpers
 from .utils import get_audio_object, AudioType
@@ -44,36 +46,15 @@ def get_album_artist_id_by_album(album: db.Album) -> int:
     return -1
 
 
-def get_tracklist_duration(db_tracks: Sequence[db.Track]) -> int:
-    if len(db_tracks) == 0:
-        return 0
-    return int(sum([t.duration for t in db_tracks]))
-
-
-def get_album_genre(db_album: db.Album) -> Optional[str]:
-    if len(db_album.tracks) == 0:
-        return None
-    return join_genre_names(db_album.tracks[0].genres)
-
-
-def get_album_genres(db_album: db.Album) -> Set[db.Genre]:
-    genres: Set[db.Genre] = set()
-    if len(db_album.tracks) == 0:
-        return genres
-    for track in db_album.tracks:
-        genres.update(track.genres)
-    return genres
-
-
 def fill_album(
     db_album: db.Album, db_user: db.User | None, with_songs: bool = False
 ) -> dto.Album:
-    album_genres: List[db.Genre] = list(get_album_genres(db_album))
+    album_genres: List[db.Genre] = db_album.genres
     album = dto.Album(
         id=db_album.id,
         name=db_album.name,
         song_count=db_album.total_tracks,
-        duration=get_tracklist_duration(db_album.tracks),
+        duration=db_album.duration,
         created=datetime.now(),
         artist=join_artist_names(db_album.artists),
         artist_id=get_album_artist_id_by_album(db_album),
@@ -103,7 +84,7 @@ class AlbumService:
         self.album_db_helper = db_helpers.AlbumDBHelper(session)
 
     def get_album_by_id(self, id: int) -> Optional[dto.Album]:
-        db_album = self.album_db_helper.get_album_by_id(id)
+        db_album = self.album_db_helper.get_album_by_id(id, with_songs=True)
         if db_album:
             return fill_album(db_album, None, with_songs=True)
         return None
@@ -116,51 +97,58 @@ class AlbumService:
         from_year: Optional[str] = None,
         to_year: Optional[str] = None,
         genre: Optional[str] = None,
-        music_folder_id: Optional[str] = None,
-    ) -> Optional[List[dto.Album]]:
-        result = []
+        music_folder_id: Optional[int] = None,
+        cursor: Optional[str] = None,
+        user_id: Optional[int] = None,
+    ) -> Optional[dto.Page[dto.Album]]:
+        result: dto.Page[db.Album]
         match type:
             case RequestType.RANDOM:
-                albums = self.album_db_helper.get_all_albums()
-                result = random.sample(albums, min(size, len(albums)))
+                result = dto.Page(
+                    list(self.album_db_helper.get_random_albums(size, music_folder_id))
+                )
             case RequestType.BY_NAME:
-                result = list(self.album_db_helper.get_albums_by_name(size, offset))
+                result = self.album_db_helper.get_albums_by_name(
+                    size, offset, music_folder_id, cursor
+                )
             case RequestType.BY_ARTIST:
-                albums = list(self.album_db_helper.get_all_albums())
-                albums.sort(key=lambda album: self.compare_albums_by_artist(album.id))
-                result = albums[offset : offset + size]
+                result = self.album_db_helper.get_albums_by_artist(
+                    size, offset, music_folder_id, cursor
+                )
             case RequestType.BY_YEAR if from_year is not None and to_year is not None:
-                albums = self.album_db_helper.get_all_albums()
-                result = [
-                    album
-                    for album in albums
-                    if album.year
-                    and min(from_year, to_year) <= album.year <= max(from_year, to_year)
-                ][offset : size + offset]
-                if from_year > to_year:
-                    result.reverse()
-            case (
-                RequestType.NEWEST
-                | RequestType.HIGHEST
-                | RequestType.FREQUENT
-                | RequestType.RECENT
-                | RequestType.BY_GENRE
-            ):
+                result = self.album_db_helper.get_albums_by_year(
+                    from_year, to_year, size, offset, music_folder_id, cursor
+                )
+            case RequestType.FREQUENT if user_id is not None:
+                result = self.album_db_helper.get_frequent_albums(
+                    user_id, size, offset, music_folder_id, cursor
+                )
+            case RequestType.RECENT if user_id is not None:
+                result = self.album_db_helper.get_recent_albums(
+                    user_id, size, offset, music_folder_id, cursor
+                )
+            case RequestType.NEWEST | RequestType.HIGHEST | RequestType.BY_GENRE:
                 raise NotImplementedError()
             case _:  # validation error
                 return None
 
-        return fill_albums(result, None, with_songs=False)
-
-    def compare_albums_by_artist(self, album_id: int) -> str:
-        artist: Optional[db.Artist] = self.album_db_helper.get_album_artist(album_id)
-        return "" if artist is None else artist.name
+        return dto.Page(
+            fill_albums(result.items, None, with_songs=False), result.next_cursor
+        )
 
     def get_sorted_artist_albums(
-        self, artistId: int, size: int = 10, offset: int = 0
-    ) -> List[dto.Album]:
-        albums = self.album_db_helper.get_sorted_artist_albums(artistId, size, offset)
-        return fill_albums(albums, None, with_songs=False)
+        self,
+        artistId: int,
+        size: int = 10,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ) -> dto.Page[dto.Album]:
+        albums = self.album_db_helper.get_sorted_artist_albums(
+            artistId, size, offset, cursor
+        )
+        return dto.Page(
+            fill_albums(albums.items, None, with_songs=False), albums.next_cursor
+        )
 
 
 def join_artist_names(artists: Sequence[db.Artist]) -> Optional[str]:
@@ -192,6 +180,8 @@ def fill_artist_item(artist: db.Artist) -> dto.ArtistItem:
     return dto.ArtistItem(
         id=artist.id,
         name=artist.name,
+        album_count=artist.album_count,
+        cover_art_id=artist.id if artist.album_count > 0 else None,
     )
 
 
@@ -268,10 +258,12 @@ class TrackService:
         genre: str,
         count: int = 10,
         offset: int = 0,
-        music_folder: str | None = None,
+        music_folder_id: int | None = None,
     ) -> List[dto.Track]:
         return fill_tracks(
-            self.track_db_helper.get_tracks_by_genre_name(genre, count, offset),
+            self.track_db_helper.get_tracks_by_genre_name(
+                genre, count, offset, music_folder_id
+            ),
             None,
         )
 
@@ -281,20 +273,11 @@ class TrackService:
         genre: Optional[str] = None,
         from_year: Optional[str] = None,
         to_year: Optional[str] = None,
-        music_folder_id: Optional[str] = None,
+        music_folder_id: Optional[int] = None,
     ) -> List[dto.Track]:
-        tracks = self.track_db_helper.get_all_tracks()
-        if genre:
-            tracks = self.track_db_helper.get_tracks_by_genre_name(genre)
-        if from_year:
-            tracks = list(
-                filter(lambda track: track.year and track.year >= from_year, tracks)
-            )
-        if to_year:
-            tracks = list(
-                filter(lambda track: track.year and track.year <= to_year, tracks)
-            )
-        random_tracks = random.sample(tracks, min(size, len(tracks)))
+        random_tracks = self.track_db_helper.get_random_tracks(
+            size, genre, from_year, to_year, music_folder_id
+        )
         return fill_tracks(random_tracks, None)
 
     def extract_lyrics(self, id: int) -> Optional[List[Dict[str, Any]]]:
@@ -320,9 +303,11 @@ class TrackService:
 
 
 def fill_genre(db_genre: db.Genre) -> dto.Genre:
-    albumCount = len(set([t.album_id for t in db_genre.tracks]))
-    songCount = len(db_genre.tracks)
-    return dto.Genre(albumCount=albumCount, songCount=songCount, name=db_genre.name)
+    return dto.Genre(
+        albumCount=db_genre.album_count,
+        songCount=db_genre.song_count,
+        name=db_genre.name,
+    )
 
 
 def fill_genres(db_genres: Sequence[db.Genre]) -> List[dto.Genre]:
@@ -348,6 +333,8 @@ def fill_artist(
     result = dto.Artist(
         id=db_artist.id,
         name=db_artist.name,
+        album_count=db_artist.album_count,
+        cover_art_id=db_artist.id if db_artist.album_count > 0 else None,
         artist_image_url=None,
         starred=None,
     )
@@ -384,7 +371,9 @@ class ArtistService:
         return ", ".join(a.name for a in artists)
 
     def get_artist_by_id(self, id: int) -> Optional[dto.Artist]:
-        db_artist = self.artist_db_helper.get_artist_by_id(id)
+        db_artist = self.artist_db_helper.get_artist_by_id(
+            id, with_albums=True, with_songs=True
+        )
         if db_artist:
             return fill_artist(db_artist, None, with_albums=True, with_songs=True)
         return None
@@ -405,22 +394,33 @@ class SearchService:
         album_offset: int,
         song_count: int,
         song_offset: int,
-    ) -> Tuple[Sequence[dto.Artist], Sequence[dto.Album], Sequence[dto.Track]]:
+        artist_cursor: Optional[str] = None,
+        album_cursor: Optional[str] = None,
+        song_cursor: Optional[str] = None,
+    ) -> Tuple[dto.Page[dto.Artist], dto.Page[dto.Album], dto.Page[dto.Track]]:
 
         db_artists = self.artist_db_helper.get_artists(
-            artist_count, artist_offset, filter_name=query
+            artist_count, artist_offset, filter_name=query, cursor=artist_cursor
         )
         db_albums = self.album_db_helper.get_albums(
-            album_count, album_offset, filter_name=query
+            album_count, album_offset, filter_name=query, cursor=album_cursor
         )
         db_tracks = self.track_db_helper.get_tracks(
-            song_count, song_offset, filter_title=query
+            song_count, song_offset, filter_title=query, cursor=song_cursor
         )
 
         return (
-            fill_artists(db_artists, None, with_albums=False, with_songs=False),
-            fill_albums(db_albums, None, with_songs=False),
-            fill_tracks(db_tracks, None),
+            dto.Page(
+                fill_artists(
+                    db_artists.items, None, with_albums=False, with_songs=False
+                ),
+                db_artists.next_cursor,
+            ),
+            dto.Page(
+                fill_albums(db_albums.items, None, with_songs=False),
+                db_albums.next_cursor,
+            ),
+            dto.Page(fill_tracks(db_tracks.items, None), db_tracks.next_cursor),
         )
 
     def search3(
@@ -432,7 +432,10 @@ class SearchService:
         album_offset: int,
         song_count: int,
         song_offset: int,
-    ) -> Tuple[Sequence[dto.Artist], Sequence[dto.Album], Sequence[dto.Track]]:
+        artist_cursor: Optional[str] = None,
+        album_cursor: Optional[str] = None,
+        song_cursor: Optional[str] = None,
+    ) -> Tuple[dto.Page[dto.Artist], dto.Page[dto.Album], dto.Page[dto.Track]]:
         if query != "":
             return self.search2(
                 query,
@@ -442,15 +445,20 @@ class SearchService:
                 album_offset,
                 song_count,
                 song_offset,
+                artist_cursor,
+                album_cursor,
+                song_cursor,
             )
         db_artists = self.artist_db_helper.get_all_artists()
         db_albums = self.album_db_helper.get_all_albums()
         db_tracks = self.track_db_helper.get_all_tracks()
 
         return (
-            fill_artists(db_artists, None, with_albums=False, with_songs=False),
-            fill_albums(db_albums, None, with_songs=False),
-            fill_tracks(db_tracks, None),
+            dto.Page(
+                fill_artists(db_artists, None, with_albums=False, with_songs=False)
+            ),
+            dto.Page(fill_albums(db_albums, None, with_songs=False)),
+            dto.Page(fill_tracks(db_tracks, None)),
         )
 
 
@@ -521,9 +529,7 @@ def fill_playlist(
         id=db_playlist.id,
         name=db_playlist.name,
         song_count=db_playlist.total_tracks,
-        duration=get_tracklist_duration(
-            playlist_tracks_to_tracks(db_playlist.playlist_tracks)
-        ),
+        duration=db_playlist.duration,
         created=now,
         changed=now,
         owner=db_playlist.user.login,
@@ -578,7 +584,7 @@ class PlaylistService:
         return self.playlist_db_helper.delete_playlist(id)
 
     def get_playlist(self, id: int) -> dto.Playlist | None:
-        db_playlist = self.playlist_db_helper.get_playlist(id)
+        db_playlist = self.playlist_db_helper.get_playlist(id, with_songs=True)
         if db_playlist:
             return fill_playlist(db_playlist, None, with_songs=True)
         return None
@@ -590,48 +596,59 @@ class PlaylistService:
 
 class IndexService:
     def __init__(self, session: Session):
+        self.session = session
         self.artist_db_helper = db_helpers.ArtistDBHelper(session)
         self.track_db_helper = db_helpers.TrackDBHelper(session)
 
     def get_indexes_artists(
         self,
-        music_folder_id: str = "",
+        music_folder_id: Optional[int] = None,
         if_modified_since_ms: int = 0,
         with_childs: bool = False,
     ) -> dto.Indexes:
+        state = db.get_library_state(self.session)
+        # В getIndexes есть треки со счётчиками прослушиваний
+        last_modified = (
+            state.plays_modified_at() if with_childs else state.modified_at()
+        )
         indexes: dto.Indexes = dto.Indexes(
-            last_modified=datetime.now()
-        )  #  TODO MUS-208 fill last_modified
-        artists: List[dto.Artist] = fill_artists(
-            self.artist_db_helper.get_all_artists(),
-            None,
-            with_albums=True,
-            with_songs=with_childs,
+            last_modified=last_modified, ignored_articles=config.IGNORED_ARTICLES
         )
-        sorted_artists = sorted(artists, key=lambda a: a.name)
-
-        letter: str = ""
-        letter_artists: List[dto.Artist] = []
-        for a in sorted_artists:
-            if len(a.name) > 0 and a.name[0] != letter:
-                if len(letter_artists) > 0:
-                    indexes.artist_index.append(dto.ArtistIndex(letter, letter_artists))
-                letter = a.name[0]
-                letter_artists = []
-            letter_artists.append(a)
-
-        if len(letter_artists) > 0:
-            indexes.artist_index.append(dto.ArtistIndex(letter, letter_artists))
+        # Библиотека не менялась: клиенту хватает того, что у него уже есть
+        if 0 < int(last_modified.timestamp() * 1000) <= if_modified_since_ms:
+            return indexes
+
+        # Порядок и буквы указателя хранятся в строках исполнителей
+        artists = self.artist_db_helper.get_artist_index(music_folder_id)
+        for letter, letter_artists in groupby(
+            artists, key=lambda a: a.index_letter or "#"
+        ):
+            indexes.artist_index.append(
+                dto.ArtistIndex(
+                    letter, fill_artists(list(letter_artists), None, with_albums=False)
+                )
+            )
 
         if with_childs:
-            tracks: Sequence[dto.Track] = fill_tracks(
-                self.track_db_helper.get_all_tracks(), None
+            indexes.tracks.extend(
+                fill_tracks(
+                    self.track_db_helper.get_folder_root_tracks(music_folder_id), None
+                )
             )
-            indexes.tracks.extend(tracks)
-
         return indexes
 
 
+class MusicFolderService:
+    def __init__(self, session: Session):
+        self.music_folder_db_helper = db_helpers.MusicFolderDBHelper(session)
+
+    def get_music_folders(self) -> List[dto.MusicFolder]:
+        return [
+            dto.MusicFolder(folder.id, folder.name)
+            for folder in self.music_folder_db_helper.get_all_music_folders()
+        ]
+
+
 def random_enum_choice(e: type[Enum]) -> Any:
     return random.choice(list(e))
 
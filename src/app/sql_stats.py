@@ -0,0 +1,139 @@
+import logging
+import re
+import sys
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from types import FrameType
+from typing import Any, Iterator
+
+from sqlalchemy import Engine, event
+
+from . import config
+
+
+logger = logging.getLogger(__name__)
+
+# Медленные запросы подписываются методом db_helpers, который их выполнил
+DB_HELPERS_MODULE = f"{__package__}.db_helpers"
+MAX_HEADER_STATEMENT = 500
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_ms: float = 0.0
+    slowest_ms: float = 0.0
+    slowest_statement: str = ""
+
+    def add(self, statement: str, elapsed_ms: float) -> None:
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms >= self.slowest_ms:
+            self.slowest_ms = elapsed_ms
+            self.slowest_statement = statement
+
+    def to_headers(self) -> list[tuple[bytes, bytes]]:
+        statement = re.sub(r"\s+", " ", self.slowest_statement).strip()
+        return [
+            (b"x-db-query-count", str(self.count).encode()),
+            (b"x-db-time-ms", f"{self.total_ms:.1f}".encode()),
+            (b"x-db-slowest-ms", f"{self.slowest_ms:.1f}".encode()),
+            (
+                b"x-db-slowest-query",
+                statement[:MAX_HEADER_STATEMENT].encode("ascii", "replace"),
+            ),
+        ]
+
+
+# Статистика текущего HTTP-запроса. Объект общий для всех потоков и
+# гринлетов, в которые копируется контекст запроса
+current_stats: ContextVar[QueryStats | None] = ContextVar("current_stats", default=None)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    stats = QueryStats()
+    token = current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        current_stats.reset(token)
+
+
+def find_caller() -> str:
+    fallback = None
+    frame: FrameType | None = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        name = f"{module}.{frame.f_code.co_qualname}"
+        if module == DB_HELPERS_MODULE:
+            return name
+        # Иначе — ближайшая к запросу функция приложения
+        if fallback is None and module.startswith(f"{__package__}."):
+            fallback = name
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+def before_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+    elapsed_ms = (time.perf_counter() - conn.info["query_start"].pop()) * 1000
+    stats = current_stats.get()
+    if stats is not None:
+        stats.add(statement, elapsed_ms)
+    if config.SLOW_QUERY_MS > 0 and elapsed_ms >= config.SLOW_QUERY_MS:
+        logger.warning(
+            "Slow query (%.1f ms) in %s: %s", elapsed_ms, find_caller(), statement
+        )
+
+
+def handle_error(context: Any) -> None:
+    # После ошибки after_cursor_execute не вызывается
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+class QueryStatsMiddleware:
+    # ASGI-обёртка без BaseHTTPMiddleware, чтобы не замедлять потоковые ответы
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_with_stats(message: Any) -> None:
+                if (
+                    message["type"] == "http.response.start"
+                    and config.SQL_DEBUG_HEADERS
+                ):
+                    message["headers"] = list(message.get("headers", [])) + (
+                        stats.to_headers()
+                    )
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
+            if stats.count > 0:
+                logger.debug(
+                    "%s %s: %d queries, %.1f ms in DB",
+                    scope["method"],
+                    scope["path"],
+                    stats.count,
+                    stats.total_ms,
+                )
@@ -1,6 +1,55 @@
-from typing import Any
+import json
+from datetime import datetime
+from typing import Any, Callable
+
 from fastapi.responses import JSONResponse
 
+from . import config
+
+try:
+    import orjson
+except ImportError:  # orjson необязателен, без него ответы кодирует json
+    orjson = None  # type: ignore
+
+
+def encode_default(value: Any) -> Any:
+    # Форматтер отдаёт даты объектами datetime, orjson кодирует их сам
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(content: Any) -> bytes:
+    # Те же параметры, что у JSONResponse из Starlette
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+        default=encode_default,
+    ).encode("utf-8")
+
+
+def dumps_orjson(content: Any) -> bytes:
+    return orjson.dumps(content, default=encode_default)
+
+
+ENCODERS: dict[str, Callable[[Any], bytes]] = {"json": dumps_json}
+if orjson is not None:
+    ENCODERS["orjson"] = dumps_orjson
+
+
+def get_encoder(name: str) -> Callable[[Any], bytes]:
+    return ENCODERS.get(name, dumps_json)
+
+
+class SubsonicJSONResponse(JSONResponse):
+    encoder = staticmethod(get_encoder(config.JSON_ENCODER))
+
+    def render(self, content: Any) -> bytes:
+        return self.encoder(content)
+
 
 class SubsonicResponse:
     def __init__(self) -> None:
@@ -17,4 +66,4 @@ class SubsonicResponse:
         self.data["error"] = {"code": code, "message": message}
 
     def to_json_rsp(self) -> JSONResponse:
-        return JSONResponse({"subsonic-response": self.data})
+        return SubsonicJSONResponse({"subsonic-response": self.data})
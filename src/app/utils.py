@@ -7,7 +7,6 @@ from mutagen.id3 import TXXX, TIT2, TPE1, TPE2, TALB, TCON, TRCK, TDRC  # type:
 from mutagen.mp3 import MP3
 from mutagen.flac import FLAC
 from sqlmodel import Session, select
-from . import service_layer
 from . import database as db
 
 MAX_COVER_PREVIEW_SIZE = 128
@@ -186,6 +185,8 @@ def update_tags(
 
 
 def create_default_user() -> None:
+    from . import service_layer
+
     service_layer.create_user(next(db.get_session()), "admin", "admin")
 
 
@@ -204,7 +205,9 @@ def clear_media(session: Session) -> None:
     clear_table(db.GenreTrack, session)
     clear_table(db.ArtistTrack, session)
     clear_table(db.ArtistAlbum, session)
+    clear_table(db.GenreAlbum, session)
     clear_table(db.PlaylistTrack, session)
+    clear_table(db.PlayHistory, session)
     session.commit()
 
 
@@ -74,3 +74,19 @@ def test_get_random_songs_with_year_filter():
 
     response = client.get("/rest/getRandomSongs?size=2&toYear=2010")
     assert not response.json()["subsonic-response"]["randomSongs"]["song"]
+
+
+def test_album_lists_by_history_require_user():
+    response = client.get("/rest/getAlbumList2", params={"type": "recent"})
+    assert response.status_code == 401
+
+    with Session(db.engine) as session:
+        session.add(db.User(login="history_user", password="secret", avatar=""))
+        session.commit()
+
+    for path in ("/rest/getAlbumList", "/rest/getAlbumList2"):
+        for type in ("frequent", "recent"):
+            params = {"type": type, "u": "history_user", "p": "secret"}
+            assert client.get(path, params=params).status_code == 200
+        response = client.get(path, params={"type": "alphabeticalByName"})
+        assert response.status_code == 200
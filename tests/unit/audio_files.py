@@ -0,0 +1,73 @@
+import struct
+
+from mutagen.flac import FLAC
+from mutagen.id3 import ID3, TALB, TCON, TIT2, TPE1, TPE2, TRCK, TDRC, TXXX  # type: ignore[attr-defined]
+
+MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+
+def write_mp3(
+    path: str,
+    title: str,
+    artists: str = "Artist",
+    album: str = "Album",
+    album_artist: str | None = None,
+    genres: str | None = None,
+    track_number: int | None = None,
+    year: str | None = None,
+    custom_tags: dict[str, str] = {},
+    frames: int = 20,
+) -> None:
+    with open(path, "wb") as f:
+        f.write(MP3_FRAME * frames)
+
+    tags = ID3()
+    tags.add(TIT2(text=[title]))
+    tags.add(TPE1(text=[artists]))
+    tags.add(TALB(text=[album]))
+    if album_artist is not None:
+        tags.add(TPE2(text=[album_artist]))
+    if genres is not None:
+        tags.add(TCON(text=[genres]))
+    if track_number is not None:
+        tags.add(TRCK(text=[str(track_number)]))
+    if year is not None:
+        tags.add(TDRC(text=[year]))
+    for name, value in custom_tags.items():
+        tags.add(TXXX(desc=name, text=value))
+    tags.save(path)
+
+
+def write_flac(
+    path: str,
+    title: str,
+    artists: list[str] = ["Artist"],
+    album: str = "Album",
+    genres: list[str] = [],
+    track_number: int | None = None,
+    year: str | None = None,
+) -> None:
+    sample_rate, channels, bits_per_sample, total_samples = 44100, 2, 16, 441000
+    stream_info = struct.pack(">HH", 4096, 4096) + b"\x00" * 6
+    stream_info += (
+        (sample_rate << 44)
+        | ((channels - 1) << 41)
+        | ((bits_per_sample - 1) << 36)
+        | total_samples
+    ).to_bytes(8, "big")
+    stream_info += b"\x00" * 16
+    with open(path, "wb") as f:
+        f.write(b"fLaC" + b"\x80" + len(stream_info).to_bytes(3, "big"))
+        f.write(stream_info)
+
+    audio = FLAC(path)
+    audio["TITLE"] = title
+    audio["ARTIST"] = artists
+    audio["ALBUM"] = album
+    if genres:
+        audio["GENRE"] = genres
+    if track_number is not None:
+        audio["TRACKNUMBER"] = str(track_number)
+    if year is not None:
+        audio["DATE"] = year
+    audio.save()
@@ -0,0 +1,214 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import event, inspect, text
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from src.app import config
+from src.app import database as db
+from src.app import db_helpers
+
+
+class TestUpgradeDB(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        self.engine_patch = patch.object(db, "engine", self.engine)
+        self.engine_patch.start()
+
+    def tearDown(self):
+        self.engine_patch.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_keeps_data_and_adds_missing_columns(self):
+        SQLModel.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE "Tracks" DROP COLUMN "file_inode"'))
+            connection.execute(
+                text(
+                    'INSERT INTO "Users" (login, password, avatar) '
+                    "VALUES ('admin', 'admin', '')"
+                )
+            )
+
+        db.upgrade_db()
+
+        columns = {c["name"] for c in inspect(self.engine).get_columns("Tracks")}
+        assert "file_inode" in columns
+        with self.engine.connect() as connection:
+            logins = connection.execute(text('SELECT login FROM "Users"')).all()
+        assert logins == [("admin",)]
+
+    def test_fills_new_aggregate_columns(self):
+        SQLModel.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text('DROP TABLE "Genre_Albums"'))
+            connection.execute(text('ALTER TABLE "Albums" DROP COLUMN "duration"'))
+            for column in ("song_count", "album_count"):
+                connection.execute(text(f'ALTER TABLE "Genres" DROP COLUMN "{column}"'))
+            connection.execute(
+                text(
+                    "INSERT INTO \"Albums\" (id, name, total_tracks) VALUES (1, 'X', 5)"
+                )
+            )
+            connection.execute(
+                text("INSERT INTO \"Genres\" (id, name) VALUES (1, 'Rock')")
+            )
+            for id, duration in ((1, 100), (2, 50)):
+                connection.execute(
+                    text(
+                        'INSERT INTO "Tracks" (id, file_path, file_size, type, title, '
+                        "album_id, plays_count, cover, cover_type, bit_rate, "
+                        "bits_per_sample, sample_rate, channels, duration) "
+                        f"VALUES ({id}, '{id}.mp3', 1, 'audio/mpeg', '{id}', 1, 0, "
+                        f"'', '', 128, 16, 44100, 2, {duration})"
+                    )
+                )
+                connection.execute(text(f'INSERT INTO "Genre_Tracks" VALUES (1, {id})'))
+
+        db.upgrade_db()
+
+        with self.engine.connect() as connection:
+            album = connection.execute(
+                text('SELECT total_tracks, duration FROM "Albums"')
+            ).one()
+            genre = connection.execute(
+                text('SELECT song_count, album_count FROM "Genres"')
+            ).one()
+        assert tuple(album) == (2, 150)
+        assert tuple(genre) == (2, 1)
+
+    def test_builds_search_index_for_existing_rows(self):
+        SQLModel.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            db.drop_search_indexes(None, connection)
+            for name in ("insert", "delete", "update"):
+                connection.execute(text(f'DROP TRIGGER "Artists_Search_{name}"'))
+            connection.execute(
+                text("INSERT INTO \"Artists\" (name, album_count) VALUES ('Кино', 0)")
+            )
+
+        db.upgrade_db()
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                text('SELECT rowid FROM "Artists_Search" WHERE name MATCH \'"кин"*\'')
+            ).all()
+        assert rows == [(1,)]
+
+    def test_creates_missing_indexes(self):
+        SQLModel.metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            connection.execute(text('DROP INDEX "ix_Tracks_file_path"'))
+            connection.execute(text('DROP INDEX "ix_Artist_Tracks_track_id_artist_id"'))
+
+        db.upgrade_db()
+
+        indexes = {i["name"] for i in inspect(self.engine).get_indexes("Tracks")}
+        assert "ix_Tracks_file_path" in indexes
+        with self.engine.connect() as connection:
+            plan = connection.execute(
+                text(
+                    'EXPLAIN QUERY PLAN SELECT * FROM "Artist_Tracks" WHERE track_id = 1'
+                )
+            ).all()
+        assert "ix_Artist_Tracks_track_id_artist_id" in str(plan)
+
+    def test_repeated_start_does_not_rewrite_library(self):
+        SQLModel.metadata.create_all(self.engine)
+        with Session(self.engine) as session:
+            session.add(db.Artist(name="The Beatles"))
+            session.commit()
+        db.upgrade_db()
+
+        statements: list[str] = []
+
+        def listener(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", listener)
+        db.upgrade_db()
+        assert not any(s.lstrip().upper().startswith("UPDATE") for s in statements)
+
+        # Указатель перестраивается, когда меняются артикли
+        with patch.object(config, "IGNORED_ARTICLES", []):
+            db.upgrade_db()
+        event.remove(self.engine, "before_cursor_execute", listener)
+        with Session(self.engine) as session:
+            artist = session.exec(select(db.Artist)).one()
+        assert artist.index_letter == "T"
+
+
+class TestSQLiteProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_pragmas_are_applied_on_connect(self):
+        engine = db.create_db_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        with engine.connect() as connection:
+
+            def pragma(name: str):
+                return connection.execute(text(f"PRAGMA {name}")).scalar()
+
+            assert pragma("journal_mode") == "wal"
+            assert pragma("synchronous") == 1
+            assert pragma("temp_store") == 2
+            assert pragma("busy_timeout") == config.SQLITE_BUSY_TIMEOUT_MS
+            assert pragma("cache_size") == -config.SQLITE_CACHE_SIZE_KB
+        engine.dispose()
+
+    def test_tuning_can_be_disabled(self):
+        with patch.object(config, "SQLITE_TUNING", False):
+            engine = db.create_db_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        with engine.connect() as connection:
+            journal_mode = connection.execute(text("PRAGMA journal_mode")).scalar()
+        assert journal_mode == "delete"
+        engine.dispose()
+
+
+class TestAsyncSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{self.tmp_dir.name}/test.db"
+        self.engine = db.create_db_engine(url)
+        SQLModel.metadata.create_all(self.engine)
+        self.async_engine = db.create_async_db_engine(url)
+        self.patch = patch.object(db, "async_engine", self.async_engine)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        asyncio.run(self.async_engine.dispose())
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_reads_through_async_session(self):
+        with Session(self.engine) as session:
+            session.add(db.Artist(name="Кино"))
+            session.commit()
+
+        async def read() -> tuple[str, list[str], list[str]]:
+            sessions = db.get_async_session()
+            session = await anext(sessions)
+            journal_mode = await session.scalar(text("PRAGMA journal_mode"))
+            names = (await session.exec(select(db.Artist.name))).all()
+            found = await db.run_sync(
+                session,
+                lambda session: db_helpers.ArtistDBHelper(session)
+                .get_artists(10, 0, "кин")
+                .items,
+            )
+            await sessions.aclose()
+            return journal_mode, list(names), [a.name for a in found]
+
+        assert asyncio.run(read()) == ("wal", ["Кино"], ["Кино"])
+
+
+if __name__ == "__main__":
+    unittest.main()
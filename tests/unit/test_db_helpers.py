@@ -0,0 +1,446 @@
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import event, update
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from src.app import config
+from src.app import database as db
+from src.app import db_helpers, service_layer
+from src.app.open_subsonic_formatter import OpenSubsonicFormatter
+from src.app.service_layer import RequestType
+
+
+class TestEagerLoading(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.patch = patch.object(db, "engine", self.engine)
+        self.patch.start()
+        self.statements: list[str] = []
+        event.listen(self.engine, "before_cursor_execute", self.count_statement)
+
+        with Session(self.engine) as session:
+            self.user = db.User(login="user", password="", avatar="")
+            session.add(self.user)
+            session.commit()
+            self.user_id = self.user.id
+
+    def tearDown(self):
+        self.patch.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def add_library(self, artists: int, start: int = 0) -> None:
+        with Session(self.engine) as session:
+            rock = db.Genre(name=f"Rock {start}")
+            pop = db.Genre(name=f"Pop {start}")
+            playlist = db.Playlist(
+                name=f"Playlist {start}",
+                user_id=self.user_id,
+                total_tracks=0,
+                create_date="",
+            )
+            for a in range(start, start + artists):
+                artist = db.Artist(name=f"Artist {a}")
+                guest = db.Artist(name=f"Guest {a}")
+                for b in range(2):
+                    album = db.Album(
+                        name=f"Album {a}-{b}",
+                        total_tracks=3,
+                        year=str(2000 + b),
+                        cover=None,
+                        artists=[artist],
+                    )
+                    for position in range(1, 4):
+                        track = db.Track(
+                            file_path=f"/music/{a}/{b}/{position}.mp3",
+                            file_size=1,
+                            type="audio/mpeg",
+                            title=f"Song {a}-{b}-{position}",
+                            album=album,
+                            album_position=position,
+                            year=album.year,
+                            plays_count=0,
+                            cover=b"",
+                            cover_type="",
+                            bit_rate=128,
+                            bits_per_sample=16,
+                            sample_rate=44100,
+                            channels=2,
+                            duration=60,
+                            artists=[artist, guest] if position == 1 else [artist],
+                            genres=[rock, pop] if b == 0 else [rock],
+                        )
+                        playlist.playlist_tracks.append(
+                            db.PlaylistTrack(track=track, added_at="")
+                        )
+                    session.add(album)
+            session.add(playlist)
+            session.flush()
+            db.update_album_aggregates(session)
+            db.update_library_aggregates(session)
+            session.commit()
+
+    def count_queries(self, request) -> int:
+        self.statements.clear()
+        with Session(self.engine) as session:
+            request(session)
+        return len(self.statements)
+
+    def test_query_count_does_not_grow_with_library(self):
+        requests = {
+            "getIndexes": lambda session: service_layer.IndexService(
+                session
+            ).get_indexes_artists(),
+            "search3": lambda session: service_layer.SearchService(session).search3(
+                "", 100, 0, 100, 0, 100, 0
+            ),
+            "search2": lambda session: service_layer.SearchService(session).search2(
+                "a", 100, 0, 100, 0, 100, 0
+            ),
+            "getArtist": lambda session: service_layer.ArtistService(
+                session
+            ).get_artist_by_id(1),
+            "getAlbum": lambda session: service_layer.AlbumService(
+                session
+            ).get_album_by_id(1),
+            "getAlbumList": lambda session: service_layer.AlbumService(
+                session
+            ).get_album_list(RequestType.BY_ARTIST, size=100),
+            "getRandomSongs": lambda session: service_layer.TrackService(
+                session
+            ).get_random_songs(size=100),
+            "getSongsByGenre": lambda session: service_layer.TrackService(
+                session
+            ).get_songs_by_genre("Rock 0", count=100),
+            "getGenres": lambda session: service_layer.GenreService(
+                session
+            ).get_genres(),
+            "getPlaylist": lambda session: service_layer.PlaylistService(
+                session
+            ).get_playlist(1),
+            "getPlaylists": lambda session: service_layer.PlaylistService(
+                session
+            ).get_playlists(),
+        }
+
+        self.add_library(artists=2)
+        small = {name: self.count_queries(r) for name, r in requests.items()}
+        self.add_library(artists=10, start=2)
+        large = {name: self.count_queries(r) for name, r in requests.items()}
+
+        assert small == large
+        assert max(large.values()) <= 12
+
+    def test_list_queries_do_not_load_covers(self):
+        self.add_library(artists=2)
+        self.count_queries(
+            lambda session: service_layer.SearchService(session).search3(
+                "", 0, 0, 0, 0, 0, 0
+            )
+        )
+        self.count_queries(
+            lambda session: service_layer.PlaylistService(session).get_playlist(1)
+        )
+        assert not any(re.search(r"\.cover\b", s) for s in self.statements)
+
+    def test_album_list_by_artist_and_year(self):
+        self.add_library(artists=3)
+        with Session(self.engine) as session:
+            service = service_layer.AlbumService(session)
+
+            albums = service.get_album_list(
+                RequestType.BY_ARTIST, size=3, offset=1
+            ).items
+            assert [a.name for a in albums] == ["Album 0-1", "Album 1-0", "Album 1-1"]
+            assert albums[0].song_count == 3
+            assert albums[0].duration == 180
+
+            albums = service.get_album_list(
+                RequestType.BY_YEAR, size=2, from_year="2001", to_year="2001"
+            ).items
+            assert [a.name for a in albums] == ["Album 0-1", "Album 1-1"]
+
+            albums = service.get_album_list(
+                RequestType.BY_YEAR, size=2, from_year="2001", to_year="1999"
+            ).items
+            assert [a.name for a in albums] == ["Album 2-1", "Album 1-1"]
+
+    def test_aggregate_durations_are_whole_seconds(self):
+        self.add_library(artists=1)
+        with Session(self.engine) as session:
+            # mutagen возвращает длительность в дробных секундах
+            session.execute(update(db.Track).values(duration=60.4))
+            db.update_album_aggregates(session)
+            db.update_library_aggregates(session)
+            session.commit()
+
+            album = service_layer.AlbumService(session).get_album_by_id(1)
+            playlist = service_layer.PlaylistService(session).get_playlist(1)
+            assert album is not None and playlist is not None
+            assert type(album.duration) is int and album.duration == 181
+            assert type(playlist.duration) is int and playlist.duration == 362
+
+    def test_cursor_pages_match_offset_pages(self):
+        self.add_library(artists=4)
+        with Session(self.engine) as session:
+            service = service_layer.AlbumService(session)
+            for type, years in (
+                (RequestType.BY_NAME, {}),
+                (RequestType.BY_ARTIST, {}),
+                (RequestType.BY_YEAR, {"from_year": "2001", "to_year": "2000"}),
+            ):
+                expected = [
+                    a.id for a in service.get_album_list(type, size=100, **years).items
+                ]
+                ids: list[int] = []
+                cursor = None
+                while True:
+                    page = service.get_album_list(type, size=3, cursor=cursor, **years)
+                    ids.extend(a.id for a in page.items)
+                    if page.next_cursor is None:
+                        break
+                    cursor = page.next_cursor
+                assert ids == expected, type
+
+            albums = [a.id for a in service.get_sorted_artist_albums(1, 1).items]
+            page = service.get_sorted_artist_albums(1, 1)
+            page = service.get_sorted_artist_albums(1, 1, cursor=page.next_cursor)
+            assert albums + [a.id for a in page.items] == [
+                a.id for a in service.get_sorted_artist_albums(1, 2).items
+            ]
+
+    def test_cursor_page_does_not_shift(self):
+        self.add_library(artists=2, start=5)
+        with Session(self.engine) as session:
+            service = service_layer.AlbumService(session)
+            first = service.get_album_list(RequestType.BY_NAME, size=2)
+            assert [a.name for a in first.items] == ["Album 5-0", "Album 5-1"]
+
+            # Новые альбомы в начале списка не сдвигают следующую страницу
+            self.add_library(artists=1)
+            second = service.get_album_list(
+                RequestType.BY_NAME, size=2, cursor=first.next_cursor
+            )
+            assert [a.name for a in second.items] == ["Album 6-0", "Album 6-1"]
+            third = service.get_album_list(
+                RequestType.BY_NAME, size=2, cursor=second.next_cursor
+            )
+            assert third.items == [] and third.next_cursor is None
+
+            with self.assertRaises(ValueError):
+                service.get_album_list(RequestType.BY_NAME, size=2, cursor="bad")
+
+    def test_random_songs_are_filtered(self):
+        self.add_library(artists=2)
+        with Session(self.engine) as session:
+            service = service_layer.TrackService(session)
+            songs = service.get_random_songs(size=100, genre="Pop 0", to_year="2000")
+            assert len(songs) == 6
+            assert all(song.year == 2000 for song in songs)
+            assert {song.artist for song in songs} >= {"Artist 0, Guest 0"}
+
+
+class TestArtistIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+        self.add_artists(
+            ["Кино", "The Beatles", "Beyoncé", "ДДТ", "2Pac", "Ёлка", "Thelonious Monk"]
+        )
+        self.session.add(
+            db.Album(name="Help!", total_tracks=0, artists=[self.artist("The Beatles")])
+        )
+        self.session.flush()
+        db.update_library_aggregates(self.session)
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def add_artists(self, names: list[str]) -> None:
+        for name in names:
+            self.session.add(db.Artist(name=name))
+        self.session.flush()
+
+    def artist(self, name: str) -> db.Artist:
+        return self.session.exec(select(db.Artist).where(db.Artist.name == name)).one()
+
+    def index(self) -> list[tuple[str, list[str]]]:
+        indexes = service_layer.IndexService(self.session).get_indexes_artists()
+        return [(i.name, [a.name for a in i.artist]) for i in indexes.artist_index]
+
+    def test_buckets_skip_ignored_articles(self):
+        assert self.index() == [
+            ("#", ["2Pac"]),
+            ("B", ["The Beatles", "Beyoncé"]),
+            ("T", ["Thelonious Monk"]),
+            ("Д", ["ДДТ"]),
+            ("Е", ["Ёлка"]),
+            ("К", ["Кино"]),
+        ]
+        indexes = service_layer.IndexService(self.session).get_indexes_artists()
+        beatles = OpenSubsonicFormatter.format_indexes(indexes)["index"][1]["artist"]
+        assert beatles[0]["albumCount"] == 1
+        assert beatles[0]["coverArt"] == f"ar-{self.artist('The Beatles').id}"
+        assert "albumCount" in beatles[1] and "coverArt" not in beatles[1]
+
+    def test_new_artists_are_added_incrementally(self):
+        statements: list[str] = []
+        event.listen(
+            self.engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: statements.append(statement),
+        )
+        self.add_artists(["Aerosmith"])
+        statements.clear()
+        db.update_artist_index(self.session)
+        assert any("sort_name IS NULL" in s for s in statements)
+        assert self.index()[1] == ("A", ["Aerosmith"])
+
+    def test_rebuild_follows_ignored_articles(self):
+        with patch.object(config, "IGNORED_ARTICLES", []):
+            db.update_artist_index(self.session, rebuild=True)
+        assert self.index()[2] == ("T", ["The Beatles", "Thelonious Monk"])
+
+    def test_indexes_list_files_at_folder_root(self):
+        folders = [db.MusicFolder(name=name, path=f"/music/{name}") for name in "ab"]
+        self.session.add_all(folders)
+        album = db.Album(name="Singles", total_tracks=4, cover=None)
+        for path in ("a/1.mp3", "a/Artist/2.mp3", "b/3.mp3", "ab/4.mp3"):
+            self.session.add(
+                db.Track(
+                    file_path=f"/music/{path}",
+                    file_size=1,
+                    type="audio/mpeg",
+                    title=path,
+                    album=album,
+                    plays_count=0,
+                    cover=b"",
+                    cover_type="",
+                    bit_rate=128,
+                    bits_per_sample=16,
+                    sample_rate=44100,
+                    channels=2,
+                    duration=60,
+                )
+            )
+        self.session.commit()
+
+        def childs(music_folder_id: int | None, with_childs: bool = True):
+            indexes = service_layer.IndexService(self.session).get_indexes_artists(
+                music_folder_id, with_childs=with_childs
+            )
+            formatted = OpenSubsonicFormatter.format_indexes(indexes)
+            return [t["title"] for t in formatted.get("child", [])]
+
+        assert childs(folders[0].id) == ["a/1.mp3"]
+        assert childs(None) == ["a/1.mp3", "b/3.mp3"]
+        # getArtists отдаёт только исполнителей
+        assert childs(None, with_childs=False) == []
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.session = Session(self.engine)
+        self.album = db.Album(name="Ёлочные игрушки", total_tracks=0, cover=None)
+        self.session.add(db.Artist(name="Beyoncé"))
+        self.session.add(db.Artist(name="ДДТ"))
+        for id, title in enumerate(
+            ["Звезда по имени Солнце", "Солнце", "Кукушка", "Ёжик в тумане"], 1
+        ):
+            self.session.add(
+                db.Track(
+                    id=id,
+                    file_path=f"/music/{id}.mp3",
+                    file_size=1,
+                    type="audio/mpeg",
+                    title=title,
+                    album=self.album,
+                    plays_count=0,
+                    cover=b"",
+                    cover_type="",
+                    bit_rate=128,
+                    bits_per_sample=16,
+                    sample_rate=44100,
+                    channels=2,
+                    duration=60,
+                )
+            )
+        self.session.commit()
+        self.helper = db_helpers.TrackDBHelper(self.session)
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def titles(self, query: str) -> list[str]:
+        page = self.helper.get_tracks(10, 0, filter_title=query)
+        return [t.title for t in page.items]
+
+    def test_folds_case_diacritics_and_yo(self):
+        assert self.titles("СОЛН") == ["Солнце", "Звезда по имени Солнце"]
+        assert self.titles("ежик") == ["Ёжик в тумане"]
+        assert self.titles("ёжик ТУМ") == ["Ёжик в тумане"]
+        assert self.titles("олнце") == []
+
+        artists = db_helpers.ArtistDBHelper(self.session)
+        assert [a.name for a in artists.get_artists(10, 0, "beyonce").items] == [
+            "Beyoncé"
+        ]
+        assert [a.name for a in artists.get_artists(10, 0, "ддт").items] == ["ДДТ"]
+        albums = db_helpers.AlbumDBHelper(self.session)
+        assert [a.name for a in albums.get_albums(10, 0, "елоч").items] == [
+            "Ёлочные игрушки"
+        ]
+
+    def test_index_follows_changes(self):
+        track = self.session.get(db.Track, 3)
+        track.title = "Группа крови"
+        self.session.delete(self.session.get(db.Track, 2))
+        self.session.commit()
+
+        assert self.titles("кукушка") == []
+        assert self.titles("крови") == ["Группа крови"]
+        assert self.titles("солнце") == ["Звезда по имени Солнце"]
+
+    def test_punctuation_falls_back_to_substring(self):
+        assert self.titles("по имени") == ["Звезда по имени Солнце"]
+        assert self.titles("!") == []
+        assert self.titles("%") == []
+        assert self.titles("_") == []
+
+        self.session.get(db.Track, 3).title = "100% Кукушка"
+        self.session.commit()
+        assert self.titles("%") == ["100% Кукушка"]
+
+    def test_search_cursor(self):
+        first = self.helper.get_tracks(1, 0, filter_title="солнце")
+        second = self.helper.get_tracks(1, 0, "солнце", cursor=first.next_cursor)
+        assert [t.title for t in first.items + list(second.items)] == self.titles(
+            "солнце"
+        )
+        assert second.next_cursor is not None
+        third = self.helper.get_tracks(1, 0, "солнце", cursor=second.next_cursor)
+        assert third.items == []
+
+        # Ранги поиска меняются вместе с индексом, старый курсор отвергается
+        self.session.get(db.Track, 3).title = "Солнце мое"
+        self.session.commit()
+        with self.assertRaises(ValueError):
+            self.helper.get_tracks(1, 0, "солнце", cursor=first.next_cursor)
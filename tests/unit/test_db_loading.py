@@ -0,0 +1,457 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlmodel import Session, SQLModel, create_engine, select, text
+
+from src.app import config
+from src.app import database as db
+from src.app import db_helpers
+from src.app import db_loading
+from tests.unit.audio_files import write_flac, write_mp3
+
+
+class TestScanAudioFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = self.tmp_dir.name
+        os.makedirs(os.path.join(self.dir, "album"))
+        write_mp3(os.path.join(self.dir, "one.mp3"), "One", artists="A; B")
+        write_mp3(os.path.join(self.dir, "album", "two.mp3"), "Two")
+        write_flac(os.path.join(self.dir, "album", "three.flac"), "Three")
+        with open(os.path.join(self.dir, "cover.txt"), "w") as f:
+            f.write("not audio")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_serial_scan(self):
+        result = db_loading.scan_directory_for_audio_files(self.dir)
+        assert sorted(a.title for a in result) == ["One", "Three", "Two"]
+
+    def test_unsupported_file_is_skipped(self):
+        path = os.path.join(self.dir, "cover.txt")
+        assert db_loading.parse_audio_file(path) is None
+
+    def test_parallel_scan_matches_serial(self):
+        serial = db_loading.scan_directory_for_audio_files(self.dir)
+        parallel = list(db_loading.scan_audio_files(self.dir, workers=2))
+
+        def key(a: db_loading.AudioInfo) -> tuple:
+            return (a.file_path, a.title, tuple(a.artists), a.type, a.cover)
+
+        assert sorted(map(key, parallel)) == sorted(map(key, serial))
+
+    def test_stream_matches_serial(self):
+        paths = db_loading.iter_audio_file_paths(self.dir)
+        streamed = list(db_loading.stream_audio_files(paths, workers=2, queue_size=1))
+        assert sorted(a.title for a in streamed) == ["One", "Three", "Two"]
+
+    def test_stream_merges_sources(self):
+        sources = [
+            [os.path.join(self.dir, "one.mp3")],
+            db_loading.iter_audio_file_paths(os.path.join(self.dir, "album")),
+        ]
+        streamed = list(db_loading.stream_audio_file_sources(sources, workers=2))
+        assert sorted(a.title for a in streamed) == ["One", "Three", "Two"]
+
+    def test_stream_is_bounded_by_queue(self):
+        taken: list[str] = []
+
+        def file_paths():
+            for i in range(100):
+                taken.append(str(i))
+                yield os.path.join(self.dir, "one.mp3")
+
+        stream = db_loading.stream_audio_files(file_paths(), workers=1, queue_size=2)
+        next(stream)
+        time.sleep(0.5)
+        assert len(taken) <= 5
+        stream.close()
+
+    def test_stream_raises_producer_errors(self):
+        def file_paths():
+            yield os.path.join(self.dir, "one.mp3")
+            raise OSError("disk is gone")
+
+        with self.assertRaises(OSError):
+            list(db_loading.stream_audio_files(file_paths(), workers=1))
+
+
+class TestIncrementalScan(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self.tmp_dir.name, "tracks")
+        os.makedirs(self.dir)
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.engine_patch = patch.object(db, "engine", self.engine)
+        self.engine_patch.start()
+
+        write_mp3(self.path("one.mp3"), "One", album="First", genres="Rock")
+        write_mp3(self.path("two.mp3"), "Two", album="Second", genres="Jazz")
+
+    def tearDown(self):
+        self.engine_patch.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def scan(self, full_scan: bool = False) -> dict[str, db.Track]:
+        db_loading.scan_and_load([self.dir], workers=1, full_scan=full_scan)
+        with Session(self.engine) as session:
+            return {t.title: t for t in session.exec(select(db.Track)).all()}
+
+    def test_unchanged_tracks_keep_ids_and_plays(self):
+        tracks = self.scan()
+        with Session(self.engine) as session:
+            track = session.get(db.Track, tracks["One"].id)
+            track.plays_count = 5
+            session.commit()
+
+        write_mp3(self.path("three.mp3"), "Three", album="First")
+        rescanned = self.scan()
+
+        assert sorted(rescanned) == ["One", "Three", "Two"]
+        assert rescanned["One"].id == tracks["One"].id
+        assert rescanned["One"].plays_count == 5
+        assert rescanned["Two"].id == tracks["Two"].id
+
+    def test_changed_file_is_reparsed_in_place(self):
+        tracks = self.scan()
+        os.remove(self.path("two.mp3"))
+        write_mp3(self.path("two.mp3"), "Two (Remaster)", album="Second")
+        os.utime(self.path("two.mp3"), ns=(1, 1))
+
+        rescanned = self.scan()
+
+        assert "Two" not in rescanned
+        assert rescanned["Two (Remaster)"].id == tracks["Two"].id
+
+    def test_vanished_files_are_removed(self):
+        self.scan()
+        os.remove(self.path("two.mp3"))
+
+        rescanned = self.scan()
+
+        assert list(rescanned) == ["One"]
+        with Session(self.engine) as session:
+            albums = session.exec(select(db.Album.name)).all()
+            genres = session.exec(select(db.Genre.name)).all()
+        assert albums == ["First"]
+        assert genres == ["Rock"]
+
+    def test_vanished_files_update_aggregates(self):
+        tracks = self.scan()
+        with Session(self.engine) as session:
+            user = db.User(login="user", password="", avatar="")
+            session.add(user)
+            session.commit()
+            playlist = db_helpers.PlaylistDBHelper(session).create_playlist(
+                "Mix", [tracks["One"].id, tracks["Two"].id], user.id
+            )
+            assert playlist.total_tracks == 2
+            assert playlist.duration == int(
+                tracks["One"].duration + tracks["Two"].duration
+            )
+
+        os.remove(self.path("two.mp3"))
+        self.scan()
+
+        with Session(self.engine) as session:
+            playlist = session.exec(select(db.Playlist)).one()
+            assert playlist.total_tracks == 1
+            assert playlist.duration == int(tracks["One"].duration)
+            genre = session.exec(select(db.Genre)).one()
+            assert (genre.name, genre.song_count, genre.album_count) == ("Rock", 1, 1)
+
+    def test_cancelled_scan_keeps_vanished_tracks(self):
+        self.scan()
+        os.remove(self.path("two.mp3"))
+        write_mp3(self.path("three.mp3"), "Three")
+        cancelled = threading.Event()
+        cancelled.set()
+
+        completed = db_loading.scan_and_load([self.dir], workers=1, cancelled=cancelled)
+
+        assert not completed
+        with Session(self.engine) as session:
+            titles = session.exec(select(db.Track.title)).all()
+        assert sorted(titles) == ["One", "Two"]
+        assert db_loading.get_scan_checkpoints() == []
+
+    def test_interrupted_full_scan_resumes_after_checkpoint(self):
+        self.scan()
+        write_mp3(self.path("one.mp3"), "One (New)", album="First")
+        write_mp3(self.path("two.mp3"), "Two (New)", album="Second")
+        with Session(self.engine) as session:
+            session.add(
+                db.ScanCheckpoint(
+                    directory=self.dir,
+                    full_scan=True,
+                    last_path=self.path("one.mp3"),
+                    started_at="2024-01-01T00:00:00",
+                )
+            )
+            session.commit()
+
+        rescanned = self.scan()
+
+        assert sorted(rescanned) == ["One", "Two (New)"]
+        assert db_loading.get_scan_checkpoints() == []
+
+    def test_walk_order_matches_checkpoint_order(self):
+        os.makedirs(os.path.join(self.dir, "a", "b"))
+        write_mp3(self.path("z.mp3"), "Z")
+        write_mp3(os.path.join(self.dir, "a", "b", "x.mp3"), "X")
+        write_mp3(os.path.join(self.dir, "a", "y.mp3"), "Y")
+
+        paths = list(db_loading.iter_audio_file_paths(self.dir))
+
+        assert paths == sorted(
+            paths, key=lambda path: db_loading.walk_order_key(self.dir, path)
+        )
+        assert paths[-2:] == [
+            os.path.join(self.dir, "a", "y.mp3"),
+            os.path.join(self.dir, "a", "b", "x.mp3"),
+        ]
+
+    def test_scan_status_counts_files(self):
+        with open(self.path("broken.mp3"), "wb") as f:
+            f.write(b"not audio")
+        with open(self.path("cover.txt"), "w") as f:
+            f.write("not audio")
+
+        self.scan()
+        status = db_loading.scanStatus.to_dict()
+        assert not status["scanning"]
+        assert status["discovered"] == 3
+        assert (status["parsed"], status["skipped"], status["failed"]) == (2, 0, 1)
+        assert status["count"] == 2
+        assert status["bytesRead"] == sum(
+            os.path.getsize(self.path(name)) for name in ("one.mp3", "two.mp3")
+        )
+        assert set(status["phaseTimes"]) == {"walk", "parse", "thumbnail", "dbWrite"}
+
+        self.scan()
+        status = db_loading.scanStatus.to_dict()
+        assert (status["parsed"], status["skipped"], status["failed"]) == (0, 2, 1)
+        assert status["count"] == 2
+
+
+class TestMusicFolders(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.first = os.path.join(self.tmp_dir.name, "first")
+        self.second = os.path.join(self.tmp_dir.name, "second")
+        os.makedirs(self.first)
+        os.makedirs(self.second)
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.patches = [
+            patch.object(db, "engine", self.engine),
+            patch.object(config, "MUSIC_DIRECTORIES", [self.first, self.second]),
+        ]
+        for p in self.patches:
+            p.start()
+
+        write_mp3(os.path.join(self.first, "one.mp3"), "One", artists="A", album="X")
+        write_mp3(os.path.join(self.second, "two.mp3"), "Two", artists="B", album="Y")
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def folder_ids(self) -> dict[str, int]:
+        with Session(self.engine) as session:
+            return {
+                folder.name: folder.id
+                for folder in db_helpers.MusicFolderDBHelper(
+                    session
+                ).get_all_music_folders()
+            }
+
+    def test_tracks_are_filtered_by_folder(self):
+        db_loading.scan_and_load([self.first, self.second], workers=1)
+        folder_ids = self.folder_ids()
+
+        with Session(self.engine) as session:
+            tracks = db_helpers.TrackDBHelper(session)
+            albums = db_helpers.AlbumDBHelper(session)
+            artists = db_helpers.ArtistDBHelper(session)
+            assert [
+                t.title
+                for t in tracks.get_all_tracks(music_folder_id=folder_ids["first"])
+            ] == ["One"]
+            assert [
+                a.name
+                for a in albums.get_all_albums(music_folder_id=folder_ids["second"])
+            ] == ["Y"]
+            assert [
+                a.name
+                for a in artists.get_all_artists(music_folder_id=folder_ids["second"])
+            ] == ["B"]
+            assert len(tracks.get_all_tracks()) == 2
+
+    def test_scanning_one_folder_keeps_others(self):
+        db_loading.scan_and_load([self.first, self.second], workers=1)
+        os.remove(os.path.join(self.first, "one.mp3"))
+
+        db_loading.scan_and_load([self.second], workers=1)
+
+        with Session(self.engine) as session:
+            titles = session.exec(select(db.Track.title)).all()
+        assert sorted(titles) == ["One", "Two"]
+
+    def test_removed_folder_loses_its_tracks(self):
+        db_loading.scan_and_load([self.first, self.second], workers=1)
+
+        with patch.object(config, "MUSIC_DIRECTORIES", [self.second]):
+            db_loading.scan_and_load([self.second], workers=1)
+
+        with Session(self.engine) as session:
+            titles = session.exec(select(db.Track.title)).all()
+            artists = session.exec(select(db.Artist.name)).all()
+        assert titles == ["Two"]
+        assert artists == ["B"]
+        assert list(self.folder_ids()) == ["second"]
+
+
+class TestAudioDataLoader(unittest.TestCase):
+    TABLES = [
+        "Tracks",
+        "Artists",
+        "Albums",
+        "Genres",
+        "CustomTags",
+        "Artist_Tracks",
+        "Artist_Albums",
+        "Genre_Albums",
+        "Genre_Tracks",
+        "CustomTag_Tracks",
+    ]
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        write_mp3(
+            self.path("1.mp3"),
+            "One",
+            artists="A; B",
+            album="X",
+            genres="Rock, Pop",
+            custom_tags={"mood": "sad"},
+        )
+        write_mp3(self.path("2.mp3"), "Two", artists="C", album="X", genres="Rock")
+        write_mp3(self.path("3.mp3"), "Three", artists="D", album="Y", album_artist="E")
+        write_mp3(self.path("4.mp3"), "Four", artists="F", album="Z", album_artist="A")
+        write_mp3(
+            self.path("5.mp3"),
+            "Five",
+            artists="G",
+            album="Z",
+            album_artist="Various Artists",
+        )
+        write_flac(self.path("6.flac"), "Six", artists=["H", "A"], album="Y")
+        self.audio_infos = [
+            db_loading.parse_audio_file(self.path(name))
+            for name in sorted(os.listdir(self.tmp_dir.name))
+        ]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name)
+
+    def create_engine(self, name: str):
+        engine = create_engine(f"sqlite:///{self.tmp_dir.name}/{name}.db")
+        SQLModel.metadata.create_all(engine)
+        return engine
+
+    def dump(self, engine) -> dict[str, list[str]]:
+        with engine.connect() as connection:
+            return {
+                table: sorted(
+                    repr(row)
+                    for row in connection.execute(text(f'SELECT * FROM "{table}"'))
+                )
+                for table in self.TABLES
+            }
+
+    def test_batches_produce_same_rows_as_per_file_loading(self):
+        per_file = self.create_engine("per_file")
+        with patch.object(db, "engine", per_file):
+            for audio_info in self.audio_infos:
+                db_loading.load_audio_data(audio_info)
+
+        batched = self.create_engine("batched")
+        with Session(batched) as session:
+            with db_loading.AudioDataLoader(
+                session, batch_size=4, preload=True
+            ) as loader:
+                for audio_info in self.audio_infos:
+                    loader.add(audio_info)
+
+        assert self.dump(batched) == self.dump(per_file)
+        per_file.dispose()
+        batched.dispose()
+
+    def test_reloading_file_replaces_links(self):
+        engine = self.create_engine("reload")
+        with patch.object(db, "engine", engine):
+            for audio_info in self.audio_infos:
+                db_loading.load_audio_data(audio_info)
+            write_mp3(self.path("1.mp3"), "One", artists="B", album="X", genres="Jazz")
+            db_loading.load_audio_data(db_loading.parse_audio_file(self.path("1.mp3")))
+
+        with Session(engine) as session:
+            track = session.exec(select(db.Track).where(db.Track.title == "One")).one()
+            assert [a.name for a in track.artists] == ["B"]
+            assert [g.name for g in track.genres] == ["Jazz"]
+            assert track.custom_tags == []
+        engine.dispose()
+
+    def test_loader_maintains_aggregates(self):
+        engine = self.create_engine("aggregates")
+        with patch.object(db, "engine", engine):
+            for audio_info in self.audio_infos:
+                db_loading.load_audio_data(audio_info)
+
+        with Session(engine) as session:
+            album = session.exec(select(db.Album).where(db.Album.name == "X")).one()
+            tracks = session.exec(
+                select(db.Track).where(db.Track.album_id == album.id)
+            ).all()
+            assert album.total_tracks == 2
+            assert album.duration == int(sum(t.duration for t in tracks))
+            assert sorted(g.name for g in album.genres) == ["Pop", "Rock"]
+
+            genres = {g.name: g for g in session.exec(select(db.Genre)).all()}
+            assert (genres["Rock"].song_count, genres["Rock"].album_count) == (2, 1)
+            artist = session.exec(select(db.Artist).where(db.Artist.name == "A")).one()
+            assert artist.album_count == 2
+
+        with patch.object(db, "engine", engine):
+            write_mp3(self.path("1.mp3"), "One", artists="B", album="Y", genres="Jazz")
+            db_loading.load_audio_data(db_loading.parse_audio_file(self.path("1.mp3")))
+
+        with Session(engine) as session:
+            albums = {a.name: a for a in session.exec(select(db.Album)).all()}
+            assert albums["X"].total_tracks == 1
+            assert albums["Y"].total_tracks == 3
+            assert [g.name for g in albums["X"].genres] == ["Rock"]
+            genres = {g.name: g for g in session.exec(select(db.Genre)).all()}
+            assert (genres["Rock"].song_count, genres["Pop"].song_count) == (1, 0)
+            assert (genres["Jazz"].song_count, genres["Jazz"].album_count) == (1, 1)
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    unittest.main()
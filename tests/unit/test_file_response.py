@@ -0,0 +1,144 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from src.app.file_response import (
+    ZEROCOPY_EXTENSION,
+    TrackFileResponse,
+    parse_range,
+)
+
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        assert parse_range("bytes=0-99", 1000) == [(0, 99)]
+        assert parse_range("bytes=900-", 1000) == [(900, 999)]
+        assert parse_range("bytes=-100", 1000) == [(900, 999)]
+        # Конец за пределами файла обрезается, суффикс больше файла — весь файл
+        assert parse_range("bytes=900-5000", 1000) == [(900, 999)]
+        assert parse_range("bytes=-5000", 1000) == [(0, 999)]
+        # Диапазоны сортируются, соседние и пересекающиеся склеиваются
+        assert parse_range("bytes=500-599, 0-9,10-19,550-700", 1000) == [
+            (0, 19),
+            (500, 700),
+        ]
+
+    def test_unsatisfiable_and_malformed(self):
+        # Недостижимые диапазоны отбрасываются, остальные отдаются
+        assert parse_range("bytes=2000-3000,0-0", 1000) == [(0, 0)]
+        assert parse_range("bytes=2000-3000", 1000) == []
+        assert parse_range("bytes=-0", 1000) == []
+        assert parse_range("bytes=0-", 0) == []
+        for header in ("bytes=5-1", "bytes=-", "bytes=a-b", "items=0-1", "bytes="):
+            assert parse_range(header, 1000) is None
+        assert parse_range("bytes=" + ",".join(["0-1"] * 17), 1000) is None
+
+
+class TestTrackFileResponse(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "track.flac")
+        self.content = bytes(range(256)) * 40
+        with open(self.path, "wb") as f:
+            f.write(self.content)
+
+        app = FastAPI()
+        app.get("/stream")(lambda: TrackFileResponse(self.path, "audio/flac"))
+        app.get("/missing")(lambda: TrackFileResponse(self.path + ".mp3"))
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_full_file(self):
+        response = self.client.get("/stream")
+        assert response.status_code == 200
+        assert response.content == self.content
+        assert response.headers["content-type"] == "audio/flac"
+        assert response.headers["content-length"] == str(len(self.content))
+        assert response.headers["accept-ranges"] == "bytes"
+        assert self.client.get("/missing").status_code == 404
+
+    def test_single_range(self):
+        response = self.client.get("/stream", headers={"Range": "bytes=100-199"})
+        assert response.status_code == 206
+        assert response.content == self.content[100:200]
+        assert response.headers["content-range"] == f"bytes 100-199/{len(self.content)}"
+        assert response.headers["content-length"] == "100"
+        assert response.headers["content-type"] == "audio/flac"
+
+        response = self.client.get("/stream", headers={"Range": "bytes=20000-"})
+        assert response.status_code == 416
+        assert response.headers["content-range"] == f"bytes */{len(self.content)}"
+
+    def test_multiple_ranges(self):
+        response = self.client.get("/stream", headers={"Range": "bytes=0-9,-10"})
+        assert response.status_code == 206
+        content_type = response.headers["content-type"]
+        assert content_type.startswith("multipart/byteranges; boundary=")
+        boundary = content_type.split("=")[1]
+        assert response.headers["content-length"] == str(len(response.content))
+
+        size = len(self.content)
+        parts = response.content.split(f"--{boundary}".encode())
+        assert parts[0] == b"\r\n" and parts[-1] == b"--\r\n"
+        assert parts[1:-1] == [
+            (
+                f"\r\nContent-Type: audio/flac\r\n"
+                f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n"
+            ).encode()
+            + self.content[start : end + 1]
+            + b"\r\n"
+            for start, end in ((0, 9), (size - 10, size - 1))
+        ]
+
+    def test_if_range(self):
+        full = self.client.get("/stream")
+        for validator in (full.headers["etag"], full.headers["last-modified"]):
+            response = self.client.get(
+                "/stream", headers={"Range": "bytes=0-9", "If-Range": validator}
+            )
+            assert response.status_code == 206
+
+        # Файл изменился — отдаётся целиком
+        for validator in ('"other"', "W/" + full.headers["etag"]):
+            response = self.client.get(
+                "/stream", headers={"Range": "bytes=0-9", "If-Range": validator}
+            )
+            assert response.status_code == 200
+            assert response.content == self.content
+
+    def test_zerocopy_extension(self):
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(10)
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "headers": [(b"range", b"bytes=10-19")],
+            "extensions": {ZEROCOPY_EXTENSION: {}},
+        }
+        asyncio.run(TrackFileResponse(self.path, "audio/flac")(scope, receive, send))
+
+        assert messages[0]["status"] == 206
+        assert messages[1]["type"] == ZEROCOPY_EXTENSION
+        assert (messages[1]["offset"], messages[1]["count"]) == (10, 10)
+        assert messages[1]["file"].name == self.path
+        assert messages[2] == {
+            "type": "http.response.body",
+            "body": b"",
+            "more_body": False,
+        }
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import asyncio
+import tempfile
+from datetime import datetime, timezone
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel
+
+from src.app import database as db
+from src.app import db_helpers, service_layer
+from src.app.conditional_get import ConditionalGetMiddleware
+from src.app.response_cache import response_cache
+from src.app.scrobble_buffer import Scrobble, write_scrobbles
+
+
+class TestLibraryVersion(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{self.tmp_dir.name}/test.db"
+        self.engine = db.create_db_engine(url)
+        SQLModel.metadata.create_all(self.engine)
+        self.async_engine = db.create_async_db_engine(url)
+        self.patch = patch.object(db, "async_engine", self.async_engine)
+        self.patch.start()
+        response_cache.invalidate()
+
+    def tearDown(self):
+        self.patch.stop()
+        asyncio.run(self.async_engine.dispose())
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def version(self) -> int:
+        with Session(self.engine) as session:
+            return db.get_library_state(session).version
+
+    def test_changes_bump_version(self):
+        assert self.version() == 0
+        with Session(self.engine) as session:
+            session.add(db.User(login="user", password="", avatar=""))
+            session.add(db.Artist(name="Кино"))
+            session.commit()
+        assert self.version() == 1
+
+        with Session(self.engine) as session:
+            db_helpers.FavouriteDBHelper(session).star_artist(1, 1)
+            db_helpers.FavouriteDBHelper(session).star_artist(1, 1)
+        assert self.version() == 2
+
+        # Массовая вставка, как при сканировании
+        with Session(self.engine) as session:
+            session.execute(insert(db.Genre), [{"name": "Рок"}])
+            session.commit()
+        assert self.version() == 3
+
+    def test_unchanged_transactions_keep_version(self):
+        with Session(self.engine) as session:
+            session.add(db.Genre(name="Рок"))
+            session.rollback()
+            session.add(
+                db.ScanCheckpoint(directory="/music", full_scan=False, started_at="")
+            )
+            session.commit()
+            session.commit()
+        assert self.version() == 0
+
+    def test_scrobbles_bump_only_plays_version(self):
+        app = FastAPI()
+        app.add_middleware(ConditionalGetMiddleware)
+        app.get("/rest/getGenres")(lambda: "ok")
+        app.get("/rest/getAlbum")(lambda: "ok")
+
+        with Session(self.engine) as session:
+            user = db.User(login="user", password="", avatar="")
+            session.add(user)
+            session.add(
+                db.Track(
+                    file_path="/music/1.mp3",
+                    file_size=1,
+                    type="audio/mpeg",
+                    title="Кукушка",
+                    album=db.Album(name="Черный альбом", total_tracks=1, cover=None),
+                    plays_count=0,
+                    cover=b"",
+                    cover_type="",
+                    bit_rate=128,
+                    bits_per_sample=16,
+                    sample_rate=44100,
+                    channels=2,
+                    duration=60,
+                )
+            )
+            session.commit()
+            user_id = user.id
+        client = TestClient(app)
+        genres = client.get("/rest/getGenres").headers["etag"]
+        album = client.get("/rest/getAlbum").headers["etag"]
+
+        with Session(self.engine) as session:
+            now = datetime.now(timezone.utc)
+            write_scrobbles(session, [Scrobble(1, user_id, now)])
+            session.get(db.User, user_id).password = "secret"
+            session.commit()
+            state = db.get_library_state(session)
+        assert (state.version, state.plays_version) == (1, 1)
+
+        # Меняются только ответы со счётчиками прослушиваний
+        assert client.get("/rest/getGenres").headers["etag"] == genres
+        assert client.get("/rest/getAlbum").headers["etag"] != album
+
+    def test_indexes_if_modified_since(self):
+        with Session(self.engine) as session:
+            session.add(db.Artist(name="Кино"))
+            session.commit()
+            service = service_layer.IndexService(session)
+            indexes = service.get_indexes_artists()
+            assert len(indexes.artist_index) == 1
+
+            since = int(indexes.last_modified.timestamp() * 1000)
+            assert service.get_indexes_artists(None, since).artist_index == []
+            assert len(service.get_indexes_artists(None, since - 1).artist_index) == 1
+
+    def test_conditional_get(self):
+        app = FastAPI()
+        app.add_middleware(ConditionalGetMiddleware)
+        calls: list[str] = []
+
+        @app.get("/rest/getGenres")
+        @app.get("/rest/getAlbumList2")
+        @app.get("/rest/ping")
+        def endpoint() -> str:
+            calls.append("call")
+            return "ok"
+
+        with Session(self.engine) as session:
+            session.add(db.Genre(name="Рок"))
+            session.commit()
+
+        client = TestClient(app)
+        first = client.get("/rest/getGenres")
+        etag = first.headers["etag"]
+        assert first.headers["last-modified"].endswith("GMT")
+
+        cached = client.get("/rest/getGenres", headers={"If-None-Match": etag})
+        assert cached.status_code == 304 and cached.content == b""
+        assert cached.headers["etag"] == etag
+        assert len(calls) == 1
+        since = {"If-Modified-Since": first.headers["last-modified"]}
+        assert client.get("/rest/getGenres", headers=since).status_code == 304
+
+        with Session(self.engine) as session:
+            session.add(db.Genre(name="Поп"))
+            session.commit()
+        changed = client.get("/rest/getGenres", headers={"If-None-Match": etag})
+        assert changed.status_code == 200 and changed.headers["etag"] != etag
+
+        # Случайные списки и эндпоинты вне списка не кешируются
+        random = client.get("/rest/getAlbumList2", params={"type": "random"})
+        assert "etag" not in random.headers
+        assert "etag" not in client.get("/rest/ping").headers
+
+
+if __name__ == "__main__":
+    unittest.main()
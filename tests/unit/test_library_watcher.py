@@ -0,0 +1,105 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import call, patch
+
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from src.app import database as db
+from src.app import library_watcher
+from tests.unit.audio_files import write_mp3
+
+
+@unittest.skipUnless(sys.platform.startswith("linux"), "inotify is Linux only")
+class TestLibraryWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self.tmp_dir.name, "tracks")
+        os.makedirs(self.dir)
+        self.engine = create_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.engine_patch = patch.object(db, "engine", self.engine)
+        self.engine_patch.start()
+
+        self.watcher = library_watcher.LibraryWatcher(
+            self.dir, debounce_seconds=0.2, workers=1
+        )
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        self.watcher.join()
+        self.engine_patch.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def tracks(self) -> dict[str, db.Track]:
+        with Session(self.engine) as session:
+            return {t.file_path: t for t in session.exec(select(db.Track)).all()}
+
+    def wait_for(self, condition) -> dict[str, db.Track]:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            tracks = self.tracks()
+            if condition(tracks):
+                return tracks
+            time.sleep(0.1)
+        self.fail(f"Library was not updated: {list(self.tracks())}")
+
+    def test_new_album_directory_is_loaded(self):
+        album_dir = os.path.join(self.tmp_dir.name, "album")
+        os.makedirs(album_dir)
+        write_mp3(os.path.join(album_dir, "1.mp3"), "One", album="New")
+        write_mp3(os.path.join(album_dir, "2.mp3"), "Two", album="New")
+        shutil.move(album_dir, self.dir)
+
+        tracks = self.wait_for(lambda tracks: len(tracks) == 2)
+        assert {t.title for t in tracks.values()} == {"One", "Two"}
+
+    def test_rename_and_delete_update_tracks_in_place(self):
+        old_path = os.path.join(self.dir, "old.mp3")
+        new_path = os.path.join(self.dir, "new.mp3")
+        write_mp3(old_path, "Song")
+        track_id = self.wait_for(lambda tracks: old_path in tracks)[old_path].id
+
+        os.rename(old_path, new_path)
+        tracks = self.wait_for(lambda tracks: new_path in tracks)
+        assert list(tracks) == [new_path]
+        assert tracks[new_path].id == track_id
+
+        os.remove(new_path)
+        self.wait_for(lambda tracks: len(tracks) == 0)
+
+    def test_rename_to_non_audio_file_removes_track(self):
+        path = os.path.join(self.dir, "song.mp3")
+        write_mp3(path, "Song")
+        self.wait_for(lambda tracks: path in tracks)
+
+        os.rename(path, path + ".bak")
+        self.wait_for(lambda tracks: len(tracks) == 0)
+
+        os.rename(path + ".bak", path)
+        self.wait_for(lambda tracks: path in tracks)
+
+    def test_overflow_rescan_goes_through_scan_manager(self):
+        watcher = library_watcher.LibraryWatcher(self.dir, workers=1)
+        self.addCleanup(watcher.inotify.close)
+        watcher.rescan_required = True
+
+        # Пока идёт другое сканирование, пересканирование откладывается
+        with patch.object(
+            library_watcher.scan_manager, "start", side_effect=[False, True]
+        ) as start:
+            watcher.apply_pending()
+            assert watcher.rescan_required
+            watcher.apply_pending()
+
+        assert not watcher.rescan_required
+        assert start.call_args_list == [call([self.dir], 1)] * 2
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+import asyncio
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlmodel import Session, SQLModel
+
+from src.app import database as db
+from src.app import db_helpers
+from src.app.response_cache import (
+    CachedResponse,
+    ResponseCache,
+    ResponseCacheMiddleware,
+    response_cache,
+)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{self.tmp_dir.name}/test.db"
+        self.engine = db.create_db_engine(url)
+        SQLModel.metadata.create_all(self.engine)
+        self.async_engine = db.create_async_db_engine(url)
+        self.patch = patch.object(db, "async_engine", self.async_engine)
+        self.patch.start()
+        self.statements: list[str] = []
+        event.listen(self.async_engine.sync_engine, "before_cursor_execute", self.count)
+
+        with Session(self.engine) as session:
+            session.add(db.User(login="user", password="", avatar=""))
+            session.add(db.Artist(name="Кино"))
+            session.commit()
+
+    def tearDown(self):
+        self.patch.stop()
+        asyncio.run(self.async_engine.dispose())
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_lru_eviction_within_budget(self):
+        cache = ResponseCache(max_bytes=250)
+        cache.state = db.initial_library_state()
+        for name in "abc":
+            cache.put(
+                ("/rest/getAlbum", name, 0, 0), CachedResponse(200, [], b"x" * 100)
+            )
+        assert cache.get(("/rest/getAlbum", "a", 0, 0)) is None
+        assert cache.get(("/rest/getAlbum", "b", 0, 0)) is not None
+
+        cache.put(("/rest/getAlbum", "d", 0, 0), CachedResponse(200, [], b"x" * 100))
+        # b прочитан последним, поэтому вытеснен c
+        assert cache.get(("/rest/getAlbum", "c", 0, 0)) is None
+        assert cache.get(("/rest/getAlbum", "b", 0, 0)) is not None
+        # Ответ старой версии не сохраняется, слишком большой тоже
+        cache.put(("/rest/getAlbum", "e", 1, 0), CachedResponse(200, [], b""))
+        cache.put(("/rest/getAlbum", "f", 0, 0), CachedResponse(200, [], b"x" * 300))
+        assert cache.stats() == {
+            "hits": 2,
+            "misses": 2,
+            "entries": 2,
+            "sizeBytes": 200,
+            "maxBytes": 250,
+        }
+
+    def test_middleware_serves_repeated_requests_from_memory(self):
+        response_cache.invalidate()
+        before = response_cache.stats()
+        app = FastAPI()
+        app.add_middleware(ResponseCacheMiddleware)
+        calls: list[str] = []
+
+        @app.get("/rest/getArtists")
+        @app.get("/rest/getAlbumList2")
+        def endpoint() -> int:
+            calls.append("call")
+            return len(calls)
+
+        client = TestClient(app)
+        first = client.get("/rest/getArtists", params={"u": "a", "p": "1", "x": 1})
+        self.statements.clear()
+        # Другой клиент с тем же запросом получает тот же ответ без запросов к БД
+        second = client.get("/rest/getArtists", params={"x": 1, "u": "b", "c": "app"})
+        assert second.json() == first.json() == 1
+        assert second.headers["content-type"] == "application/json"
+        assert self.statements == []
+        assert client.get("/rest/getArtists", params={"x": 2}).json() == 2
+
+        with Session(self.engine) as session:
+            db_helpers.FavouriteDBHelper(session).star_artist(1, 1)
+        assert client.get("/rest/getArtists", params={"x": 1}).json() == 3
+
+        # Случайные списки и списки по истории прослушиваний не кешируются
+        for type in ("random", "random", "recent", "recent"):
+            client.get("/rest/getAlbumList2", params={"type": type, "u": "a"})
+        assert len(calls) == 7
+        after = response_cache.stats()
+        assert after["hits"] - before["hits"] == 1
+        assert after["misses"] - before["misses"] == 3
+
+    def test_plays_invalidate_only_play_count_responses(self):
+        response_cache.invalidate()
+        app = FastAPI()
+        app.add_middleware(ResponseCacheMiddleware)
+        calls: list[str] = []
+
+        @app.get("/rest/getArtists")
+        @app.get("/rest/getAlbum")
+        def endpoint() -> int:
+            calls.append("call")
+            return len(calls)
+
+        client = TestClient(app)
+        assert client.get("/rest/getArtists").json() == 1
+        assert client.get("/rest/getAlbum").json() == 2
+
+        with Session(self.engine) as session:
+            session.info["plays_changed"] = True
+            session.commit()
+        assert client.get("/rest/getArtists").json() == 1
+        assert client.get("/rest/getAlbum").json() == 3
+        assert client.get("/rest/getAlbum").json() == 3
+
+
+if __name__ == "__main__":
+    unittest.main()
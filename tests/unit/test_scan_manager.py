@@ -0,0 +1,54 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+from src.app import db_loading
+from src.app.scan_manager import ScanManager
+
+
+class TestScanManager(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.calls: list[tuple] = []
+
+        def scan_and_load(directory_path, workers, full_scan, cancelled):
+            self.calls.append((directory_path, full_scan))
+            while not self.release.is_set() and not cancelled.is_set():
+                self.release.wait(0.01)
+            db_loading.scanStatus.finish()
+            return not cancelled.is_set()
+
+        self.scan_patch = patch.object(db_loading, "scan_and_load", scan_and_load)
+        self.scan_patch.start()
+        self.manager = ScanManager()
+
+    def tearDown(self):
+        self.release.set()
+        self.manager.wait()
+        self.scan_patch.stop()
+
+    def test_duplicate_start_joins_running_scan(self):
+        assert self.manager.start("music")
+        assert not self.manager.start("music", full_scan=True)
+        assert db_loading.scanStatus.to_dict()["scanning"]
+
+        self.release.set()
+        self.manager.wait()
+
+        assert self.calls == [("music", False)]
+        assert not self.manager.is_running()
+        assert self.manager.start("music", full_scan=True)
+
+    def test_cancel_stops_running_scan(self):
+        assert not self.manager.cancel()
+        self.manager.start("music")
+
+        assert self.manager.cancel()
+        self.manager.wait(5)
+
+        assert not self.manager.is_running()
+        assert not db_loading.scanStatus.to_dict()["scanning"]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from sqlmodel import Session, SQLModel, select
+
+from src.app import database as db
+from src.app.scrobble_buffer import ScrobbleBuffer
+from src.app.service_layer import AlbumService, RequestType
+
+
+class TestScrobbleBuffer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = db.create_db_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        self.patch = patch.object(db, "engine", self.engine)
+        self.patch.start()
+        # Интервал большой, чтобы записью управлял сам тест
+        self.buffer = ScrobbleBuffer(flush_interval=3600, max_size=10000)
+
+        with Session(self.engine) as session:
+            user = db.User(login="user", password="", avatar="")
+            other = db.User(login="other", password="", avatar="")
+            session.add_all([user, other])
+            for a in range(3):
+                album = db.Album(name=f"Album {a}", total_tracks=2, cover=None)
+                for position in range(1, 3):
+                    session.add(
+                        db.Track(
+                            file_path=f"/music/{a}/{position}.mp3",
+                            file_size=1,
+                            type="audio/mpeg",
+                            title=f"Song {a}-{position}",
+                            album=album,
+                            album_position=position,
+                            plays_count=0,
+                            cover=b"",
+                            cover_type="",
+                            bit_rate=128,
+                            bits_per_sample=16,
+                            sample_rate=44100,
+                            channels=2,
+                            duration=60,
+                        )
+                    )
+            session.commit()
+            self.user_id = user.id
+            self.other_id = other.id
+
+    def tearDown(self):
+        self.buffer.stop()
+        self.patch.stop()
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def plays(self) -> dict[int, int]:
+        with Session(self.engine) as session:
+            tracks = session.exec(select(db.Track)).all()
+            return {t.id: t.plays_count for t in tracks if t.plays_count > 0}
+
+    def test_flush_increments_counters_and_writes_history(self):
+        utc = timezone.utc
+        self.buffer.add(1, self.user_id, datetime(2024, 1, 1, tzinfo=utc))
+        # Время хранится в UTC независимо от часового пояса клиента и сервера
+        moscow = timezone(timedelta(hours=3))
+        self.buffer.add(1, self.user_id, datetime(2024, 1, 2, 3, tzinfo=moscow))
+        self.buffer.add(3, self.user_id, datetime(2024, 1, 3, tzinfo=utc))
+        # Прослушивание удалённого трека пропускается
+        self.buffer.add(100, self.user_id)
+        assert self.plays() == {}
+
+        assert self.buffer.flush() == 4
+        assert self.buffer.pending_count() == 0
+        assert self.plays() == {1: 2, 3: 1}
+        with Session(self.engine) as session:
+            history = session.exec(
+                select(db.PlayHistory.track_id, db.PlayHistory.played_at)
+            ).all()
+        assert sorted(history) == [
+            (1, datetime(2024, 1, 1)),
+            (1, datetime(2024, 1, 2)),
+            (3, datetime(2024, 1, 3)),
+        ]
+
+    def test_concurrent_scrobbles_are_not_lost(self):
+        def play() -> None:
+            for _ in range(100):
+                self.buffer.add(2, self.user_id)
+
+        threads = [threading.Thread(target=play) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        self.buffer.flush()
+        for thread in threads:
+            thread.join()
+        self.buffer.stop()
+
+        assert self.plays() == {2: 400}
+
+    def test_full_buffer_is_written_in_background(self):
+        self.buffer.max_size = 3
+        for _ in range(3):
+            self.buffer.add(1, self.user_id)
+        for _ in range(500):
+            if self.buffer.pending_count() == 0 and self.plays():
+                break
+            threading.Event().wait(0.01)
+        assert self.plays() == {1: 3}
+
+    def test_frequent_and_recent_albums(self):
+        for track_id, day in ((1, 1), (3, 2), (4, 3), (5, 4), (6, 5), (5, 6)):
+            played_at = datetime(2024, 1, day, tzinfo=timezone.utc)
+            self.buffer.add(track_id, self.user_id, played_at)
+        # Прослушивания другого пользователя в списки не попадают
+        for _ in range(5):
+            self.buffer.add(1, self.other_id, datetime(2024, 2, 1, tzinfo=timezone.utc))
+        self.buffer.flush()
+
+        with Session(self.engine) as session:
+            service = AlbumService(session)
+            frequent = service.get_album_list(
+                RequestType.FREQUENT, size=10, user_id=self.user_id
+            ).items
+            assert [a.name for a in frequent] == ["Album 2", "Album 1", "Album 0"]
+            recent = service.get_album_list(
+                RequestType.RECENT, size=2, user_id=self.user_id
+            )
+            assert [a.name for a in recent.items] == ["Album 2", "Album 1"]
+            rest = service.get_album_list(
+                RequestType.RECENT,
+                size=2,
+                cursor=recent.next_cursor,
+                user_id=self.user_id,
+            )
+            assert [a.name for a in rest.items] == ["Album 0"]
+
+            other = service.get_album_list(
+                RequestType.RECENT, size=10, user_id=self.other_id
+            ).items
+            assert [a.name for a in other] == ["Album 0"]
+            assert service.get_album_list(RequestType.FREQUENT, size=10) is None
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlmodel import Session, SQLModel
+
+from src.app import config
+from src.app import database as db
+from src.app import db_helpers, service_layer, sql_stats
+
+
+class TestQueryStats(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.engine = db.create_db_engine(f"sqlite:///{self.tmp_dir.name}/test.db")
+        SQLModel.metadata.create_all(self.engine)
+        with Session(self.engine) as session:
+            for name in ("Кино", "ДДТ"):
+                session.add(db.Artist(name=name))
+            session.commit()
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.tmp_dir.cleanup()
+
+    def test_counts_queries_of_current_request(self):
+        with sql_stats.track_queries() as stats:
+            with Session(self.engine) as session:
+                service_layer.ArtistService(session).get_artist_by_id(1)
+        assert stats.count > 0
+        assert stats.total_ms >= stats.slowest_ms > 0
+        assert "Artists" in stats.slowest_statement
+
+        # Запросы вне отслеживаемого запроса не учитываются
+        with Session(self.engine) as session:
+            db_helpers.ArtistDBHelper(session).get_artist_by_id(1)
+        assert sql_stats.current_stats.get() is None
+
+    def test_slow_query_log_names_helper(self):
+        with patch.object(config, "SLOW_QUERY_MS", 0.000001):
+            with self.assertLogs(sql_stats.logger, "WARNING") as logs:
+                with Session(self.engine) as session:
+                    db_helpers.ArtistDBHelper(session).get_artist_by_id(1)
+        assert "src.app.db_helpers.ArtistDBHelper.get_artist_by_id" in logs.output[0]
+
+    def test_debug_headers(self):
+        app = FastAPI()
+        app.add_middleware(sql_stats.QueryStatsMiddleware)
+
+        def get_session():
+            with Session(self.engine) as session:
+                yield session
+
+        @app.get("/artists")
+        def artists(session: Session = Depends(get_session)) -> int:
+            helper = db_helpers.ArtistDBHelper(session)
+            return len(helper.get_artists(10, 0).items) + len(
+                helper.get_artists(10, 0, "кин").items
+            )
+
+        client = TestClient(app)
+        assert "x-db-query-count" not in client.get("/artists").headers
+        with patch.object(config, "SQL_DEBUG_HEADERS", True):
+            response = client.get("/artists")
+        assert response.json() == 3
+        assert int(response.headers["x-db-query-count"]) >= 2
+        assert float(response.headers["x-db-time-ms"]) > 0
+        assert "SELECT" in response.headers["x-db-slowest-query"]
+
+
+if __name__ == "__main__":
+    unittest.main()
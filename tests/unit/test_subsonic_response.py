@@ -0,0 +1,73 @@
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from fastapi.responses import JSONResponse
+
+from src.app import dto
+from src.app import subsonic_response
+from src.app.open_subsonic_formatter import OpenSubsonicFormatter
+from src.app.subsonic_response import SubsonicResponse
+
+
+def make_response() -> SubsonicResponse:
+    created = datetime(2024, 5, 6, 7, 8, 9, 123456)
+    starred = datetime(2024, 5, 6, 7, 8, 9, tzinfo=timezone(timedelta(hours=3)))
+    artist = dto.ArtistItem(1, 'Кино "Группа крови"', starred=starred)
+    track = dto.Track(
+        1,
+        "Tab\tnew\nline \x1f   🎸 \\ /",
+        album="Ёлочные игрушки",
+        year=1988,
+        created=created,
+        starred=None,
+        artists=[artist],
+        genres=[dto.GenreItem("Рок")],
+    )
+    album = dto.Album(1, "Album", 1, 60, datetime(2024, 1, 1), tracks=[track])
+    playlist = dto.Playlist(1, "Playlist", 1, 60, created, created, public=True)
+    rsp = SubsonicResponse()
+    rsp.data["searchResult3"] = OpenSubsonicFormatter.format_combination(
+        [dto.Artist(1, "Кино", albums=[album])],
+        [album],
+        [track],
+        [playlist],
+        next_song_cursor="eyJ9",
+    )
+    rsp.data["indexes"] = OpenSubsonicFormatter.format_indexes(
+        dto.Indexes(created, ["The"], shortcuts=[dto.Artist(2, "ДДТ")])
+    )
+    return rsp
+
+
+class TestSubsonicResponse(unittest.TestCase):
+    def test_dates_are_encoded_as_before(self):
+        content = {"subsonic-response": make_response().data}
+        # Раньше форматтер сам переводил даты в строки
+        legacy = json.loads(
+            subsonic_response.dumps_json(content).decode(),
+        )
+        assert legacy["subsonic-response"]["searchResult3"]["song"][0]["created"] == (
+            "2024-05-06T07:08:09.123456"
+        )
+        assert JSONResponse(legacy).body == subsonic_response.dumps_json(content)
+
+    @unittest.skipIf(subsonic_response.orjson is None, "orjson is not installed")
+    def test_orjson_output_is_identical(self):
+        content = {"subsonic-response": make_response().data}
+        assert subsonic_response.dumps_orjson(content) == (
+            subsonic_response.dumps_json(content)
+        )
+
+    def test_response_uses_configured_encoder(self):
+        body = make_response().to_json_rsp().body
+        assert body == subsonic_response.dumps_json(
+            {"subsonic-response": make_response().data}
+        )
+        assert subsonic_response.get_encoder("unknown") is (
+            subsonic_response.dumps_json
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()